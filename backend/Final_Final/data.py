@@ -3,13 +3,16 @@ import os
 import music21 as m21
 import json
 
+from training.corpus import WindowDataset, load_corpus, windows
+
 path = r"D:\test"
 durations = [0.5,0.75,0.25,1,1.5,2,3,4]
 timestep = 0.25
 sequence_length = 128
-single_path = 'single_song.txt'
-import os
+single_path = os.path.join(os.path.dirname(__file__), 'single_song.txt')
 map_path = os.path.join(os.path.dirname(__file__), 'map.json')
+# separates consecutive songs in single_song.txt
+song_end = ['\\'] * sequence_length
 
 '''load songfiles using music21'''
 def loadfiles(path, max_limit=-1):
@@ -21,66 +24,72 @@ def loadfiles(path, max_limit=-1):
           songs.append(song)
     return songs
 
+'''check a song only uses the allowed durations'''
+def acceptable(song,durations):
+  return all(note.duration.quarterLength in durations for note in song.flatten().notesAndRests)
+
 '''filter the songs based on durations'''
 def filter(songs,durations):
-  
-  for song in songs:
-    for note in song.flatten().notesAndRests:
-      if note.duration.quarterLength not in durations:
-        songs.remove(song)
-        break
-  return songs
-        
-'''converting the into C/A keys, 24 keys->2''' 
+  return [song for song in songs if acceptable(song,durations)]
+
+'''converting a song into C/A keys, 24 keys->2'''
+def transpose_song(song):
+    # get key from the song
+    parts = song.getElementsByClass(m21.stream.Part)
+    measures_part0 = parts[0].getElementsByClass(m21.stream.Measure)
+    key = measures_part0[0][4]
+
+    # estimate key using music21
+    if not isinstance(key, m21.key.Key):
+        key = song.analyze("key")
+
+    # get interval for transposition. E.g., Bmaj -> Cmaj
+    if key.mode == "major":
+        interval = m21.interval.Interval(key.tonic, m21.pitch.Pitch("C"))
+    elif key.mode == "minor":
+        interval = m21.interval.Interval(key.tonic, m21.pitch.Pitch("A"))
+
+    # transpose song by calculated interval
+    return song.transpose(interval)
+
+'''transpose every song, see transpose_song'''
 def transpose(songs):
-    tranposed_songs = []
-    for song in songs:
-      # get key from the song
-      parts = song.getElementsByClass(m21.stream.Part)
-      measures_part0 = parts[0].getElementsByClass(m21.stream.Measure)
-      key = measures_part0[0][4]
-
-      # estimate key using music21
-      if not isinstance(key, m21.key.Key):
-          key = song.analyze("key")
-
-      # get interval for transposition. E.g., Bmaj -> Cmaj
-      if key.mode == "major":
-          interval = m21.interval.Interval(key.tonic, m21.pitch.Pitch("C"))
-      elif key.mode == "minor":
-          interval = m21.interval.Interval(key.tonic, m21.pitch.Pitch("A"))
-
-      # transpose song by calculated interval
-      tranposed_song = song.transpose(interval)
-      tranposed_songs.append(tranposed_song)
-    return tranposed_songs
-  
-'''encode the symbols for pitch and duration '''
+    return [transpose_song(song) for song in songs]
+
+'''encode the symbols for pitch and duration of one song'''
+def encode_song(song,timestep):
+  encoded_song = []
+  for event in song.flatten().notesAndRests:
+
+    if isinstance(event,m21.note.Note):
+      symbol = event.pitch.midi
+    if isinstance(event,m21.note.Rest):
+      symbol = 'R'
+
+    steps = int(event.duration.quarterLength/timestep)
+    for step in range(steps):
+      if step==0:
+        encoded_song.append(symbol)
+      else:
+        encoded_song.append('_')
+  return list(map(str,encoded_song))
+
+'''encode the symbols for pitch and duration, each song followed by sequence_length end tokens'''
 def encoding(songs,timestep):
-  single_song = ''
-  for song in songs:
-    encoded_song = []
-    for event in song.flatten().notesAndRests:
-      
-      if isinstance(event,m21.note.Note):
-        symbol = event.pitch.midi
-      if isinstance(event,m21.note.Rest):
-        symbol = 'R'
-        
-      steps = int(event.duration.quarterLength/timestep)
-      for step in range(steps):
-        if step==0:
-          encoded_song.append(symbol)
-        else:
-          encoded_song.append('_')
-          
-    encoded_song = " ".join(map(str,encoded_song))
-    single_song = single_song + encoded_song + " " + sequence_length * "\ "
-  single_song = single_song[:-1]
-  
+  # joined once at the end, concatenating song by song is quadratic in the corpus size
+  single_song = " ".join(" ".join(encode_song(song,timestep) + song_end) for song in songs)
+
   with open(single_path,'w') as f:
       f.write(single_song)
   return single_song
+
+'''parse, filter, transpose and encode one kern file, for the preprocessing workers'''
+def preprocess_file(file_path,durations=durations,timestep=timestep):
+  song = m21.converter.parse(file_path)
+  if not acceptable(song,durations):
+    return None
+  return encode_song(transpose_song(song),timestep)
+
 '''mapping for str to int'''
 def mapping(single_song):
   dict_map = {}
@@ -93,23 +102,13 @@ def mapping(single_song):
     json.dump(dict_map,f,indent=4)
     
 def training_samples(songs_path=single_path,sequence_length=sequence_length,map_path=map_path):
-  
-  with open(map_path,'r') as f:
-    mapping = json.load(f)
-  with open(songs_path,'r') as f:
-    songs = f.read()
-  # str to int mapping
-  ls = songs.split()
-  mapped_song = []
-  for i in range(len(ls)):
-    mapped_song.append(mapping[ls[i]])
-  
-  inputs = []
-  targets = []
-  for i in range(0,len(mapped_song)-sequence_length):
-    inputs.append(mapped_song[i:i+sequence_length])
-    targets.append(mapped_song[i+sequence_length])
-  return inputs,targets
+  """(inputs, targets) of every window of the corpus, as zero-copy views of its
+  memory-mapped encoding (cached next to songs_path as .npy)"""
+  return windows(load_corpus(songs_path,map_path),sequence_length)
+
+def training_dataset(songs_path=single_path,sequence_length=sequence_length,map_path=map_path):
+  """WindowDataset over the memory-mapped corpus, windows are sliced per item/batch"""
+  return WindowDataset(load_corpus(songs_path,map_path),sequence_length)
 
 def get_vocabsize(map_path=map_path):
   with open(map_path,'r') as f:
@@ -117,6 +116,7 @@ def get_vocabsize(map_path=map_path):
   return len(mapping)
 
   
+# python -m training.preprocess kern <dir> does the steps below in parallel, with a cache
 # songs = loadfiles(path, 15)
 # print(f"len of songs {len(songs)}")
 # songs = filter(songs,durations)
@@ -1,66 +1,151 @@
-import torch
-import torch.nn as nn
-from Final_Final.data import get_vocabsize
-import json
-import music21 as m21
-
-device = 'cuda' if torch.cuda.is_available() else 'cpu'
-
-class Model(nn.Module):
-  def __init__(self,in_size,vocab_size,hidden_dim,out_notes):
-    super().__init__()
-    self.lstm1 = nn.LSTM(input_size=in_size,hidden_size=hidden_dim,num_layers=1,batch_first=True)
-    self.norm = nn.LayerNorm(hidden_dim)
-    self.drop = nn.Dropout(0.1)
-    
-    self.mlp = nn.Sequential(
-      nn.Linear(hidden_dim,hidden_dim),
-      nn.Dropout(0.1),
-      nn.Linear(hidden_dim,out_notes)
-    )
-    self.embedding = nn.Embedding(vocab_size,hidden_dim)
-  def forward(self,x):
-    x = self.embedding(x)
-    _,(h,_) = self.lstm1(x)
-    x = self.norm(h.squeeze(0))
-    x = self.drop(x)
-    x = self.mlp(h.squeeze(0))
-    return x
-  
-hidden_dim = 256
-vocab_size = get_vocabsize()
-model = Model(hidden_dim,vocab_size,hidden_dim,vocab_size).to(device)
-
-model.load_state_dict(torch.load("Final_Final/model.pth"))
-
-def Malody_Generator(seed,num_steps,sequence_length,temperature):
-
-    with open('Final_Final/map.json','r') as f:
-      mapping = json.load(f)
-      
-    melody = seed.split()
-    seed = '/ ' * sequence_length + seed
-    mapping['/'] = 2
-    seed = seed.split()
-    int_seed = [ mapping[item] for item in seed]
-    
-    for i in range(num_steps):
-        seed = int_seed[-sequence_length:]
-        seed = torch.tensor(seed).to(device)
-        seed = seed.view(1,sequence_length)
-        model.eval()
-        with torch.no_grad():
-            prediction = model(seed)
+from midi_writer import melody_to_midi
+from token_window import TokenWindow
+from vocabulary import Vocabulary
+
+# torch and music21 are imported where they are used, so importing this module
+# stays cheap and side-effect free; call startup() to load the model
+DEFAULT_MODEL_PATH = "Final_Final/model.pth"
+DEFAULT_MAP_PATH = "Final_Final/map.json"
+
+class MelodyGenerator:
+    def __init__(self, model_path, map_path, sequence_length=128, hidden_dim=256):
+        # weights converted to .npz run on numpy_lstm, without importing torch
+        self.numpy = model_path.endswith(".npz")
+        if self.numpy:
+            self.device = 'cpu'
+        else:
+            import torch
+            self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.sequence_length = sequence_length
+        self.hidden_dim = hidden_dim
+
+        # '\\' separates the songs of the training corpus, so it both ends a
+        # generation and pads a seed shorter than the window
+        self.vocab = Vocabulary.load(map_path,pad='\\',end='\\',hold='_')
+        self.vocab.check(model_path)
+        self.mapping = self.vocab.mapping
+        self.reverse_mapping = self.vocab.reverse_mapping
+        self.vocab_size = len(self.vocab)
+
+        if self.numpy:
+          import numpy_lstm
+          self.model = numpy_lstm.NumpyModel.load(model_path)
+        else:
+          from lstm_model import Model
+          self.model = Model(hidden_dim,self.vocab_size,hidden_dim,self.vocab_size).to(self.device)
+          self.model.load_state_dict(torch.load(model_path,map_location=self.device,weights_only=True))
+          self.model.eval()
+
+    def generate(self,seed,num_steps,temperature=1.0,sequence_length=None,stateful=True,generator=None):
+        """Samples up to num_steps tokens after seed, stops early on the end token
+
+        :param seed (str): space separated melody tokens
+        :param stateful (bool): prime the lstm once on the seed window and carry (h,c)
+            forward one token per step, instead of re-running the whole window every step
+        :param generator: rng used for sampling (see rng), makes the output reproducible
+        :return (list of str): seed tokens followed by the generated ones
+        """
+        return seed.split() + list(self.stream(seed,num_steps,temperature,sequence_length,stateful,generator))
+
+    def stream(self,seed,num_steps,temperature=1.0,sequence_length=None,stateful=True,generator=None,
+               stop_at_end=True):
+        """Same sampling as generate, but yields each generated token (str) as soon as it
+        is sampled, stopping the generator early stops the remaining computation
+
+        :param stop_at_end (bool): False never samples the end token, so exactly
+            num_steps tokens come out (long-form generation)
+        """
+        sequence_length = sequence_length or self.sequence_length
+        window = TokenWindow(self.encode_seed(seed,sequence_length),sequence_length)
+        banned = None if stop_at_end else self.vocab.end_id
+        state = None
+
+        for i in range(num_steps):
+            with self._no_grad():
+                if not stateful:
+                    prediction = self.model(self._input(window.view()))
+                elif state is None:
+                    prediction,state = self.model.step(self._input(window.view()))
+                else:
+                    prediction,state = self.model.step(self._input([index]),state)
+            index = self._sample(prediction,temperature,generator,banned)
+            if index == self.vocab.end_id:
+                break
+            if not stateful:
+                window.append(index)
+            yield self.vocab.token(index)
+
+    def _no_grad(self):
+        if self.numpy:
+          import numpy_lstm
+          return numpy_lstm.no_grad()
+        import torch
+        return torch.no_grad()
+
+    def _input(self,ids):
+        """ids (list or int64 array) as a (1, len) model input"""
+        if self.numpy:
+          import numpy as np
+          return np.asarray([ids])
+        import torch
+        return torch.as_tensor(ids,device=self.device).unsqueeze(0)
+
+    def _sample(self,prediction,temperature,generator=None,banned=None):
+        """Samples one id from the logits, never banned (an id) when given"""
+        if banned is not None:
+          prediction = prediction.clone() if hasattr(prediction,"clone") else prediction.copy()
+          prediction[...,banned] = float("-inf")
+        if self.numpy:
+          import numpy_lstm
+          return int(numpy_lstm.sample(numpy_lstm.softmax(prediction / temperature),generator)[0])
+        import torch
         probabilities = torch.softmax(prediction / temperature, dim=-1)
-        index = torch.multinomial(probabilities, num_samples=1).item()
-        gen_note = [k for k, v in mapping.items() if v==index][0]
-        
-        if gen_note == "\\":
-            break
-        int_seed.append(index)
-        melody.append(gen_note)
-        
-    return melody
+        return torch.multinomial(probabilities, num_samples=1, generator=generator).item()
+
+    def rng(self,seed):
+        """Seeded sampling rng for generate/stream and the batch scheduler"""
+        if self.numpy:
+          import numpy as np
+          return np.random.default_rng(seed)
+        import torch
+        return torch.Generator(device=self.device).manual_seed(seed)
+
+    @property
+    def end_id(self):
+        return self.vocab.end_id
+
+    def encode_seed(self,seed,sequence_length=None):
+        """Maps a seed string to the ids of its window, left-padded with the pad id"""
+        sequence_length = sequence_length or self.sequence_length
+        ids = self.vocab.encode(seed.split())[-sequence_length:].tolist()
+        return [self.vocab.pad_id] * (sequence_length - len(ids)) + ids
+
+    def decode(self,ids):
+        return self.vocab.decode(ids)
+
+    def warmup(self,num_steps=8):
+        """Runs a short generation so the first real request doesn't pay for lazy init"""
+        self.generate(seed_dict['seed1'],num_steps)
+
+melody_generator = None
+
+def startup(model_path=DEFAULT_MODEL_PATH, map_path=DEFAULT_MAP_PATH, warmup=True):
+    """Loads the module-level MelodyGenerator used by Malody_Generator and warms it up,
+    later calls return the already loaded one"""
+    global melody_generator
+    if melody_generator is None:
+        melody_generator = MelodyGenerator(model_path,map_path)
+        if warmup:
+            melody_generator.warmup()
+    return melody_generator
+
+def Malody_Generator(seed,num_steps,sequence_length,temperature,stateful=True):
+    """Samples num_steps tokens after seed with the module-level MelodyGenerator
+
+    :param stateful (bool): prime the lstm once on the seed window and carry (h,c)
+        forward one token per step, instead of re-running the whole window every step
+    """
+    return startup(warmup=False).generate(seed,num_steps,temperature,sequence_length,stateful)
 
 def save_melody(melody, step_duration=0.25, format="midi", file_name="mel.mid"):
     """Converts a melody into a MIDI file
@@ -70,6 +155,13 @@ def save_melody(melody, step_duration=0.25, format="midi", file_name="mel.mid"):
     :param file_name (str): Name of midi file
     :return:
     """
+    if format == "midi":
+        # written directly, same content as music21's writer without building a Stream
+        with open(file_name, "wb") as f:
+            f.write(melody_to_midi(melody, step_duration))
+        return
+
+    import music21 as m21
 
     # create a music21 stream
     stream = m21.stream.Stream()
@@ -121,9 +213,12 @@ seed_dict ={
     'seed8':"_ 62 _ _ _ _ _ 60 _ 60 _ _ _ 55 _"
 }
 
-seed = "_ 67 _ 65 _ 64 _ 62 _ 60 _"
-seed2 = "_ 60 _ _ _ 55 _ _ _ 65 _"
-melody = Malody_Generator(seed2,200,128,1.7)
-print(melody)
-print(len(melody))
-save_melody(melody) 
\ No newline at end of file
+if __name__ == "__main__":
+    # run from backend/ with python -m Final_Final.generator
+    seed = "_ 67 _ 65 _ 64 _ 62 _ 60 _"
+    seed2 = "_ 60 _ _ _ 55 _ _ _ 65 _"
+    melody = Malody_Generator(seed2,200,128,1.7)
+    print(melody)
+    print(len(melody))
+    save_melody(melody)
+ 
\ No newline at end of file
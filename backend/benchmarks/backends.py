@@ -0,0 +1,142 @@
+'''accuracy, latency and memory of the inference backends (eager fp32,
+torchscript, int8 quantized, numpy), run from backend/ with python -m benchmarks.backends
+
+Accuracy is the KL divergence of each backend's next-token distribution from
+the fp32 model's, teacher-forced on sequences the fp32 model generated. Memory is
+the RSS of a fresh process holding one model (without torch for numpy).'''
+import argparse
+import subprocess
+import sys
+import time
+
+import torch
+
+from drum.drum_gen import DrumGenerator
+from Final_Final.generator import MelodyGenerator, seed_dict
+from serving import backends
+
+MODELS = {
+    'melody': (MelodyGenerator, 'Final_Final/model.pth', 'Final_Final/map.json'),
+    'drum': (DrumGenerator, 'drum/model_drum.pth', 'drum/drum_map.json'),
+}
+
+MEMORY_SCRIPT = '''
+from {module} import {cls}
+from serving import backends
+
+model_path = {model_path!r}
+if {backend!r} == "numpy":
+    generator = {cls}(model_path=backends.numpy_weights(model_path), map_path={map_path!r})
+else:
+    generator = {cls}(model_path=model_path, map_path={map_path!r})
+    generator.model = backends.load(generator.model, model_path, {backend!r})
+with generator._no_grad():
+    generator.model.step(generator._input([0] * 128))
+with open("/proc/self/statm") as f:
+    print(int(f.read().split()[1]) * 4096)
+'''
+
+
+class _TorchView:
+    """numpy_lstm model behind the torch step() signature, for the accuracy check"""
+
+    def __init__(self, model):
+        self.model = model
+
+    def step(self, x, state=None):
+        logits, state = self.model.step(x.numpy(), state)
+        return torch.from_numpy(logits), state
+
+
+def sequences(name, generator, count, length):
+    """token id sequences sampled from the fp32 model"""
+    torch.manual_seed(0)
+    if name == 'melody':
+        seeds = list(seed_dict.values())
+        rows = []
+        for i in range(count):
+            seed = seeds[i % len(seeds)]
+            tokens = generator.generate(seed, length)
+            rows.append(generator.encode_seed(seed) + [generator.mapping[t] for t in tokens[len(seed.split()):]])
+        return rows
+    return [generator.generate_sequence(length=length) for _ in range(count)]
+
+
+def kl_divergence(reference, model, rows, prompt_length):
+    """mean and max KL(p_reference || p_model) over every generated position, and the
+    largest absolute logit difference; all 0 when no row is longer than the prompt"""
+    values, max_diff = [], 0.0
+    with torch.no_grad():
+        for row in rows:
+            tokens = torch.tensor(row).view(1, -1)
+            p_logits, p_state = reference.step(tokens[:, :prompt_length])
+            q_logits, q_state = model.step(tokens[:, :prompt_length])
+            for t in range(prompt_length, tokens.shape[1]):
+                p = torch.log_softmax(p_logits, dim=-1)
+                q = torch.log_softmax(q_logits, dim=-1)
+                values.append((p.exp() * (p - q)).sum().item())
+                max_diff = max(max_diff, (p_logits - q_logits).abs().max().item())
+                p_logits, p_state = reference.step(tokens[:, t:t + 1], p_state)
+                q_logits, q_state = model.step(tokens[:, t:t + 1], q_state)
+    if not values:
+        return 0.0, 0.0, max_diff
+    return sum(values) / len(values), max(values), max_diff
+
+
+def step_latency(model, vocab_size, batch, steps):
+    """seconds per stateful step for batch rows"""
+    prompt = torch.randint(0, vocab_size, (batch, 128))
+    tokens = torch.randint(0, vocab_size, (batch, 1))
+    if getattr(model, 'is_numpy', False):
+        prompt, tokens = prompt.numpy(), tokens.numpy()
+    with torch.no_grad():
+        _, state = model.step(prompt)
+        for _ in range(5):
+            model.step(tokens, state)
+        start = time.perf_counter()
+        for _ in range(steps):
+            _, state = model.step(tokens, state)
+    return (time.perf_counter() - start) / steps
+
+
+def memory(name, backend):
+    generator_cls, model_path, map_path = MODELS[name]
+    script = MEMORY_SCRIPT.format(module=generator_cls.__module__, cls=generator_cls.__name__,
+                                  model_path=model_path, map_path=map_path, backend=backend)
+    result = subprocess.run([sys.executable, '-W', 'ignore', '-c', script],
+                            capture_output=True, text=True, check=True)
+    return int(result.stdout.split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', nargs='+', default=list(backends.BACKENDS), choices=backends.BACKENDS)
+    parser.add_argument('--sequences', type=int, default=8)
+    parser.add_argument('--length', type=int, default=128)
+    parser.add_argument('--steps', type=int, default=200)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 32])
+    parser.add_argument('--max-kl', type=float, default=0.05, help='fail when the mean KL exceeds this')
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    for name, (generator_cls, model_path, map_path) in MODELS.items():
+        generator = generator_cls(model_path=model_path, map_path=map_path)
+        reference = generator.model.cpu().eval()
+        rows = sequences(name, generator, args.sequences, args.length)
+        for backend in args.backends:
+            model = backends.load(reference, model_path, backend)
+            checked = _TorchView(model) if backend == 'numpy' else model
+            mean_kl, max_kl, logit_diff = kl_divergence(reference, checked, rows, generator.sequence_length)
+            latencies = ' '.join(
+                f"b{batch}={step_latency(model, generator.vocab_size, batch, args.steps) * 1000:.3f}ms"
+                for batch in args.batch_sizes
+            )
+            rss = memory(name, backend) / 1e6
+            print(f"{name:<6} {backend:<12} KL mean {mean_kl:.2e} max {max_kl:.2e} | "
+                  f"max |dlogit| {logit_diff:.1e} | "
+                  f"step {latencies} | {rss:.0f} MB RSS")
+            assert mean_kl <= args.max_kl, f"{name} {backend} drifted from fp32 (mean KL {mean_kl:.3f})"
+
+
+if __name__ == '__main__':
+    main()
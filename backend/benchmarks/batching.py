@@ -0,0 +1,61 @@
+'''throughput of the micro-batching scheduler against serial generation,
+run from backend/ with python -m benchmarks.batching'''
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from drum.drum_gen import DrumGenerator
+from Final_Final.generator import MelodyGenerator, seed_dict
+from serving.batching import BatchScheduler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=32)
+    parser.add_argument('--length', type=int, default=256)
+    parser.add_argument('--max-batch', type=int, default=32)
+    args = parser.parse_args()
+
+    drums = DrumGenerator(model_path='drum/model_drum.pth', map_path='drum/drum_map.json')
+    melody = MelodyGenerator('Final_Final/model.pth', 'Final_Final/map.json')
+    seeds = list(seed_dict.values())
+
+    def melody_serial(i):
+        seed = seeds[i % len(seeds)]
+        # melody rows may stop early on the end token, so count what was actually sampled
+        return len(melody.generate(seed, args.length)) - len(seed.split())
+
+    def drum_serial(i):
+        drums.generate_sequence(length=args.length)
+        return args.length
+
+    def melody_submit(scheduler, i):
+        return scheduler.submit(melody.encode_seed(seeds[i % len(seeds)]), args.length, end_id=melody.end_id)
+
+    def drum_submit(scheduler, i):
+        return scheduler.submit(drums.seed_ids(), args.length)
+
+    cases = {
+        'melody': (melody, melody_serial, melody_submit),
+        'drum': (drums, drum_serial, drum_submit),
+    }
+    for name, (generator, run_serial, submit) in cases.items():
+        start = time.perf_counter()
+        tokens = sum(run_serial(i) for i in range(args.requests))
+        serial = tokens / (time.perf_counter() - start)
+
+        scheduler = BatchScheduler(lambda: generator.model, max_batch=args.max_batch)
+        scheduler.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.requests) as pool:
+            futures = list(pool.map(lambda i: submit(scheduler, i), range(args.requests)))
+            tokens = sum(len(future.result()) for future in futures)
+        batched = tokens / (time.perf_counter() - start)
+        scheduler.stop()
+
+        print(f"{name:<6} serial {serial:8.1f} tokens/sec | batched {batched:8.1f} tokens/sec "
+              f"| {batched / serial:4.1f}x with {args.requests} concurrent requests")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+'''checks the vectorized corpus encoding and windows against the old list-based
+training samples and times both, on the real corpora and on a synthetic one,
+run from backend/ with python -m benchmarks.corpus'''
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from drum import drum_data
+from Final_Final import data
+from training.corpus import WindowDataset, load_corpus, load_mapping, windows
+
+
+def list_samples(songs_path, map_path, sequence_length):
+    """training_samples as it was: per-token dict lookups and Python list windows"""
+    mapping = load_mapping(map_path)
+    with open(songs_path, 'r') as f:
+        ls = f.read().split()
+    mapped_song = [mapping[token] for token in ls]
+    inputs, targets = [], []
+    for i in range(len(mapped_song) - sequence_length):
+        inputs.append(mapped_song[i:i + sequence_length])
+        targets.append(mapped_song[i + sequence_length])
+    return inputs, targets
+
+
+def measure(fn, setup=lambda: None):
+    """result, seconds and peak traced allocation of fn(), timed and traced in
+    separate runs since tracing slows allocation down"""
+    setup()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    setup()
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def check(name, songs_path, map_path, sequence_length, npy_path, compare=True):
+    def remove_cache():
+        if os.path.exists(npy_path):
+            os.remove(npy_path)
+
+    (inputs, targets), encode_time, encode_peak = measure(
+        lambda: windows(load_corpus(songs_path, map_path, npy_path), sequence_length), remove_cache)
+    _, cached_time, _ = measure(lambda: windows(load_corpus(songs_path, map_path, npy_path), sequence_length))
+    line = (f"{name:<10} {len(targets):>9} windows | encode {encode_time * 1000:8.1f} ms peak "
+            f"{encode_peak / 1e6:7.1f} MB | cached load {cached_time * 1000:6.2f} ms")
+    if compare:
+        (list_inputs, list_targets), list_time, list_peak = measure(
+            lambda: list_samples(songs_path, map_path, sequence_length))
+        assert np.array_equal(inputs, np.array(list_inputs).reshape(-1, sequence_length)), name
+        assert np.array_equal(targets, np.array(list_targets)), name
+        line += f" | lists {list_time * 1000:8.1f} ms peak {list_peak / 1e6:7.1f} MB | identical"
+
+    dataset = WindowDataset(load_corpus(songs_path, map_path, npy_path), sequence_length)
+    train_set, test_set = dataset.split(0.7)
+    batch_inputs, batch_targets = test_set.batch(0, 256)
+    assert len(train_set) + len(test_set) == len(targets)
+    assert np.array_equal(batch_inputs[0], inputs[len(train_set)])
+    assert batch_targets[-1] == dataset[len(train_set) + len(batch_targets) - 1][1]
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tokens', type=int, default=2_000_000, help='size of the synthetic corpus')
+    parser.add_argument('--compare-tokens', type=int, default=200_000,
+                        help='largest synthetic corpus the list version is run on')
+    parser.add_argument('--sequence-length', type=int, default=128)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        check('melody', data.single_path, data.map_path, args.sequence_length,
+              os.path.join(tmp_dir, 'melody.npy'))
+        check('drum', drum_data.SINGLE_SONG_PATH, drum_data.MAP_PATH, args.sequence_length,
+              os.path.join(tmp_dir, 'drum.npy'))
+
+        rng = random.Random(0)
+        tokens = list(load_mapping(data.map_path))
+        synthetic = os.path.join(tmp_dir, 'synthetic.txt')
+        with open(synthetic, 'w') as f:
+            f.write(' '.join(rng.choice(tokens) for _ in range(args.tokens)))
+        check(f'{args.tokens // 1000}k', synthetic, data.map_path, args.sequence_length,
+              os.path.join(tmp_dir, 'synthetic.npy'), compare=args.tokens <= args.compare_tokens)
+        with open(synthetic, 'w') as f:
+            f.write(' '.join(rng.choice(tokens) for _ in range(args.compare_tokens)))
+        check(f'{args.compare_tokens // 1000}k', synthetic, data.map_path, args.sequence_length,
+              os.path.join(tmp_dir, 'synthetic.npy'))
+
+
+if __name__ == '__main__':
+    main()
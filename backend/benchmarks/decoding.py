@@ -0,0 +1,71 @@
+'''compares stateful and sliding-window decoding, run from backend/ with
+python -m benchmarks.decoding'''
+import argparse
+import time
+import torch
+
+from Final_Final import generator as melody
+from drum.drum_gen import DrumGenerator
+
+
+def compare_logits(model, tokens, window, device='cpu'):
+    """Teacher-forces tokens through both decoding modes, returns the max abs logit difference"""
+    tokens = torch.tensor(tokens, device=device).view(1, -1)
+    max_diff = 0.0
+    with torch.no_grad():
+        _, state = model.step(tokens[:, :window])
+        for t in range(window, tokens.shape[1]):
+            windowed = model(tokens[:, t - window + 1:t + 1])
+            stateful, state = model.step(tokens[:, t:t + 1], state)
+            max_diff = max(max_diff, (windowed - stateful).abs().max().item())
+    return max_diff
+
+
+def tokens_per_sec(fn, repeats):
+    """fn runs one generation and returns how many tokens it sampled"""
+    num_tokens = 0
+    start = time.perf_counter()
+    for _ in range(repeats):
+        num_tokens += fn()
+    return num_tokens / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--steps', type=int, default=256)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    drums = DrumGenerator(model_path='drum/model_drum.pth', map_path='drum/drum_map.json')
+    melody_generator = melody.startup(warmup=False)
+    models = {
+        'melody': (melody_generator.model, melody_generator.vocab_size, melody_generator.device),
+        'drum': (drums.model, drums.vocab_size, drums.device),
+    }
+
+    # fixed seed so both modes see the same token stream
+    torch.manual_seed(0)
+    for name, (model, vocab_size, device) in models.items():
+        tokens = torch.randint(0, vocab_size, (128 + args.steps,)).tolist()
+        diff = compare_logits(model, tokens, 128, device)
+        # tests/test_decoding.py checks they agree
+        print(f"{name}: max |logits(window) - logits(stateful)| = {diff:.2e}")
+
+    seed = melody.seed_dict['seed2']
+
+    def run_melody(stateful):
+        generated = melody.Malody_Generator(seed, args.steps, 128, 1.0, stateful=stateful)
+        return len(generated) - len(seed.split())
+
+    def run_drum(stateful):
+        drums.generate_sequence(length=args.steps, stateful=stateful)
+        return args.steps
+
+    for stateful in (False, True):
+        mode = 'stateful' if stateful else 'window'
+        for name, run in (('melody', run_melody), ('drum', run_drum)):
+            rate = tokens_per_sec(lambda: run(stateful), args.repeats)
+            print(f"{name:<6} {mode:>8}: {rate:8.1f} tokens/sec")
+
+if __name__ == '__main__':
+    main()
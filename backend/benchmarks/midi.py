@@ -0,0 +1,86 @@
+'''checks the in-memory MIDI writer against music21 / pretty_midi output and times
+both, run from backend/ with python -m benchmarks.midi'''
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from midi_writer import drum_to_midi, melody_to_midi
+
+
+def music21_melody(melody, path):
+    import music21 as m21
+    stream = m21.stream.Stream()
+    start_symbol, step_counter = None, 1
+    for i, symbol in enumerate(melody):
+        if symbol != "_" or i + 1 == len(melody):
+            if start_symbol is not None:
+                if start_symbol == "R":
+                    stream.append(m21.note.Rest(quarterLength=0.25 * step_counter))
+                else:
+                    stream.append(m21.note.Note(int(start_symbol), quarterLength=0.25 * step_counter))
+                step_counter = 1
+            start_symbol = symbol
+        else:
+            step_counter += 1
+    stream.write("midi", path)
+
+
+def pretty_midi_drums(sequence, reverse_mapping, path, timestep=0.1):
+    import pretty_midi
+    pm = pretty_midi.PrettyMIDI()
+    drums = pretty_midi.Instrument(program=0, is_drum=True)
+    for i, token in enumerate(sequence):
+        if token in reverse_mapping and reverse_mapping[token] != '_':
+            start = i * timestep
+            drums.notes.append(pretty_midi.Note(velocity=100, pitch=int(reverse_mapping[token]),
+                                                start=start, end=start + 0.1))
+    pm.instruments.append(drums)
+    pm.write(path)
+
+
+def compare(name, reference, writer, cases, tmp_dir):
+    path = os.path.join(tmp_dir, f"{name}.mid")
+    reference_time = writer_time = 0.0
+    for case in cases:
+        start = time.perf_counter()
+        reference(case, path)
+        reference_time += time.perf_counter() - start
+        with open(path, "rb") as f:
+            expected = f.read()
+        start = time.perf_counter()
+        written = writer(case)
+        writer_time += time.perf_counter() - start
+        assert written == expected, f"{name}: writer output differs for {case}"
+    print(f"{name:<6} reference {reference_time / len(cases) * 1000:7.2f} ms | writer "
+          f"{writer_time / len(cases) * 1000:6.3f} ms | identical bytes for {len(cases)} sequences")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cases', type=int, default=100)
+    parser.add_argument('--length', type=int, default=256)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with open('Final_Final/map.json') as f:
+        melody_symbols = [s for s in json.load(f) if s not in ("/", "\\")]
+    with open('drum/drum_map.json') as f:
+        reverse_mapping = {i: s for s, i in json.load(f).items()}
+    drum_ids = list(reverse_mapping)
+
+    # "_" is the most common token in both vocabularies
+    melodies = [[rng.choice(melody_symbols + ["_"] * 6) for _ in range(rng.randint(0, args.length))]
+                for _ in range(args.cases)]
+    drums = [[rng.choice(drum_ids) for _ in range(rng.randint(0, args.length))] for _ in range(args.cases)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        compare('melody', music21_melody, melody_to_midi, melodies, tmp_dir)
+        compare('drum', lambda seq, path: pretty_midi_drums(seq, reverse_mapping, path),
+                lambda seq: drum_to_midi(seq, reverse_mapping), drums, tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
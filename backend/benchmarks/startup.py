@@ -0,0 +1,70 @@
+'''cold-start cost: import time of the generator and server modules and the time
+until the server answers its first generation, each measured in a fresh
+interpreter. Run from backend/ with python -m benchmarks.startup (set
+MODEL_BACKEND=numpy to measure the torch-free server)'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+IMPORT_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print(int("torch" in sys.modules))
+'''
+
+READY_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import main
+from fastapi.testclient import TestClient
+imported = time.perf_counter()
+with TestClient(main.app) as client:
+    ready = time.perf_counter()
+    with client.stream("GET", "/generate/stream", params={"model_type": "Drum", "drum_length": 16}) as response:
+        for line in response.iter_lines():
+            if line.startswith("event: done"):
+                break
+    first = time.perf_counter()
+print(json.dumps({"import": imported - start, "startup": ready - imported, "ready": ready - start,
+                  "first_request": first - start, "torch": "torch" in sys.modules}))
+'''
+
+
+def run(script, env):
+    result = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True)
+    return [line for line in result.stdout.split("\n") if line]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--modules', nargs='+', default=['Final_Final.generator', 'drum.drum_gen', 'main'])
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # no fluidsynth is needed to reach the first streamed generation
+    env.setdefault("SYNTH_POOL_SIZE", "0")
+
+    for module in args.modules:
+        times, torch_loaded = [], False
+        for _ in range(args.repeats):
+            lines = run(IMPORT_SCRIPT.format(module=module), env)
+            times.append(float(lines[0]))
+            torch_loaded = lines[1] == "1"
+        print(f"import {module:<22} {statistics.median(times) * 1000:8.1f} ms"
+              f"{' (pulls in torch)' if torch_loaded else ''}")
+
+    timings = [json.loads(run(READY_SCRIPT, env)[-1]) for _ in range(args.repeats)]
+    for key in ("import", "startup", "ready", "first_request"):
+        print(f"server {key:<14} {statistics.median(t[key] for t in timings):8.2f} s")
+    print(f"server backend {env.get('MODEL_BACKEND', 'eager')}, "
+          f"{'torch loaded' if timings[-1]['torch'] else 'torch never imported'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+'''inference benchmark and load test, run from backend/ with
+python -m benchmarks.suite [generation] [render] [load] --output results.json
+
+  generation  per-token latency and tokens/sec of the melody generator (the
+              Malody_Generator path) and DrumGenerator.generate_sequence over
+              sequence lengths, batch sizes (rows decoded together by the
+              BatchScheduler) and torch thread counts
+  render      MIDI serialization, synth rendering and MP3 encoding time per length
+  load        /generate and /audio/{filename} latency percentiles at a given
+              concurrency, against --url or a uvicorn server started for the run
+
+--fake-renderer puts the stand-in fluidsynth and ffmpeg of benchmarks/fakebin on
+PATH and the sine synth in the pool, so the suite runs without either installed.
+Results are written as JSON; --compare old.json prints the change of every metric
+and exits with 1 when one regressed by more than --threshold.'''
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+FAKEBIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fakebin")
+MODELS = ("Melody", "Drum")
+
+
+def percentiles(samples):
+    samples = np.asarray(samples, dtype=float) * 1000
+    if not samples.size:
+        return {}
+    return {"p50_ms": float(np.percentile(samples, 50)), "p95_ms": float(np.percentile(samples, 95)),
+            "p99_ms": float(np.percentile(samples, 99)), "mean_ms": float(samples.mean())}
+
+
+def _registry(backend):
+    from drum.drum_gen import DrumGenerator
+    from Final_Final.generator import MelodyGenerator
+    from serving.registry import ModelRegistry
+    registry = ModelRegistry(backend=backend)
+    registry.register("Melody", MelodyGenerator, "Final_Final/model.pth", "Final_Final/map.json")
+    registry.register("Drum", DrumGenerator, "drum/model_drum.pth", "drum/drum_map.json")
+    registry.load(warmup=True)
+    return registry
+
+
+def _set_threads(threads):
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+
+
+def _prompt(name, generator):
+    from Final_Final.generator import seed_dict
+    return generator.encode_seed(seed_dict["seed2"]) if name == "Melody" else generator.seed_ids()
+
+
+def generation(registry, lengths, batch_sizes, threads, repeats):
+    """rows of per-token latency and tokens/sec. Batch 1 goes through the
+    generators' own sampling loop; larger batches are submitted together to a
+    BatchScheduler. Melody rows ignore the end token so every row has the same length."""
+    from serving.batching import BatchScheduler
+    from Final_Final.generator import seed_dict
+    rows = []
+    # numpy's BLAS threads can't be changed at runtime, only the first count applies
+    thread_counts = threads if registry.backend != "numpy" else threads[:1]
+    for name in MODELS:
+        generator = registry.get(name)
+        for thread_count in thread_counts:
+            _set_threads(thread_count)
+            for length in lengths:
+                for batch in batch_sizes:
+                    elapsed = tokens = steps = 0
+                    for _ in range(repeats):
+                        start = time.perf_counter()
+                        if batch == 1 and name == "Melody":
+                            seed = seed_dict["seed2"]
+                            produced = len(generator.generate(seed, length)) - len(seed.split())
+                            tokens, steps = tokens + produced, steps + produced
+                        elif batch == 1:
+                            generator.generate_sequence(length=length)
+                            tokens, steps = tokens + length, steps + length
+                        else:
+                            scheduler = BatchScheduler(lambda: generator.model, max_batch=batch, window_ms=50)
+                            scheduler.start()
+                            futures = [scheduler.submit(_prompt(name, generator), length) for _ in range(batch)]
+                            produced = [len(future.result()) for future in futures]
+                            scheduler.stop()
+                            tokens, steps = tokens + sum(produced), steps + max(produced)
+                        elapsed += time.perf_counter() - start
+                    rows.append({"model": name, "length": length, "batch": batch, "threads": thread_count,
+                                 "token_latency_ms": elapsed / max(steps, 1) * 1000,
+                                 "tokens_per_sec": tokens / elapsed})
+                    print(f"generation {name:<6} len {length:>5} batch {batch:>3} threads {thread_count:>2} | "
+                          f"{rows[-1]['token_latency_ms']:7.3f} ms/token | {rows[-1]['tokens_per_sec']:9.1f} tokens/sec")
+    return rows
+
+
+async def _render_rows(registry, lengths, repeats, fake):
+    from serving.execution import ExecutionLayer
+    from serving.pipeline import GenerationPipeline
+    from serving.synth_pool import SynthPool
+    from Final_Final.generator import seed_dict
+
+    command = [sys.executable, "-m", "serving.synth_worker", "--soundfont", os.path.abspath("FluidR3_GM.sf2")]
+    synth_pool = SynthPool(1, command + (["--fake"] if fake else []))
+    await synth_pool.start()
+    execution = ExecutionLayer(render_concurrency=1)
+    pipeline = GenerationPipeline(registry, {}, execution, synth_pool=synth_pool)
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name in MODELS:
+                generator = registry.get(name)
+                for length in lengths:
+                    if name == "Melody":
+                        tokens = generator.generate(seed_dict["seed2"], length)
+                    else:
+                        tokens = generator.generate_sequence(length=length)
+                    times = {"midi": 0.0, "synth_pool": 0.0, "fluidsynth_cli": 0.0, "ffmpeg": 0.0}
+                    for _ in range(repeats):
+                        start = time.perf_counter()
+                        midi = await pipeline.midi_bytes(name, tokens)
+                        times["midi"] += time.perf_counter() - start
+
+                        start = time.perf_counter()
+                        pcm = await pipeline.render_pcm(midi)
+                        times["synth_pool"] += time.perf_counter() - start
+
+                        midi_path = os.path.join(tmp_dir, "bench.mid")
+                        with open(midi_path, "wb") as f:
+                            f.write(midi)
+                        start = time.perf_counter()
+                        await pipeline.midi_to_wav(midi_path, os.path.join(tmp_dir, "bench.wav"))
+                        times["fluidsynth_cli"] += time.perf_counter() - start
+
+                        start = time.perf_counter()
+                        await execution.run_subprocess(pipeline.pcm_to_mp3_command(os.path.join(tmp_dir, "bench.mp3")),
+                                                       "FFmpeg", pcm)
+                        times["ffmpeg"] += time.perf_counter() - start
+                    row = {"model": name, "length": length, "tokens": len(tokens)}
+                    row.update({f"{stage}_ms": seconds / repeats * 1000 for stage, seconds in times.items()})
+                    rows.append(row)
+                    print(f"render     {name:<6} len {length:>5} | " + " | ".join(
+                        f"{stage} {row[f'{stage}_ms']:8.2f} ms" for stage in times))
+    finally:
+        await synth_pool.stop()
+        execution.shutdown()
+    return rows
+
+
+def render(registry, lengths, repeats, fake):
+    return asyncio.run(_render_rows(registry, lengths, repeats, fake))
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(env, timeout=120):
+    """uvicorn main:app on a free port, returns (process, base url) once /models answers"""
+    port = _free_port()
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("The server exited during startup")
+        try:
+            urllib.request.urlopen(f"{url}/models", timeout=1).read()
+            return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("The server did not start in time")
+
+
+def _request(url, body=None):
+    """(seconds, status, response bytes)"""
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"} if data else {})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=300) as response:
+            payload, status = response.read(), response.status
+    except urllib.error.HTTPError as e:
+        payload, status = e.read(), e.code
+    except OSError as e:
+        payload, status = str(e).encode(), 0
+    return time.perf_counter() - start, status, payload
+
+
+def load(url, requests, concurrency, model_types, drum_length):
+    """Sends requests POST /generate at concurrency, then GETs the MP3 of each
+    answer, returns latency percentiles, throughput and error counts per endpoint"""
+    def one(i):
+        model_type = model_types[i % len(model_types)]
+        body = {"model_type": model_type, "temperature": 1.0}
+        if model_type == "Drum":
+            body["drum_length"] = drum_length
+        seconds, status, payload = _request(f"{url}/generate", body)
+        result = json.loads(payload) if status == 200 else {}
+        if status != 200 or result.get("error"):
+            return seconds, None
+        audio_seconds, audio_status, _ = _request(f"{url}/audio/{result['mp3_filename']}")
+        return seconds, audio_seconds if audio_status == 200 else None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    generate_times = [seconds for seconds, audio in results if audio is not None]
+    audio_times = [audio for _, audio in results if audio is not None]
+    summary = {
+        "requests": requests, "concurrency": concurrency, "errors": sum(audio is None for _, audio in results),
+        "requests_per_sec": requests / elapsed,
+        "generate": percentiles(generate_times), "audio": percentiles(audio_times),
+    }
+    for endpoint in ("generate", "audio"):
+        stats = summary[endpoint]
+        if stats:
+            print(f"load       /{endpoint:<9} c={concurrency:<3} p50 {stats['p50_ms']:8.1f} ms | "
+                  f"p95 {stats['p95_ms']:8.1f} ms | p99 {stats['p99_ms']:8.1f} ms")
+    print(f"load       {summary['requests_per_sec']:.2f} requests/sec, {summary['errors']} errors")
+    return summary
+
+
+def metrics(results):
+    """flat {name: value} of every number in results, named by their position"""
+    flat = {}
+    for row in results.get("generation", []):
+        key = f"generation.{row['model']}.len{row['length']}.b{row['batch']}.t{row['threads']}"
+        flat[f"{key}.token_latency_ms"] = row["token_latency_ms"]
+        flat[f"{key}.tokens_per_sec"] = row["tokens_per_sec"]
+    for row in results.get("render", []):
+        for name, value in row.items():
+            if name.endswith("_ms"):
+                flat[f"render.{row['model']}.len{row['length']}.{name}"] = value
+    for run in results.get("load", []):
+        key = f"load.c{run['concurrency']}"
+        flat[f"{key}.requests_per_sec"] = run["requests_per_sec"]
+        for endpoint in ("generate", "audio"):
+            for name, value in run[endpoint].items():
+                flat[f"{key}.{endpoint}.{name}"] = value
+    return flat
+
+
+def compare(results, baseline, threshold):
+    """Prints every metric against baseline, returns the names that got worse by
+    more than threshold (a fraction)"""
+    current, previous = metrics(results), metrics(baseline)
+    regressions = []
+    for name in sorted(current.keys() & previous.keys()):
+        old, new = previous[name], current[name]
+        if not old:
+            continue
+        change = (new - old) / old
+        # throughputs should go up, everything else is a time and should go down
+        worse = -change if name.endswith("per_sec") else change
+        flag = "REGRESSION" if worse > threshold else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<60} {old:12.3f} -> {new:12.3f} {change:+7.1%} {flag}")
+    return regressions
+
+
+def _meta(args):
+    meta = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "machine": platform.machine(), "cpus": os.cpu_count(), "backend": args.backend,
+            "fake_renderer": args.fake_renderer}
+    try:
+        meta["commit"] = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                        text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    if "torch" in sys.modules:
+        meta["torch"] = sys.modules["torch"].__version__
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("parts", nargs="*", choices=["generation", "render", "load"],
+                        help="defaults to all three")
+    parser.add_argument("--backend", default=os.environ.get("MODEL_BACKEND", "eager"))
+    parser.add_argument("--lengths", type=int, nargs="+", default=[64, 256, 1024])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--fake-renderer", action="store_true",
+                        help="stand-in fluidsynth/ffmpeg from benchmarks/fakebin and the sine synth")
+    parser.add_argument("--url", help="load test this server instead of starting one")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--drum-length", type=int, default=256)
+    parser.add_argument("--output", help="write the results here as JSON")
+    parser.add_argument("--compare", help="results JSON of an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args()
+    parts = args.parts or ["generation", "render", "load"]
+
+    env = dict(os.environ, MODEL_BACKEND=args.backend)
+    if args.fake_renderer:
+        env.update(PATH=FAKEBIN + os.pathsep + env.get("PATH", ""), SYNTH_FAKE="1")
+        os.environ["PATH"] = env["PATH"]
+
+    results = {}
+    if "generation" in parts or "render" in parts:
+        registry = _registry(args.backend)
+        if "generation" in parts:
+            results["generation"] = generation(registry, args.lengths, args.batch_sizes, args.threads, args.repeats)
+        if "render" in parts:
+            results["render"] = render(registry, args.lengths, args.repeats, args.fake_renderer)
+    if "load" in parts:
+        # every request has to generate and render, not come out of the cache
+        env["CACHE_DISABLED"] = "1"
+        process, url = (None, args.url) if args.url else start_server(env)
+        try:
+            results["load"] = [load(url, args.requests, concurrency, MODELS, args.drum_length)
+                               for concurrency in args.concurrency]
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+    results["meta"] = _meta(args)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
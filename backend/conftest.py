@@ -0,0 +1,2 @@
+# The tests import the backend modules the way main.py does (serving.*, midi_writer, ...),
+# pytest puts this directory on sys.path because this conftest.py lives in it.
@@ -1,12 +1,13 @@
 import os
 import json
 import pretty_midi
-import numpy as np
+
+from training.corpus import WindowDataset, load_corpus, windows
 
 # Paths
 MIDI_PATH = r"C:\Users\Krishna Mohan\Downloads\Compressed\groove\drummer7\eval_session"
-SINGLE_SONG_PATH = "drum_single_song.txt"
-MAP_PATH = "drum_map.json"
+SINGLE_SONG_PATH = os.path.join(os.path.dirname(__file__), "drum_single_song.txt")
+MAP_PATH = os.path.join(os.path.dirname(__file__), "drum_map.json")
 SEQUENCE_LENGTH = 128
 
 def load_midi_files(path, max_limit=-1):
@@ -19,33 +20,40 @@ def load_midi_files(path, max_limit=-1):
                 midi_files.append(midi)
     return midi_files
 
+def drum_events(midi):
+    """(time, pitch) drum hits of one MIDI file in chronological order, None without a drum track."""
+    drum_track = [inst for inst in midi.instruments if inst.is_drum]
+    if not drum_track:
+        return None
+    drum_notes = []
+    for note in drum_track[0].notes:
+        drum_notes.append((note.start, note.pitch))  # (time, drum pad hit)
+    drum_notes.sort()  # Ensure events are in chronological order
+    return drum_notes
+
 def extract_drum_events(midi_files):
     """Extract drum notes from MIDI files."""
-    drum_sequences = []
-    for midi in midi_files:
-        drum_track = [inst for inst in midi.instruments if inst.is_drum]
-        if not drum_track:
-            continue
-        drum_notes = []
-        for note in drum_track[0].notes:
-            drum_notes.append((note.start, note.pitch))  # (time, drum pad hit)
-        drum_notes.sort()  # Ensure events are in chronological order
-        drum_sequences.append(drum_notes)
-    return drum_sequences
+    return [events for events in map(drum_events, midi_files) if events is not None]
+
+def encode_drum_sequence(sequence, timestep=0.1):
+    """Convert one song's drum notes into a list of tokens at fixed time intervals."""
+    encoded_song = []
+    last_time = 0.0
+    for time, pitch in sequence:
+        time_steps = int((time - last_time) / timestep)
+        encoded_song.extend(['_'] * time_steps)  # Padding for time gaps
+        encoded_song.append(str(pitch))  # Drum note hit
+        last_time = time
+    return encoded_song
 
 def encode_drum_events(drum_sequences, timestep=0.1):
     """Convert drum notes into a sequence of events at fixed time intervals."""
-    encoded_songs = []
-    for sequence in drum_sequences:
-        encoded_song = []
-        last_time = 0.0
-        for time, pitch in sequence:
-            time_steps = int((time - last_time) / timestep)
-            encoded_song.extend(['_'] * time_steps)  # Padding for time gaps
-            encoded_song.append(str(pitch))  # Drum note hit
-            last_time = time
-        encoded_songs.append(" ".join(encoded_song))
-    return " ".join(encoded_songs)
+    return " ".join(" ".join(encode_drum_sequence(sequence, timestep)) for sequence in drum_sequences)
+
+def preprocess_file(file_path, timestep=0.1):
+    """Load and encode one MIDI file for the preprocessing workers, None without a drum track."""
+    events = drum_events(pretty_midi.PrettyMIDI(file_path))
+    return None if events is None else encode_drum_sequence(events, timestep)
 
 def save_encoded_data(encoded_song, path):
     """Save encoded drum sequence to a file."""
@@ -59,21 +67,14 @@ def create_mapping(encoded_song, map_path):
     with open(map_path, 'w') as f:
         json.dump(mapping, f, indent=4)
 
-def generate_training_samples(sequence_length=SEQUENCE_LENGTH, map_path=MAP_PATH):
-    """Generate input-target pairs for training."""
-    with open(map_path, 'r') as f:
-        mapping = json.load(f)
-    with open("drum_single_song.txt","r") as f:
-        encoded_song = f.read()
-    song_tokens = encoded_song.split()
-    mapped_song = [mapping[token] for token in song_tokens]
-    
-    inputs, targets = [], []
-    for i in range(len(mapped_song) - sequence_length):
-        inputs.append(mapped_song[i:i+sequence_length])
-        targets.append(mapped_song[i+sequence_length])
-    
-    return np.array(inputs), np.array(targets)
+def generate_training_samples(sequence_length=SEQUENCE_LENGTH, map_path=MAP_PATH, song_path=SINGLE_SONG_PATH):
+    """Generate input-target pairs for training, as zero-copy views of the
+    memory-mapped encoded song (cached next to it as .npy)."""
+    return windows(load_corpus(song_path, map_path), sequence_length)
+
+def training_dataset(sequence_length=SEQUENCE_LENGTH, map_path=MAP_PATH, song_path=SINGLE_SONG_PATH):
+    """WindowDataset over the memory-mapped encoded song."""
+    return WindowDataset(load_corpus(song_path, map_path), sequence_length)
 
 def get_vocab_size(map_path=MAP_PATH):
     """Retrieve the vocabulary size."""
@@ -81,7 +82,7 @@ def get_vocab_size(map_path=MAP_PATH):
         mapping = json.load(f)
     return len(mapping)
 
-# Example Usage:
+# Example Usage (python -m training.preprocess drum <dir> runs these in parallel, with a cache):
 # midi_files = load_midi_files(MIDI_PATH, max_limit=20)
 # drum_sequences = extract_drum_events(midi_files)
 # encoded_song = encode_drum_events(drum_sequences)
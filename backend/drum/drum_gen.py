@@ -1,90 +1,135 @@
-import torch
-import torch.nn as nn
-import json
-import numpy as np
-from drum.drum_data import get_vocab_size
-
-class Model(nn.Module):
-  def __init__(self,in_size,vocab_size,hidden_dim,out_notes):
-    super().__init__()
-    self.lstm1 = nn.LSTM(input_size=in_size,hidden_size=hidden_dim,num_layers=1,batch_first=True)
-    self.norm = nn.LayerNorm(hidden_dim)
-    self.drop = nn.Dropout(0.1)
-    
-    self.mlp = nn.Sequential(
-      nn.Linear(hidden_dim,hidden_dim),
-      nn.Dropout(0.1),
-      nn.Linear(hidden_dim,out_notes)
-    )
-    self.embedding = nn.Embedding(vocab_size,hidden_dim)
-  def forward(self,x):
-    x = self.embedding(x)
-    _,(h,_) = self.lstm1(x)
-    x = self.norm(h.squeeze(0))
-    x = self.drop(x)
-    x = self.mlp(h.squeeze(0))
-    return x
-  
+from midi_writer import drum_to_midi
+from token_window import TokenWindow
+from vocabulary import Vocabulary
+
+# torch is imported where it is used, so importing this module
+# stays cheap and side-effect free; call startup() to load the model
+DEFAULT_MODEL_PATH = "drum/model_drum.pth"
+DEFAULT_MAP_PATH = "drum/drum_map.json"
 
 class DrumGenerator:
     def __init__(self, model_path, map_path, sequence_length=128, hidden_dim=256):
-        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        # Weights converted to .npz run on numpy_lstm, without importing torch
+        self.numpy = model_path.endswith(".npz")
+        if self.numpy:
+            self.device = 'cpu'
+        else:
+            import torch
+            self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
         self.sequence_length = sequence_length
         self.hidden_dim = hidden_dim
         
-        # Load vocabulary mapping
-        with open(map_path, 'r') as f:
-            self.mapping = json.load(f)
-        self.reverse_mapping = {v: k for k, v in self.mapping.items()}
-        self.vocab_size = len(self.mapping)
+        # Load vocabulary, '_' is a step without a hit
+        self.vocab = Vocabulary.load(map_path, hold='_')
+        self.vocab.check(model_path)
+        self.mapping = self.vocab.mapping
+        self.reverse_mapping = self.vocab.reverse_mapping
+        self.vocab_size = len(self.vocab)
         
         # Initialize and load model
-        self.model = Model(hidden_dim, self.vocab_size, hidden_dim, self.vocab_size).to(self.device)
-        self.model.load_state_dict(torch.load(model_path, map_location=self.device,weights_only=True))
-        self.model.eval()
+        if self.numpy:
+            import numpy_lstm
+            self.model = numpy_lstm.NumpyModel.load(model_path)
+        else:
+            from lstm_model import Model
+            self.model = Model(hidden_dim, self.vocab_size, hidden_dim, self.vocab_size).to(self.device)
+            self.model.load_state_dict(torch.load(model_path, map_location=self.device,weights_only=True))
+            self.model.eval()
 
-    def generate_sequence(self, seed_sequence=None, length=256, temperature=1.0):
+    def seed_ids(self, seed_sequence=None):
+        """Seed token ids to start generation from, a fixed groove if none is given"""
+        if seed_sequence is None:
+            # Generate random seed sequence
+            seed_text = "38 _ _ _ 42 _ 42 _ 36 42 _ _ _ 42 _ _ _ 38 _ _ _ 42 _ 42 _ 36 _ 42"
+            seed_sequence = self.vocab.encode(seed_text.split(" ")).tolist()
+            # seed_sequence = np.random.choice(list(self.mapping.values()), 
+                                        #   size=self.sequence_length)
+            # print(seed_sequence); exit()
+        return list(seed_sequence)
+
+    def generate_sequence(self, seed_sequence=None, length=256, temperature=1.0, stateful=True, generator=None):
         """
         Generate a drum sequence.
         Args:
             seed_sequence: Optional list of initial tokens. If None, will use random seed.
             length: Length of sequence to generate
             temperature: Controls randomness (higher = more random, lower = more deterministic)
+            stateful: Prime the LSTM once on the seed and carry (h, c) forward one token
+                per step instead of re-running the whole window (same distribution, O(1) per step)
+            generator: Optional rng used for sampling (see rng), makes the output reproducible
         """
-        if seed_sequence is None:
-            # Generate random seed sequence
-            seed_text = "38 _ _ _ 42 _ 42 _ 36 42 _ _ _ 42 _ _ _ 38 _ _ _ 42 _ 42 _ 36 _ 42"
-            seed_sequence = [ self.mapping[i] for i in seed_text.split(" ")]
-            # seed_sequence = np.random.choice(list(self.mapping.values()), 
-                                        #   size=self.sequence_length)
-            # print(seed_sequence); exit()
-        # Convert to tensor and move to device
-        current_sequence = torch.tensor(seed_sequence).unsqueeze(0).to(self.device)
-        generated_sequence = list(seed_sequence)
+        seed_sequence = self.seed_ids(seed_sequence)
+        return seed_sequence + list(self.stream_sequence(seed_sequence, length, temperature, stateful, generator))
+
+    def stream_sequence(self, seed_sequence=None, length=256, temperature=1.0, stateful=True, generator=None):
+        """
+        Same sampling as generate_sequence, but yields each new token id (without the seed)
+        as soon as it is sampled. Closing the generator stops the remaining computation.
+        """
+        seed_sequence = self.seed_ids(seed_sequence)
+        # Convert to model input
+        current_sequence = self._input(seed_sequence)
+        # the last sequence_length ids in a fixed buffer, however long the sequence gets
+        window = TokenWindow(seed_sequence, self.sequence_length)
+        state = None
         
-        with torch.no_grad():
-            for _ in range(length):
+        for _ in range(length):
+            with self._no_grad():
                 # Get model prediction
-                logits = self.model(current_sequence)
-                
-                # Apply temperature
-                logits = logits / temperature
-                
-                # Sample from the distribution
-                probs = torch.softmax(logits, dim=-1)
-                next_token = torch.multinomial(probs, 1).item()
-                
-                # Add to generated sequence
-                generated_sequence.append(next_token)
+                if stateful:
+                    logits, state = self.model.step(current_sequence, state)
+                else:
+                    logits = self.model(current_sequence)
                 
-                # Update current sequence
-                current_sequence = torch.tensor(generated_sequence[-self.sequence_length:]).unsqueeze(0).to(self.device)
-        
-        return generated_sequence
+                # Apply temperature and sample from the distribution
+                next_token = self._sample(logits, temperature, generator)
+            
+            # Update current sequence (only the new token when the state is carried)
+            if stateful:
+                current_sequence = self._input([next_token])
+            else:
+                window.append(next_token)
+                current_sequence = self._input(window.view())
+            yield next_token
+
+    def _no_grad(self):
+        if self.numpy:
+            import numpy_lstm
+            return numpy_lstm.no_grad()
+        import torch
+        return torch.no_grad()
+
+    def _input(self, ids):
+        """ids (list or int64 array) as a (1, len) model input"""
+        if self.numpy:
+            import numpy as np
+            return np.asarray([ids])
+        import torch
+        return torch.as_tensor(ids, device=self.device).unsqueeze(0)
+
+    def _sample(self, logits, temperature, generator=None):
+        if self.numpy:
+            import numpy_lstm
+            return int(numpy_lstm.sample(numpy_lstm.softmax(logits / temperature), generator)[0])
+        import torch
+        probs = torch.softmax(logits / temperature, dim=-1)
+        return torch.multinomial(probs, 1, generator=generator).item()
+
+    def rng(self, seed):
+        """Seeded sampling rng for generate_sequence/stream_sequence and the batch scheduler"""
+        if self.numpy:
+            import numpy as np
+            return np.random.default_rng(seed)
+        import torch
+        return torch.Generator(device=self.device).manual_seed(seed)
+
+    def warmup(self, length=8):
+        """Run a short generation so the first real request doesn't pay for lazy init"""
+        self.generate_sequence(length=length)
 
     def decode_sequence(self, sequence):
         """Convert numeric sequence back to token sequence"""
-        return [self.reverse_mapping[token] for token in sequence]
+        return self.vocab.decode(sequence)
 
     def save_to_midi(self, sequence, output_path, timestep=0.1):
         """
@@ -94,29 +139,23 @@ class DrumGenerator:
             output_path: Path to save MIDI file
             timestep: Time between events in seconds
         """
-        import pretty_midi
-        
-        pm = pretty_midi.PrettyMIDI()
-        # For drums, we don't need a specific program number
-        drums = pretty_midi.Instrument(program=0, is_drum=True)
-        
-        current_time = 0.0
-        for token in sequence:
-            if token in self.reverse_mapping:
-                token_str = self.reverse_mapping[token]
-                if token_str != '_':  # Skip silence tokens
-                    # Create note (assuming 0.1 second duration for each hit)
-                    note = pretty_midi.Note(
-                        velocity=100,
-                        pitch=int(token_str),
-                        start=current_time,
-                        end=current_time + 0.1
-                    )
-                    drums.notes.append(note)
-            current_time += timestep
-        
-        pm.instruments.append(drums)
-        pm.write(output_path)
+        with open(output_path, "wb") as f:
+            f.write(self.to_midi_bytes(sequence, timestep))
+
+    def to_midi_bytes(self, sequence, timestep=0.1):
+        """Same MIDI as save_to_midi (one 0.1 second hit per token), returned as bytes"""
+        return drum_to_midi(sequence, self.reverse_mapping, timestep)
+
+drum_generator = None
+
+def startup(model_path=DEFAULT_MODEL_PATH, map_path=DEFAULT_MAP_PATH, warmup=True):
+    """Load the module-level DrumGenerator and warm it up, later calls return the loaded one"""
+    global drum_generator
+    if drum_generator is None:
+        drum_generator = DrumGenerator(model_path=model_path, map_path=map_path)
+        if warmup:
+            drum_generator.warmup()
+    return drum_generator
 
 # Example usage:
 if __name__ == "__main__":
@@ -0,0 +1,35 @@
+'''The LSTM of the melody and drum generators (embedding -> single-layer LSTM -> MLP
+head), shared by training and serving; numpy_lstm.py runs the same weights without torch.'''
+from typing import Optional, Tuple
+
+import torch
+import torch.nn as nn
+
+class Model(nn.Module):
+  def __init__(self,in_size,vocab_size,hidden_dim,out_notes):
+    super().__init__()
+    self.lstm1 = nn.LSTM(input_size=in_size,hidden_size=hidden_dim,num_layers=1,batch_first=True)
+    self.norm = nn.LayerNorm(hidden_dim)
+    self.drop = nn.Dropout(0.1)
+    
+    self.mlp = nn.Sequential(
+      nn.Linear(hidden_dim,hidden_dim),
+      nn.Dropout(0.1),
+      nn.Linear(hidden_dim,out_notes)
+    )
+    self.embedding = nn.Embedding(vocab_size,hidden_dim)
+  def forward(self,x):
+    x = self.embedding(x)
+    _,(h,_) = self.lstm1(x)
+    x = self.norm(h.squeeze(0))
+    x = self.drop(x)
+    x = self.mlp(h.squeeze(0))
+    return x
+  @torch.jit.export
+  def step(self,x,state:Optional[Tuple[torch.Tensor,torch.Tensor]]=None):
+    '''runs x (batch,steps) through the lstm starting from state=(h,c),
+    returns the next-token logits and the new state'''
+    x = self.embedding(x)
+    _,state = self.lstm1(x,state)
+    x = self.mlp(state[0].squeeze(0))
+    return x,state
@@ -1,19 +1,170 @@
 import os
-import subprocess
-import tempfile
 import base64
+import hmac
+import json
 import time
-import uuid
-from fastapi import FastAPI, HTTPException
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import List, Optional
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field, confloat
 
 # Import your music generation functions
-from Final_Final.generator import Malody_Generator, save_melody, seed_dict
+from Final_Final.generator import MelodyGenerator
 from drum.drum_gen import DrumGenerator
+from serving.audio_store import AudioStore, file_response
+from serving.batching import BatchScheduler
+from serving.cache import OutputCache
+from serving.execution import ExecutionLayer, Overloaded
+from serving.jobs import DONE, JobManager, store_from_env
+from serving.metrics import Metrics, process_gauges, server_timing, trace
+from serving.pipeline import GenerationPipeline
+from serving.profiling import RequestProfiler
+from serving.registry import ModelRegistry
+from serving.synth_pool import SynthPool, SynthWorkerError
 
-app = FastAPI(title="AI Music Generator API")
+# Models are loaded once and shared by every request, MODEL_BACKEND picks
+# eager (fp32), torchscript or quantized (int8) inference
+registry = ModelRegistry(backend=os.environ.get("MODEL_BACKEND", "eager"))
+registry.register("Melody", MelodyGenerator, 'Final_Final/model.pth', 'Final_Final/map.json')
+registry.register("Drum", DrumGenerator, 'drum/model_drum.pth', 'drum/drum_map.json')
+
+# Concurrent requests for the same model are sampled together as one batch
+schedulers = {
+    name: BatchScheduler(lambda name=name: registry.get(name).model)
+    for name in registry.names()
+}
+
+# Blocking work (MIDI writing, fluidsynth, ffmpeg) runs off the event loop
+execution = ExecutionLayer.from_env()
+# Long-lived synth workers keep the soundfont loaded between requests
+synth_pool = SynthPool.from_env()
+# Identical seeded requests and already rendered MIDI are served from the cache
+cache = OutputCache.from_env()
+# Stage durations, throughput and queue depths, scraped from GET /metrics
+metrics = Metrics()
+pipeline = GenerationPipeline(registry, schedulers, execution, synth_pool=synth_pool, cache=cache, metrics=metrics)
+
+# Configuration
+AUDIO_FILES_DIR = "static/audio"
+MAX_VARIANTS = int(os.environ.get("MAX_VARIANTS", 8))
+MAX_DURATION_SECONDS = float(os.environ.get("MAX_DURATION_SECONDS", 1200))
+JOB_RESULTS_DIR = "static/jobs"
+PROFILES_DIR = "static/profiles"
+# model reloads and profiling need this in an X-Admin-Token header, unset disables them
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+# Served audio is indexed in memory and evicted by age and total size
+audio_store = AudioStore.from_env(AUDIO_FILES_DIR)
+
+async def run_job(job, progress):
+    params = job["params"]
+    if params["model_type"] == "Arrangement":
+        result = await pipeline.run_arrangement(
+            out_dir=os.path.join(JOB_RESULTS_DIR, job["id"]),
+            temperature=params["temperature"],
+            drum_temperature=params.get("drum_temperature"),
+            seed=params["seed"],
+            drum_length=params["drum_length"],
+            rng_seed=params.get("rng_seed"),
+            keep=("midi", "wav", "mp3"),
+            base_name="output",
+            progress=progress,
+        )
+        return {fmt: os.path.basename(path) for fmt, path in result["files"].items()}
+    if params.get("duration_seconds"):
+        result = await pipeline.run_long(
+            params["model_type"],
+            out_dir=os.path.join(JOB_RESULTS_DIR, job["id"]),
+            duration=params["duration_seconds"],
+            temperature=params["temperature"],
+            seed=params["seed"],
+            rng_seed=params.get("rng_seed"),
+            keep=("midi", "wav", "mp3"),
+            base_name="output",
+            progress=progress,
+        )
+        return {fmt: os.path.basename(path) for fmt, path in result["files"].items()}
+    result = await pipeline.run(
+        params["model_type"],
+        out_dir=os.path.join(JOB_RESULTS_DIR, job["id"]),
+        temperature=params["temperature"],
+        seed=params["seed"],
+        drum_length=params["drum_length"],
+        rng_seed=params.get("rng_seed"),
+        keep=("midi", "wav", "mp3"),
+        base_name="output",
+        progress=progress,
+    )
+    return {fmt: os.path.basename(path) for fmt, path in result["files"].items()}
+
+# Long running generations go through the job queue instead of holding the connection
+jobs = JobManager(store_from_env(), run_job, workers=int(os.environ.get("JOB_WORKERS", 2)),
+                  results_dir=JOB_RESULTS_DIR, ttl=float(os.environ.get("JOB_TTL_SECONDS", 24 * 3600)),
+                  sweep_interval=float(os.environ.get("JOB_SWEEP_SECONDS", 600)),
+                  stale_after=float(os.environ.get("JOB_STALE_SECONDS", 3600)))
+# POST /admin/profile records profiles of the next /generate requests
+profiler = RequestProfiler(PROFILES_DIR, execution, schedulers)
+
+metrics.gauge("requests_waiting", "Requests waiting for a pipeline slot", lambda: execution.waiting)
+metrics.gauge("requests_active", "Requests holding a pipeline slot", lambda: execution.running)
+metrics.gauge("renders_active", "fluidsynth/ffmpeg processes running", lambda: execution.rendering)
+metrics.counter("requests_rejected_total", "Requests rejected with 503", read=lambda: execution.rejected)
+metrics.gauge("io_backlog", "Calls queued for the I/O thread pool (MIDI and file writes, cache)",
+              lambda: execution.metrics()["io_backlog"])
+metrics.gauge("scheduler_queued_rows", "Generations waiting to join a batch",
+              lambda: {name: scheduler.queued() for name, scheduler in schedulers.items()}, ("model_type",))
+metrics.gauge("jobs_queued", "Jobs waiting for a worker", lambda: jobs.store.queued())
+metrics.gauge("synth_workers_idle", "Idle synth workers",
+              lambda: synth_pool.health()["idle"] if synth_pool is not None else None)
+if cache is not None:
+    metrics.gauge("cache_hit_rate", "Generation and audio cache hit rate", lambda: cache.stats()["hit_rate"])
+    metrics.gauge("cache_lookups", "Cache lookups since startup",
+                  lambda: {"hit": cache.stats()["hits"], "miss": cache.stats()["misses"]}, ("result",))
+metrics.gauge("audio_store_bytes", "Size of the served audio files", lambda: audio_store.stats()["bytes"])
+process_gauges(metrics)
+
+@asynccontextmanager
+async def lifespan(app):
+    global synth_pool
+    registry.load(warmup=True)
+    for scheduler in schedulers.values():
+        scheduler.start()
+    if synth_pool is not None:
+        try:
+            await synth_pool.start()
+        except SynthWorkerError as e:
+            # renders fall back to a fluidsynth process each, long-form and MP3 streaming answer 501
+            print(f"Warning: {e}, rendering with the fluidsynth command line instead of the synth pool")
+            synth_pool = pipeline.synth_pool = None
+    await jobs.start()
+    audio_store.start()
+    yield
+    await audio_store.stop()
+    await jobs.stop()
+    if synth_pool is not None:
+        await synth_pool.stop()
+    for scheduler in schedulers.values():
+        scheduler.stop()
+    execution.shutdown()
+
+app = FastAPI(title="AI Music Generator API", lifespan=lifespan)
+
+@app.middleware("http")
+async def record_timing(request: Request, call_next):
+    """Request durations (until the response starts) by route, and the stages of the
+    request as a Server-Timing header"""
+    start = time.perf_counter()
+    with trace() as stages:
+        response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.request_seconds.observe(time.perf_counter() - start, method=request.method,
+                                    route=route.path if route is not None else "unmatched",
+                                    status=response.status_code)
+    if stages:
+        response.headers["Server-Timing"] = server_timing(stages)
+    return response
 
 # Configure CORS first!
 app.add_middleware(
@@ -24,129 +175,348 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configuration
-AUDIO_FILES_DIR = "static/audio"
-os.makedirs(AUDIO_FILES_DIR, exist_ok=True)
-
-def midi_to_wav(midi_path, wav_path):
-    """Convert MIDI to WAV using fluidsynth"""
-    sf_path = os.path.abspath("FluidR3_GM.sf2")
-    command = [
-        'fluidsynth', '-ni', sf_path, midi_path,
-        '-F', wav_path, '-r', '44100', '-T', 'wav'
-    ]
-    try:
-        subprocess.run(command, check=True, capture_output=True)
-    except subprocess.CalledProcessError as e:
-        error_msg = f"Fluidsynth error: {e.stderr.decode()}"
-        print(error_msg)
-        raise RuntimeError(error_msg)
-
-def wav_to_mp3(wav_path, mp3_path):
-    """Convert WAV to MP3 using ffmpeg"""
-    command = [
-        'ffmpeg', '-y', '-i', wav_path,
-        '-codec:a', 'libmp3lame', '-qscale:a', '2', mp3_path
-    ]
-    try:
-        subprocess.run(command, check=True, capture_output=True)
-    except subprocess.CalledProcessError as e:
-        error_msg = f"FFmpeg error: {e.stderr.decode()}"
-        print(error_msg)
-        raise RuntimeError(error_msg)
-
 class MusicRequest(BaseModel):
-    model_type: str  # "Melody" or "Drum"
-    temperature: float = 1.0
+    model_type: str  # "Melody", "Drum" or "Arrangement" (both in one piece)
+    temperature: float = Field(1.0, gt=0)
     seed: str = None
     drum_length: int = None
+    rng_seed: Optional[int] = None  # makes sampling reproducible and the result cacheable
+    # alternatives sampled together as one batch, optionally each with its own
+    # temperature / rng seed and ranked by "likelihood" or "heuristic"
+    num_variants: Optional[int] = Field(None, ge=1, le=MAX_VARIANTS)
+    temperatures: Optional[List[confloat(gt=0)]] = Field(None, max_length=MAX_VARIANTS)
+    rng_seeds: Optional[List[int]] = Field(None, max_length=MAX_VARIANTS)
+    rank: Optional[str] = None
+    drum_temperature: Optional[float] = Field(None, gt=0)  # Arrangement only, defaults to temperature
+    # long-form piece of about this many seconds, generated and rendered in chunks
+    duration_seconds: Optional[float] = Field(None, gt=0, le=MAX_DURATION_SECONDS)
+
+    def variants(self):
+        return bool(self.num_variants or self.temperatures or self.rng_seeds or self.rank)
+
+class ReloadRequest(BaseModel):
+    model_path: str = None
+
+class VariantResponse(BaseModel):
+    wav_filename: str
+    mp3_filename: str
+    midi_base64: str
+    temperature: float
+    rng_seed: Optional[int] = None
+    score: Optional[float] = None
 
 class MusicResponse(BaseModel):
     wav_filename: str = None
     mp3_filename: str = None
     midi_base64: str = None
     error: str = None
+    variants: List[VariantResponse] = []  # best first when ranked, the top-level fields are the first one
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled, set ADMIN_TOKEN")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
 
 @app.post("/generate", response_model=MusicResponse)
 async def generate_music(request: MusicRequest):
+    if request.model_type == "Arrangement" and (request.duration_seconds or request.variants()):
+        raise HTTPException(status_code=400, detail="Arrangements support neither variants nor long-form")
+    if request.duration_seconds and request.variants():
+        raise HTTPException(status_code=400, detail="Long-form pieces are generated one at a time")
+    if request.duration_seconds and synth_pool is None:
+        raise HTTPException(status_code=501, detail="Long-form generation needs the synth pool")
+    try:
+        async with execution.slot():
+            async with profiler.profile("generate", request.model_type):
+                return await _generate_music(request)
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+def _midi_base64(midi, model_type):
+    with metrics.time("base64", model_type):
+        return base64.b64encode(midi).decode()
+
+async def _generate_variants(request: MusicRequest):
+    variants = await pipeline.run_variants(
+        request.model_type,
+        out_dir=audio_store.root,
+        num_variants=request.num_variants,
+        temperature=request.temperature,
+        temperatures=request.temperatures,
+        seed=request.seed,
+        drum_length=request.drum_length,
+        rng_seed=request.rng_seed,
+        rng_seeds=request.rng_seeds,
+        rank=request.rank
+    )
+    responses = []
+    for variant in variants:
+        for path in variant["files"].values():
+            await execution.run_in_thread(audio_store.add, path)
+        responses.append(VariantResponse(
+            wav_filename=os.path.basename(variant["files"]["wav"]),
+            mp3_filename=os.path.basename(variant["files"]["mp3"]),
+            midi_base64=_midi_base64(variant["midi"], request.model_type),
+            temperature=variant["temperature"],
+            rng_seed=variant["rng_seed"],
+            score=variant["score"]
+        ))
+    best = responses[0]
+    return MusicResponse(
+        wav_filename=best.wav_filename,
+        mp3_filename=best.mp3_filename,
+        midi_base64=best.midi_base64,
+        error="",
+        variants=responses
+    )
+
+async def _generate_long(request: MusicRequest):
+    result = await pipeline.run_long(
+        request.model_type,
+        out_dir=audio_store.root,
+        duration=request.duration_seconds,
+        temperature=request.temperature,
+        seed=request.seed,
+        rng_seed=request.rng_seed
+    )
+    for path in result["files"].values():
+        await execution.run_in_thread(audio_store.add, path)
+    return MusicResponse(
+        wav_filename=os.path.basename(result["files"]["wav"]),
+        mp3_filename=os.path.basename(result["files"]["mp3"]),
+        midi_base64=_midi_base64(result["midi"], request.model_type),
+        error=""
+    )
+
+async def _generate_arrangement(request: MusicRequest):
+    result = await pipeline.run_arrangement(
+        out_dir=audio_store.root,
+        temperature=request.temperature,
+        drum_temperature=request.drum_temperature,
+        seed=request.seed,
+        drum_length=request.drum_length,
+        rng_seed=request.rng_seed
+    )
+    for path in result["files"].values():
+        await execution.run_in_thread(audio_store.add, path)
+    return MusicResponse(
+        wav_filename=os.path.basename(result["files"]["wav"]),
+        mp3_filename=os.path.basename(result["files"]["mp3"]),
+        midi_base64=_midi_base64(result["midi"], request.model_type),
+        error=""
+    )
+
+async def _generate_music(request: MusicRequest):
     try:
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            # Generate MIDI
-            if request.model_type == "Melody":
-                seed_text = request.seed or seed_dict.get("seed1", "_ 67 _ 65 _ 64 _ 62 _ 60 _")
-                melody = Malody_Generator(
-                    seed=seed_text,
-                    num_steps=200,
-                    sequence_length=128,
-                    temperature=request.temperature
-                )
-                # Create unique MIDI filename
-                midi_filename = f"melody_{uuid.uuid4().hex}.mid"
-                midi_path = os.path.join(tmp_dir, midi_filename)
-                
-                # Verify path is correct
-                print(f"Saving melody to: {midi_path}")  # Debug log
-                
-                save_melody(melody, file_name=midi_path)
-                
-                # Verify file exists
-                if not os.path.exists(midi_path):
-                    raise RuntimeError("MIDI file was not created")
-
-            elif request.model_type == "Drum":
-                drum_generator = DrumGenerator(
-                    model_path='drum/model_drum.pth',
-                    map_path='drum/drum_map.json'
-                )
-                sequence = drum_generator.generate_sequence(
-                    length=request.drum_length or 256,
-                    temperature=request.temperature
-                )
-                midi_path = os.path.join(tmp_dir, "generated_drums.mid")
-                drum_generator.save_to_midi(sequence, midi_path)
-            else:
-                raise HTTPException(status_code=400, detail="Invalid model type")
-
-            # Convert to WAV and MP3
-            base_name = f"generated_{int(time.time())}_{uuid.uuid4().hex}"
-            wav_path = os.path.join(tmp_dir, f"{base_name}.wav")
-            mp3_path = os.path.join(tmp_dir, f"{base_name}.mp3")
-
-            midi_to_wav(midi_path, wav_path)
-            wav_to_mp3(wav_path, mp3_path)
-
-            # Save to permanent storage
-            final_wav_path = os.path.join(AUDIO_FILES_DIR, f"{base_name}.wav")
-            final_mp3_path = os.path.join(AUDIO_FILES_DIR, f"{base_name}.mp3")
-            
-            os.rename(wav_path, final_wav_path)
-            os.rename(mp3_path, final_mp3_path)
-
-            # Read MIDI data
-            with open(midi_path, "rb") as f:
-                midi_data = base64.b64encode(f.read()).decode()
-
-            return MusicResponse(
-                wav_filename=f"{base_name}.wav",
-                mp3_filename=f"{base_name}.mp3",
-                midi_base64=midi_data,
-                error=""
-            )
+        if request.model_type == "Arrangement":
+            return await _generate_arrangement(request)
+        if request.variants():
+            return await _generate_variants(request)
+        if request.duration_seconds:
+            return await _generate_long(request)
+        result = await pipeline.run(
+            request.model_type,
+            out_dir=audio_store.root,
+            temperature=request.temperature,
+            seed=request.seed,
+            drum_length=request.drum_length,
+            rng_seed=request.rng_seed
+        )
+        for path in result["files"].values():
+            await execution.run_in_thread(audio_store.add, path)
+        return MusicResponse(
+            wav_filename=os.path.basename(result["files"]["wav"]),
+            mp3_filename=os.path.basename(result["files"]["mp3"]),
+            midi_base64=_midi_base64(result["midi"], request.model_type),
+            error=""
+        )
 
     except Exception as e:
         return MusicResponse(error=str(e))
 
+async def streaming_slot():
+    """Pipeline slot held for the whole of a streamed response, 503 when the queue is full.
+    Close the returned stack when the body finishes, the response closes it as well in
+    case the body never started (closing twice is fine)"""
+    stack = AsyncExitStack()
+    try:
+        await stack.enter_async_context(execution.slot())
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return stack
+
+@app.get("/generate/stream")
+async def stream_music(model_type: str, temperature: float = Query(1.0, gt=0), seed: str = None, drum_length: int = None):
+    """Server-sent events: the seed, every token as it is sampled and the MIDI of each
+    finished bar, so playback can start after the first bar. Disconnecting stops sampling."""
+    if model_type not in ("Melody", "Drum"):
+        raise HTTPException(status_code=400, detail="Invalid model type")
+
+    slot = await streaming_slot()
+
+    async def events():
+        try:
+            async for event, data in pipeline.stream(model_type, temperature, seed, drum_length):
+                if event == "chunk":
+                    data = {**data, "midi": base64.b64encode(data["midi"]).decode()}
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+        finally:
+            await slot.aclose()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"}, background=BackgroundTask(slot.aclose))
+
+@app.get("/generate/mp3")
+async def generate_mp3(model_type: str, temperature: float = Query(1.0, gt=0), seed: str = None, drum_length: int = None):
+    """Generate and stream the MP3 straight from the encoder, no files are written"""
+    if model_type not in ("Melody", "Drum"):
+        raise HTTPException(status_code=400, detail="Invalid model type")
+    if synth_pool is None:
+        raise HTTPException(status_code=501, detail="MP3 streaming needs the synth pool")
+    slot = await streaming_slot()
+    try:
+        chunks = pipeline.stream_mp3(model_type, temperature, seed, drum_length)
+        # wait for the first encoded bytes so generation errors still become a 500
+        first = await anext(chunks)
+    except Exception as e:
+        await slot.aclose()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def body():
+        try:
+            yield first
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await slot.aclose()
+
+    return StreamingResponse(body(), media_type="audio/mpeg", background=BackgroundTask(slot.aclose))
+
+RESULT_MEDIA_TYPES = {"midi": "audio/midi", "wav": "audio/wav", "mp3": "audio/mpeg"}
+
+class JobResponse(BaseModel):
+    job_id: str
+    status: str
+    progress: dict = {}
+    error: Optional[str] = None
+    result: dict = {}
+
+def _job_response(job):
+    return JobResponse(
+        job_id=job["id"],
+        status=job["status"],
+        progress=job["progress"],
+        error=job["error"],
+        result={fmt: f"/jobs/{job['id']}/result/{fmt}" for fmt in job["result"]},
+    )
+
+@app.post("/jobs", response_model=JobResponse, status_code=202)
+async def submit_job(request: MusicRequest):
+    """Queue a generation and return immediately, poll GET /jobs/{id} for progress"""
+    if request.model_type not in ("Melody", "Drum", "Arrangement"):
+        raise HTTPException(status_code=400, detail="Invalid model type")
+    if request.variants():
+        raise HTTPException(status_code=400, detail="Variants are only generated by POST /generate")
+    if request.model_type == "Arrangement" and request.duration_seconds:
+        raise HTTPException(status_code=400, detail="Arrangements are not generated long-form")
+    if request.duration_seconds and synth_pool is None:
+        raise HTTPException(status_code=501, detail="Long-form generation needs the synth pool")
+    return _job_response(jobs.submit(request.model_dump(), GenerationPipeline.STAGES))
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    job = jobs.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_response(job)
+
+@app.get("/jobs/{job_id}/result/{fmt}")
+async def get_job_result(job_id: str, fmt: str):
+    job = jobs.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if fmt not in RESULT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid format")
+    if job["status"] != DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    file_path = os.path.join(JOB_RESULTS_DIR, job_id, job["result"][fmt])
+    return FileResponse(file_path, media_type=RESULT_MEDIA_TYPES[fmt], filename=job["result"][fmt])
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus text exposition format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/execution")
+async def execution_metrics():
+    return execution.metrics()
+
+@app.get("/metrics/audio")
+async def audio_metrics():
+    return audio_store.stats()
+
+@app.get("/metrics/cache")
+async def cache_metrics():
+    return cache.stats() if cache is not None else {}
+
+@app.get("/health/synth")
+async def synth_health():
+    if synth_pool is None:
+        return {"size": 0, "idle": 0, "workers": []}
+    return synth_pool.health()
+
+@app.get("/models")
+async def list_models():
+    return registry.status()
+
+@app.post("/models/{name}/reload", dependencies=[Depends(require_admin)])
+def reload_model(name: str, request: ReloadRequest):
+    """Swap in a new checkpoint without restarting the server"""
+    if name not in registry.names():
+        raise HTTPException(status_code=404, detail="Unknown model")
+    try:
+        registry.reload(name, request.model_path)
+    except (OSError, RuntimeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Reload failed: {e}")
+    return registry.status()[name]
+
+class ProfileRequest(BaseModel):
+    requests: int = Field(1, ge=1, le=100)
+    mode: str = "cprofile"  # or "torch"
+
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def arm_profiler(request: ProfileRequest):
+    """Profile the next requests of POST /generate, see serving/profiling.py"""
+    try:
+        return profiler.arm(request.requests, request.mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def profiler_status():
+    return profiler.status()
+
+@app.get("/admin/profile/{filename}", dependencies=[Depends(require_admin)])
+async def get_profile(filename: str):
+    path = profiler.path(filename)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=filename)
+
 @app.get("/audio/{filename}")
-async def get_audio(filename: str):
-    file_path = os.path.join(AUDIO_FILES_DIR, filename)
-    if not os.path.exists(file_path):
+async def get_audio(filename: str, request: Request):
+    entry = audio_store.get(filename)
+    if entry is None:
         raise HTTPException(status_code=404, detail="File not found")
     
     # Validate file type
     if not filename.endswith(('.wav', '.mp3')):
         raise HTTPException(status_code=400, detail="Invalid file type")
     
-    return FileResponse(file_path)
+    return file_response(entry, request.headers)
 
 if __name__ == "__main__":
     import uvicorn
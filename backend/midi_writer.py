@@ -0,0 +1,245 @@
+'''Writes the generators' token sequences straight to Standard MIDI File bytes.
+
+The output has the same tracks, events and timing as what music21's
+Stream.write (melody) and pretty_midi (drums) produced before, without building
+their object models or going through a file.'''
+import bisect
+import struct
+
+import numpy as np
+
+# music21 writes 10080 ticks per quarter note, pretty_midi 220
+MELODY_RESOLUTION = 10080
+DRUM_RESOLUTION = 220
+TEMPO = 500000  # microseconds per quarter note, 120 bpm
+MELODY_VELOCITY = 90
+DRUM_VELOCITY = 100
+DRUM_CHANNEL = 9
+_END_OF_TRACK = b"\xff\x2f\x00"
+# melody and drums of an arrangement share one sixteenth-note step of this many seconds,
+# the drum model's timestep (150 bpm)
+ARRANGEMENT_STEP_SECONDS = 0.1
+
+
+def _timing(tempo=TEMPO):
+    return b"\x00\xff\x51\x03" + tempo.to_bytes(3, "big") + b"\x00\xff\x58\x04\x04\x02\x18\x08"
+
+
+_TIMING = _timing()
+
+
+def vlq(value):
+    """MIDI variable-length quantity"""
+    out = bytearray([value & 0x7F])
+    value >>= 7
+    while value:
+        out.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(out))
+
+
+def _chunk(kind, data):
+    return kind + struct.pack(">I", len(data)) + data
+
+
+def _smf(resolution, tracks):
+    return _chunk(b"MThd", struct.pack(">HHH", 1, len(tracks), resolution)) + b"".join(
+        _chunk(b"MTrk", track) for track in tracks
+    )
+
+
+def _events(events, tick=0, status=None):
+    """(tick, key, message) events, already in order, as track bytes using running
+    status. Returns (bytes, tick of the last event, last status byte)."""
+    out = bytearray()
+    for event_tick, _, message in events:
+        out += vlq(event_tick - tick)
+        if message[0] == status:
+            out += message[1:]
+        else:
+            out += message
+            status = message[0]
+        tick = event_tick
+    return bytes(out), tick, status
+
+
+def melody_runs(melody):
+    """Run-length encodes melody tokens on the "_" continuation token.
+
+    Returns (symbols, steps): every note/rest "R" and how many steps it lasts. Like
+    save_melody always did, leading "_" tokens lengthen the first symbol and the
+    final symbol is dropped, since nothing after it marks where it ends.
+    """
+    tokens = np.asarray(melody, dtype=object)
+    if len(tokens) < 2:
+        return tokens[:0], np.zeros(0, dtype=np.int64)
+    boundaries = np.flatnonzero(tokens != "_")
+    if not len(boundaries):
+        return tokens[:0], np.zeros(0, dtype=np.int64)
+    if boundaries[-1] != len(tokens) - 1:
+        boundaries = np.append(boundaries, len(tokens) - 1)
+    if len(boundaries) < 2:
+        return tokens[:0], np.zeros(0, dtype=np.int64)
+    symbols = tokens[boundaries[:-1]]
+    starts = boundaries.copy()
+    starts[0] = 0
+    return symbols, np.diff(starts)
+
+
+def melody_to_midi(melody, step_duration=0.25):
+    """Melody tokens -> SMF bytes laid out the way music21 writes a single-part Stream"""
+    symbols, steps = melody_runs(melody)
+    ticks = np.rint(steps * step_duration * MELODY_RESOLUTION).astype(np.int64)
+    events = bytearray()
+    rest = 0
+    for symbol, duration in zip(symbols.tolist(), ticks.tolist()):
+        if symbol == "R":
+            rest += duration
+            continue
+        if not events:
+            events += b"\x00\xe0\x00\x40"  # music21 centres the pitch wheel before the first note
+        pitch = int(symbol)
+        events += vlq(rest) + bytes((0x90, pitch, MELODY_VELOCITY))
+        events += vlq(duration) + bytes((0x80, pitch, 0))
+        rest = 0
+    # trailing rests are dropped, both tracks end a quarter note after their last event
+    end = vlq(MELODY_RESOLUTION) + _END_OF_TRACK
+    return _smf(MELODY_RESOLUTION, [_TIMING + end, b"\x00\xff\x03\x00" + bytes(events) + end])
+
+
+def drum_pitches(reverse_mapping):
+    """id -> drum pitch table, -1 for "_" and ids outside the vocabulary (the last entry)"""
+    table = np.full(max(reverse_mapping, default=0) + 2, -1, dtype=np.int64)
+    for token, symbol in reverse_mapping.items():
+        if symbol != "_":
+            table[token] = int(symbol)
+    return table
+
+
+def drum_hits(sequence, table, timestep=0.1, hit_duration=0.1, offset=0):
+    """(pitches, note-on ticks, note-off ticks) of the hits in sequence, its first
+    step being step offset of the piece"""
+    seconds_per_tick = 60.0 / (120 * DRUM_RESOLUTION)
+    sequence = np.asarray(sequence, dtype=np.int64).reshape(-1)
+    pitches = table[np.where((sequence >= 0) & (sequence < len(table)), sequence, -1)]
+    hits = np.flatnonzero(pitches >= 0)
+    starts = (hits + offset) * timestep
+    on_ticks = np.rint(starts / seconds_per_tick).astype(np.int64)
+    off_ticks = np.rint((starts + hit_duration) / seconds_per_tick).astype(np.int64)
+    return pitches[hits], on_ticks, off_ticks
+
+
+def drum_tick(step, timestep=0.1):
+    """Tick of the start of step, on the same grid as drum_hits"""
+    return int(np.rint(step * timestep / (60.0 / (120 * DRUM_RESOLUTION))))
+
+
+def drum_to_midi(sequence, reverse_mapping, timestep=0.1, hit_duration=0.1):
+    """Drum token ids -> SMF bytes laid out the way pretty_midi writes one drum instrument"""
+    pitches, on_ticks, off_ticks = drum_hits(sequence, drum_pitches(reverse_mapping), timestep, hit_duration)
+
+    # note-offs are note-ons with velocity 0; at equal ticks events sort by pitch then velocity
+    ticks = np.concatenate([on_ticks, off_ticks])
+    notes = np.concatenate([pitches, pitches])
+    velocities = np.concatenate([np.full(len(pitches), DRUM_VELOCITY), np.zeros(len(pitches), dtype=np.int64)])
+    order = np.lexsort((velocities, notes, ticks))
+
+    status = 0x90 | DRUM_CHANNEL
+    events = bytearray(b"\x00" + bytes((0xC0 | DRUM_CHANNEL, 0)))
+    previous = 0
+    for i, (tick, note, velocity) in enumerate(zip(ticks[order].tolist(), notes[order].tolist(),
+                                                   velocities[order].tolist())):
+        events += vlq(tick - previous)
+        if i == 0:
+            events.append(status)  # running status for the rest
+        events += bytes((note, velocity))
+        previous = tick
+    end = b"\x01" + _END_OF_TRACK
+    return _smf(DRUM_RESOLUTION, [_TIMING + end, bytes(events) + end])
+
+
+def arrangement_to_midi(melody, drums, reverse_mapping, step_seconds=ARRANGEMENT_STEP_SECONDS):
+    """Melody tokens and drum token ids -> one SMF with a melody and a drum track.
+
+    Both are laid on the same grid, one sixteenth note (the melody's quarter step and
+    the drums' timestep) per token, with the tempo set so a step lasts step_seconds.
+    Melody notes are written like melody_to_midi, every drum hit lasts one step.
+    """
+    ticks_per_step = MELODY_RESOLUTION // 4
+    tempo = round(step_seconds * 4 * 1e6)
+
+    symbols, steps = melody_runs(melody)
+    onsets = np.concatenate([[0], np.cumsum(steps)[:-1]]).astype(np.int64)
+    melody_events = []
+    for i, (symbol, onset, length) in enumerate(zip(symbols.tolist(), onsets.tolist(), steps.tolist())):
+        if symbol == "R":
+            continue
+        if not melody_events:
+            melody_events.append((0, -1, b"\xe0\x00\x40"))
+        pitch = int(symbol)
+        melody_events.append((onset * ticks_per_step, 2 * i, bytes((0x90, pitch, MELODY_VELOCITY))))
+        melody_events.append(((onset + length) * ticks_per_step, 2 * i + 1, bytes((0x80, pitch, 0))))
+
+    table = drum_pitches(reverse_mapping)
+    sequence = np.asarray(drums, dtype=np.int64).reshape(-1)
+    pitches = table[np.where((sequence >= 0) & (sequence < len(table)), sequence, -1)]
+    status = 0x90 | DRUM_CHANNEL
+    drum_events = []
+    for step in np.flatnonzero(pitches >= 0).tolist():
+        pitch = int(pitches[step])
+        # note-offs are note-ons with velocity 0 and sort before hits on the same tick
+        drum_events.append((step * ticks_per_step, (pitch, DRUM_VELOCITY), bytes((status, pitch, DRUM_VELOCITY))))
+        drum_events.append(((step + 1) * ticks_per_step, (pitch, 0), bytes((status, pitch, 0))))
+    drum_events.sort(key=lambda event: (event[0], event[1]))
+
+    end = vlq(MELODY_RESOLUTION) + _END_OF_TRACK
+    return _smf(MELODY_RESOLUTION, [
+        _timing(tempo) + end,
+        b"\x00\xff\x03\x00" + _events(melody_events)[0] + end,
+        b"\x00" + bytes((0xC0 | DRUM_CHANNEL, 0)) + _events(drum_events)[0] + end,
+    ])
+
+
+class MidiTrackWriter:
+    """Writes the two-track layout of melody_to_midi / drum_to_midi to a binary file
+    while the notes are still being generated.
+
+    add() takes (tick, key, message) events in absolute ticks, message being the raw
+    MIDI message with its status byte. Events before tick ``until`` are written in
+    (tick, key) order, later ones are held back until the next call, so events of the
+    next chunk that land on the same tick still sort in between. Repeated status bytes
+    are left out (running status). close() patches the note track's length into its
+    header, so the file has to be seekable.
+    """
+
+    def __init__(self, f, resolution, end_delta, prefix=b""):
+        self.f = f
+        self.end = vlq(end_delta) + _END_OF_TRACK
+        f.write(_chunk(b"MThd", struct.pack(">HHH", 1, 2, resolution)))
+        f.write(_chunk(b"MTrk", _TIMING + self.end))
+        f.write(b"MTrk" + struct.pack(">I", 0))
+        self._length_at = f.tell() - 4
+        self.length = 0
+        self._tick = 0
+        self._status = None
+        self._pending = []
+        self._write(prefix)
+
+    def _write(self, data):
+        self.f.write(data)
+        self.length += len(data)
+
+    def add(self, events, until=None):
+        pending = sorted(self._pending + list(events), key=lambda event: (event[0], event[1]))
+        cut = len(pending) if until is None else bisect.bisect_left([event[0] for event in pending], until)
+        out, self._tick, self._status = _events(pending[:cut], self._tick, self._status)
+        self._write(out)
+        self._pending = pending[cut:]
+
+    def close(self):
+        self.add([])
+        self._write(self.end)
+        position = self.f.tell()
+        self.f.seek(self._length_at)
+        self.f.write(struct.pack(">I", self.length))
+        self.f.seek(position)
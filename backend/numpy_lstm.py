@@ -0,0 +1,121 @@
+'''Torch-free inference for the generators' LSTM (embedding -> single-layer LSTM ->
+MLP head), loaded from weights converted to .npz with
+python -m numpy_lstm Final_Final/model.pth Final_Final/model.numpy.npz
+(the conversion is the only step that needs torch).'''
+import argparse
+import contextlib
+
+import numpy as np
+
+
+def _sigmoid(x):
+    return 0.5 * (np.tanh(0.5 * x) + 1.0)
+
+
+class NumpyModel:
+    """Same step()/forward interface as the torch Model, on NumPy arrays.
+
+    ``step(x, state)`` takes token ids (batch, steps) and returns the next-token
+    logits (batch, vocab) and the new state, ``(h, c)`` each (1, batch, hidden)
+    like torch's LSTM, so rows can be joined and dropped along axis 1. Like the
+    torch Model, the head is applied to the LSTM output directly (its LayerNorm
+    result is never used), and without dropout the two linear layers fold into one.
+    """
+
+    is_numpy = True
+
+    def __init__(self, weights, dtype=np.float32):
+        embedding = weights["embedding.weight"].astype(dtype)
+        w_ih = weights["lstm1.weight_ih_l0"].astype(dtype)
+        bias = (weights["lstm1.bias_ih_l0"] + weights["lstm1.bias_hh_l0"]).astype(dtype)
+        # the LSTM input is always an embedding row, so its projection is a lookup table
+        self.input_gates = embedding @ w_ih.T + bias
+        self.w_hh = np.ascontiguousarray(weights["lstm1.weight_hh_l0"].astype(dtype).T)
+        w1, b1 = weights["mlp.0.weight"].astype(dtype), weights["mlp.0.bias"].astype(dtype)
+        w2, b2 = weights["mlp.2.weight"].astype(dtype), weights["mlp.2.bias"].astype(dtype)
+        self.head = np.ascontiguousarray((w2 @ w1).T)
+        self.head_bias = w2 @ b1 + b2
+        self.hidden_dim = self.w_hh.shape[0]
+        self.vocab_size = embedding.shape[0]
+        self.dtype = dtype
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls({name: data[name] for name in data.files if name != "checkpoint_sha256"})
+
+    def eval(self):
+        return self
+
+    def step(self, x, state=None):
+        x = np.asarray(x, dtype=np.int64)
+        batch = x.shape[0]
+        if state is None:
+            h = np.zeros((batch, self.hidden_dim), dtype=self.dtype)
+            c = np.zeros((batch, self.hidden_dim), dtype=self.dtype)
+        else:
+            h, c = state[0][0], state[1][0]
+        hidden = self.hidden_dim
+        for t in range(x.shape[1]):
+            gates = self.input_gates[x[:, t]] + h @ self.w_hh
+            # torch orders the gates input, forget, cell, output
+            i = _sigmoid(gates[:, :hidden])
+            f = _sigmoid(gates[:, hidden:2 * hidden])
+            g = np.tanh(gates[:, 2 * hidden:3 * hidden])
+            o = _sigmoid(gates[:, 3 * hidden:])
+            c = f * c + i * g
+            h = o * np.tanh(c)
+        logits = h @ self.head + self.head_bias
+        return logits, (h[None], c[None])
+
+    def forward(self, x):
+        return self.step(x)[0]
+
+    __call__ = forward
+
+
+def softmax(logits, axis=-1):
+    exp = np.exp(logits - logits.max(axis=axis, keepdims=True))
+    return exp / exp.sum(axis=axis, keepdims=True)
+
+
+def sample(probabilities, rng=None):
+    """One index per row of probabilities, drawn with rng (np.random.Generator)"""
+    rng = rng or np.random.default_rng()
+    probabilities = np.atleast_2d(probabilities)
+    cumulative = np.cumsum(probabilities, axis=-1)
+    draws = rng.random((probabilities.shape[0], 1)) * cumulative[:, -1:]
+    return np.minimum((cumulative < draws).sum(axis=-1), probabilities.shape[-1] - 1)
+
+
+no_grad = contextlib.nullcontext
+
+
+def convert(model_path, npz_path, checkpoint_hash=None):
+    """Dump a torch checkpoint's state dict to .npz, the one step that imports torch"""
+    import torch
+    from serving.cache import file_sha256
+    state_dict = torch.load(model_path, map_location="cpu", weights_only=True)
+    arrays = {name: tensor.numpy() for name, tensor in state_dict.items()}
+    arrays["checkpoint_sha256"] = np.array(checkpoint_hash or file_sha256(model_path))
+    with open(npz_path, "wb") as f:
+        np.savez(f, **arrays)
+    return npz_path
+
+
+def converted_from(npz_path):
+    """sha256 of the checkpoint the weights were converted from, None if not recorded"""
+    with np.load(npz_path) as data:
+        return str(data["checkpoint_sha256"]) if "checkpoint_sha256" in data.files else None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model_path")
+    parser.add_argument("npz_path")
+    args = parser.parse_args()
+    convert(args.model_path, args.npz_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
+
+MEDIA_TYPES = {".wav": "audio/wav", ".mp3": "audio/mpeg"}
+CHUNK_SIZE = 256 * 1024
+
+
+class _Entry:
+    def __init__(self, path, size, mtime, added):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        # the TTL runs from here: a cache hit is a hard link keeping the render's old mtime
+        self.added = added
+        # files are written once and never modified, size + mtime identify the content
+        self.etag = f'"{size:x}-{int(mtime * 1e6):x}"'
+        self.last_modified = formatdate(mtime, usegmt=True)
+
+
+class AudioStore:
+    """Generated audio served from ``root`` under a size and age budget.
+
+    Every file is kept in an in-memory index (LRU by last access) so lookups and
+    conditional/range headers never touch the filesystem. ``sweep`` removes files
+    added to the store more than ``ttl`` seconds ago and then the least recently
+    used ones until the store fits in ``max_bytes``; it runs every ``sweep_interval``
+    seconds in the background and straight away when an added file pushes the store
+    over budget.
+    """
+
+    def __init__(self, root, max_bytes=2 << 30, ttl=24 * 3600, sweep_interval=60.0):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._index = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._task = None
+        self.evicted = 0
+        os.makedirs(root, exist_ok=True)
+        files = []
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if os.path.splitext(name)[1] in MEDIA_TYPES and os.path.isfile(path):
+                stat = os.stat(path)
+                files.append((stat.st_atime, name, stat))
+        for _, name, stat in sorted(files):
+            # linking a file updates its ctime, so this is when it was last handed out
+            added = max(stat.st_mtime, stat.st_ctime)
+            self._insert(name, _Entry(os.path.join(root, name), stat.st_size, stat.st_mtime, added))
+
+    @classmethod
+    def from_env(cls, root):
+        return cls(
+            root,
+            max_bytes=int(os.environ.get("AUDIO_MAX_BYTES", 2 << 30)),
+            ttl=float(os.environ.get("AUDIO_TTL_SECONDS", 24 * 3600)),
+            sweep_interval=float(os.environ.get("AUDIO_SWEEP_SECONDS", 60)),
+        )
+
+    def _insert(self, name, entry):
+        with self._lock:
+            old = self._index.pop(name, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._index[name] = entry
+            self._bytes += entry.size
+            return self._bytes > self.max_bytes
+
+    def add(self, path):
+        """Index a finished file written into the store directory"""
+        name = os.path.basename(path)
+        stat = os.stat(path)
+        if self._insert(name, _Entry(path, stat.st_size, stat.st_mtime, time.time())):
+            self.sweep()
+        return name
+
+    def get(self, name):
+        with self._lock:
+            entry = self._index.get(name)
+            if entry is not None:
+                self._index.move_to_end(name)
+            return entry
+
+    def sweep(self):
+        """Drop expired files, then least recently used ones until under max_bytes"""
+        now = time.time()
+        removed = []
+        with self._lock:
+            for name, entry in list(self._index.items()):
+                if now - entry.added > self.ttl:
+                    removed.append(self._index.pop(name))
+            for entry in removed:
+                self._bytes -= entry.size
+            while self._bytes > self.max_bytes and self._index:
+                _, entry = self._index.popitem(last=False)
+                self._bytes -= entry.size
+                removed.append(entry)
+            self.evicted += len(removed)
+        for entry in removed:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        return len(removed)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await run_in_threadpool(self.sweep)
+            except OSError as e:
+                print(f"Audio store sweep failed: {e!r}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "files": len(self._index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "evicted": self.evicted,
+            }
+
+
+def _not_modified(entry, headers):
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or entry.etag in tags or f"W/{entry.etag}" in tags
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return int(entry.mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _parse_range(value, size):
+    """(start, end) inclusive for a single "bytes=" range, None to send the whole file,
+    or "unsatisfiable". Multiple ranges are answered with the whole file."""
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            if not last:
+                return None
+            start, end = max(size - int(last), 0), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        return "unsatisfiable"
+    return start, min(end, size - 1)
+
+
+async def _read_file(path, start, length):
+    with open(path, "rb") as f:
+        await run_in_threadpool(f.seek, start)
+        while length > 0:
+            chunk = await run_in_threadpool(f.read, min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def file_response(entry, headers):
+    """Response for an indexed file honouring If-None-Match/If-Modified-Since, Range and If-Range"""
+    media_type = MEDIA_TYPES.get(os.path.splitext(entry.path)[1], "application/octet-stream")
+    base_headers = {
+        "etag": entry.etag,
+        "last-modified": entry.last_modified,
+        "accept-ranges": "bytes",
+        "cache-control": "public, max-age=3600",
+    }
+    if _not_modified(entry, headers):
+        return Response(status_code=304, headers=base_headers)
+
+    byte_range = None
+    if "range" in headers:
+        if_range = headers.get("if-range")
+        if if_range is None or if_range.strip() in (entry.etag, entry.last_modified):
+            byte_range = _parse_range(headers["range"], entry.size)
+    if byte_range == "unsatisfiable":
+        return Response(status_code=416, headers={**base_headers, "content-range": f"bytes */{entry.size}"})
+
+    if byte_range is None:
+        start, end, status = 0, entry.size - 1, 200
+    else:
+        (start, end), status = byte_range, 206
+        base_headers["content-range"] = f"bytes {start}-{end}/{entry.size}"
+    length = end - start + 1
+    base_headers["content-length"] = str(length)
+    return StreamingResponse(
+        _read_file(entry.path, start, length), status_code=status, headers=base_headers, media_type=media_type
+    )
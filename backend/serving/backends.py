@@ -0,0 +1,114 @@
+'''CPU inference backends for the LSTM generators.
+
+  eager        the fp32 nn.Module as loaded from the checkpoint
+  torchscript  the same fp32 model compiled with torch.jit.script
+  quantized    LSTM and Linear layers dynamically quantized to int8, then scripted
+  numpy        numpy_lstm on weights converted to .npz, torch is never imported
+
+Exported variants live next to the checkpoint (model.pth -> model.quantized.pt,
+model.numpy.npz) and record the sha256 of the checkpoint they came from. Export
+them ahead of deployment with
+python -m serving.backends --backends torchscript quantized numpy
+run from backend/; a missing or stale export is converted at load time instead
+(which for numpy means torch is needed once).'''
+import argparse
+import copy
+import os
+
+from serving.cache import file_sha256
+
+BACKENDS = ("eager", "torchscript", "quantized", "numpy")
+
+
+def exported_path(model_path, backend):
+    root, _ = os.path.splitext(model_path)
+    return f"{root}.{backend}.{'npz' if backend == 'numpy' else 'pt'}"
+
+
+def numpy_weights(model_path, checkpoint_hash=None):
+    """Path of the .npz weights of a checkpoint, converting them when missing or stale"""
+    import numpy_lstm
+    if model_path.endswith(".npz"):
+        return model_path
+    path = exported_path(model_path, "numpy")
+    checkpoint_hash = checkpoint_hash or file_sha256(model_path)
+    if not os.path.exists(path) or numpy_lstm.converted_from(path) != checkpoint_hash:
+        numpy_lstm.convert(model_path, path, checkpoint_hash)
+    return path
+
+
+def convert(model, backend):
+    """fp32 eager Model -> module for backend, the input model is left untouched"""
+    import torch
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+    if backend == "numpy":
+        import numpy_lstm
+        return numpy_lstm.NumpyModel({name: tensor.cpu().numpy() for name, tensor in model.state_dict().items()})
+    model = copy.deepcopy(model).eval()
+    if backend == "eager":
+        return model
+    if backend == "quantized":
+        if next(model.parameters()).device.type != "cpu":
+            raise ValueError("The quantized backend only runs on CPU")
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8)
+    return torch.jit.script(model)
+
+
+def export(model, model_path, backend, checkpoint_hash=None):
+    import torch
+    path = exported_path(model_path, backend)
+    checkpoint_hash = checkpoint_hash or file_sha256(model_path)
+    if backend == "numpy":
+        import numpy_lstm
+        return numpy_lstm.convert(model_path, path, checkpoint_hash)
+    torch.jit.save(convert(model, backend), path, _extra_files={"checkpoint_sha256": checkpoint_hash})
+    return path
+
+
+def load(model, model_path, backend, checkpoint_hash=None):
+    """model running on backend: the exported archive when it matches the checkpoint,
+    otherwise converted from the fp32 model in-process"""
+    if backend == "eager":
+        return model
+    if backend == "numpy":
+        import numpy_lstm
+        return numpy_lstm.NumpyModel.load(numpy_weights(model_path, checkpoint_hash))
+    import torch
+    path = exported_path(model_path, backend)
+    if os.path.exists(path):
+        extra_files = {"checkpoint_sha256": ""}
+        device = next(model.parameters()).device
+        exported = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+        if extra_files["checkpoint_sha256"].decode() == (checkpoint_hash or file_sha256(model_path)):
+            return exported.eval()
+        print(f"{path} was exported from a different checkpoint, converting {model_path} instead")
+    return convert(model, backend)
+
+
+def main():
+    from drum.drum_gen import DrumGenerator
+    from Final_Final.generator import MelodyGenerator
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["torchscript", "quantized", "numpy"],
+                        choices=[b for b in BACKENDS if b != "eager"])
+    parser.add_argument("--melody", default="Final_Final/model.pth")
+    parser.add_argument("--melody-map", default="Final_Final/map.json")
+    parser.add_argument("--drum", default="drum/model_drum.pth")
+    parser.add_argument("--drum-map", default="drum/drum_map.json")
+    args = parser.parse_args()
+
+    checkpoints = [
+        (MelodyGenerator, args.melody, args.melody_map),
+        (DrumGenerator, args.drum, args.drum_map),
+    ]
+    for generator_cls, model_path, map_path in checkpoints:
+        model = generator_cls(model_path=model_path, map_path=map_path).model.cpu()
+        for backend in args.backends:
+            path = export(model, model_path, backend)
+            print(f"{backend:<12} {path} ({os.path.getsize(path) / 1e6:.2f} MB)")
+
+
+if __name__ == "__main__":
+    main()
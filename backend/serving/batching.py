@@ -0,0 +1,310 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class _Row:
+    def __init__(self, prompt, max_tokens, temperature, end_id, generator, score=False):
+        self.prompt = list(prompt)
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.end_id = end_id
+        self.generator = generator
+        self.score = score
+        self.tokens = []
+        self.log_likelihood = 0.0
+        self.sampled = 0
+        self.future = Future()
+
+    def finish(self):
+        # a request that was cancelled or timed out has already resolved its future
+        if self.future.done():
+            return
+        if self.score:
+            self.future.set_result((self.tokens, self.log_likelihood / max(self.sampled, 1)))
+        else:
+            self.future.set_result(self.tokens)
+
+    def fail(self, error):
+        if not self.future.done():
+            self.future.set_exception(error)
+
+
+class _Call:
+    """fn queued to run on the scheduler thread (BatchScheduler.call)"""
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.future = Future()
+
+    def run(self):
+        try:
+            self.future.set_result(self.fn())
+        except Exception as e:
+            self.future.set_exception(e)
+
+
+class _TorchOps:
+    """Array operations of the scheduler for torch models"""
+
+    def __init__(self, model):
+        import torch
+        self.torch = torch
+        self.device = next(model.parameters()).device
+
+    def no_grad(self):
+        return self.torch.no_grad()
+
+    def tokens(self, rows):
+        return self.torch.tensor(rows, device=self.device)
+
+    def cat(self, arrays, dim=0):
+        return self.torch.cat(arrays, dim=dim)
+
+    def select(self, array, index, dim):
+        return array.index_select(dim, self.torch.tensor(index, device=self.device))
+
+    def sample(self, logits, temperatures, generators):
+        """One token per row, rows with their own generator are sampled from it"""
+        torch = self.torch
+        temperatures = torch.tensor(temperatures, device=self.device).unsqueeze(1)
+        probabilities = torch.softmax(logits / temperatures, dim=-1)
+        seeded = [i for i, generator in enumerate(generators) if generator is not None]
+        if len(seeded) < len(generators):
+            sampled = torch.multinomial(probabilities, num_samples=1).squeeze(1).tolist()
+        else:
+            sampled = [None] * len(generators)
+        for i in seeded:
+            sampled[i] = torch.multinomial(probabilities[i], num_samples=1, generator=generators[i]).item()
+        return sampled
+
+    def log_probs(self, logits, index, tokens):
+        """log-probability of tokens[j] in row index[j] of logits, at temperature 1"""
+        torch = self.torch
+        rows = torch.log_softmax(self.select(logits, index, 0).float(), dim=-1)
+        return rows.gather(1, torch.tensor(tokens, device=self.device).unsqueeze(1)).squeeze(1).tolist()
+
+
+class _NumpyOps:
+    """Array operations of the scheduler for numpy_lstm models, torch is never imported"""
+
+    def __init__(self, model):
+        import numpy as np
+        import numpy_lstm
+        self.np = np
+        self.numpy_lstm = numpy_lstm
+
+    def no_grad(self):
+        return self.numpy_lstm.no_grad()
+
+    def tokens(self, rows):
+        return self.np.asarray(rows)
+
+    def cat(self, arrays, dim=0):
+        return self.np.concatenate(arrays, axis=dim)
+
+    def select(self, array, index, dim):
+        return self.np.take(array, index, axis=dim)
+
+    def sample(self, logits, temperatures, generators):
+        probabilities = self.numpy_lstm.softmax(logits / self.np.asarray(temperatures, dtype=logits.dtype)[:, None])
+        sampled = self.numpy_lstm.sample(probabilities).tolist()
+        for i, generator in enumerate(generators):
+            if generator is not None:
+                sampled[i] = int(self.numpy_lstm.sample(probabilities[i], generator)[0])
+        return sampled
+
+    def log_probs(self, logits, index, tokens):
+        rows = self.np.log(self.numpy_lstm.softmax(self.np.take(logits, index, axis=0)))
+        return rows[self.np.arange(len(index)), tokens].tolist()
+
+
+def _ops(model):
+    return _NumpyOps(model) if getattr(model, "is_numpy", False) else _TorchOps(model)
+
+
+class BatchScheduler:
+    """Steps concurrent generation requests for one model as a single batched LSTM forward.
+
+    Requests arriving within ``window_ms`` of each other start together; rows that hit
+    their length or the end token leave the batch and queued rows join it between steps.
+    Each row keeps its own temperature, length and end token.
+
+    ``get_model`` is called whenever a fresh batch starts, so a model hot-reloaded in
+    the registry is picked up without dropping in-flight rows.
+    """
+
+    def __init__(self, get_model, max_batch=32, window_ms=5.0):
+        self.get_model = get_model
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+    def submit(self, prompt, max_tokens, temperature=1.0, end_id=None, generator=None, score=False):
+        """Queue one row, the returned Future resolves to the list of sampled token ids
+        (without the prompt, and without the end token if one was sampled).
+        Rows with their own generator (torch.Generator, or np.random.Generator for NumPy
+        models) are sampled from it, so they are reproducible. With score the Future
+        resolves to (token ids, mean log-probability of every sampled id under the model
+        at temperature 1, the end token included). Rows submitted back to back join the
+        same batch."""
+        if not temperature > 0:
+            raise ValueError(f"temperature must be positive, got {temperature}")
+        row = _Row(prompt, max_tokens, temperature, end_id, generator, score)
+        if max_tokens <= 0:
+            row.finish()
+        else:
+            self.start()
+            self._queue.put(row)
+        return row.future
+
+    def call(self, fn):
+        """Run fn on the scheduler thread before its next step, for thread-bound state such
+        as the torch profiler. The returned Future resolves to fn's result."""
+        call = _Call(fn)
+        self.start()
+        self._queue.put(call)
+        return call.future
+
+    def queued(self):
+        """Rows waiting to join the batch"""
+        return self._queue.qsize()
+
+    def _collect(self, block, limit):
+        """Pull up to limit queued rows. When block is set, wait for a first row and then
+        keep gathering until the batching window closes. Returns (rows, stop_requested)"""
+        rows = []
+        deadline = None
+        while len(rows) < limit:
+            try:
+                if not block:
+                    row = self._queue.get_nowait()
+                elif deadline is None:
+                    row = self._queue.get()
+                    deadline = time.monotonic() + self.window
+                else:
+                    row = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if row is None:
+                return rows, True
+            if isinstance(row, _Call):
+                row.run()
+                continue
+            rows.append(row)
+        return rows, False
+
+    def _prime(self, model, ops, rows):
+        """Run the prompts of newly joined rows, grouped by length so each group is one forward"""
+        by_length = {}
+        for row in rows:
+            by_length.setdefault(len(row.prompt), []).append(row)
+        ordered, logits, hs, cs = [], [], [], []
+        for group in by_length.values():
+            group_logits, (h, c) = model.step(ops.tokens([row.prompt for row in group]))
+            ordered.extend(group)
+            logits.append(group_logits)
+            hs.append(h)
+            cs.append(c)
+        return ordered, ops.cat(logits), (ops.cat(hs, dim=1), ops.cat(cs, dim=1))
+
+    def _sample_rows(self, ops, rows, logits):
+        """Sample row by row after the batched sampling failed: the rows that fail on their
+        own get the error, the others a token (None for the failed ones)"""
+        sampled = []
+        for i, row in enumerate(rows):
+            try:
+                sampled.append(ops.sample(ops.select(logits, [i], 0), [row.temperature], [row.generator])[0])
+            except Exception as e:
+                row.fail(e)
+                sampled.append(None)
+        return sampled
+
+    def _step(self, model, ops, rows, logits, state):
+        """Sample one token for every row, retire finished rows and advance the rest"""
+        live = [i for i, row in enumerate(rows) if not row.future.done()]
+        if len(live) < len(rows):
+            # cancelled or timed out requests leave the batch
+            if not live:
+                return [], None, None
+            rows = [rows[i] for i in live]
+            logits = ops.select(logits, live, 0)
+            state = (ops.select(state[0], live, 1), ops.select(state[1], live, 1))
+
+        try:
+            sampled = ops.sample(logits, [row.temperature for row in rows], [row.generator for row in rows])
+        except Exception:
+            sampled = self._sample_rows(ops, rows, logits)
+        scored = [i for i, row in enumerate(rows) if row.score and sampled[i] is not None]
+        if scored:
+            for i, log_prob in zip(scored, ops.log_probs(logits, scored, [sampled[i] for i in scored])):
+                rows[i].log_likelihood += log_prob
+                rows[i].sampled += 1
+
+        keep = []
+        for i, (row, token) in enumerate(zip(rows, sampled)):
+            if token is None:
+                continue
+            if token == row.end_id:
+                row.finish()
+                continue
+            row.tokens.append(token)
+            if len(row.tokens) >= row.max_tokens:
+                row.finish()
+                continue
+            keep.append(i)
+
+        if not keep:
+            return [], None, None
+        if len(keep) < len(rows):
+            rows = [rows[i] for i in keep]
+            state = (ops.select(state[0], keep, 1), ops.select(state[1], keep, 1))
+        logits, state = model.step(ops.tokens([[row.tokens[-1]] for row in rows]), state)
+        return rows, logits, state
+
+    def _run(self):
+        rows, logits, state = [], None, None
+        model, ops = None, None
+        stopping = False
+        while rows or not stopping:
+            joining = []
+            if not stopping:
+                joining, stopping = self._collect(block=not rows, limit=self.max_batch - len(rows))
+                joining = [row for row in joining if not row.future.done()]
+            if not rows and not joining:
+                continue
+            if not rows:
+                model = self.get_model()
+                ops = _ops(model)
+            try:
+                with ops.no_grad():
+                    if joining:
+                        joining, new_logits, new_state = self._prime(model, ops, joining)
+                        if rows:
+                            logits = ops.cat([logits, new_logits])
+                            state = (ops.cat([state[0], new_state[0]], dim=1),
+                                     ops.cat([state[1], new_state[1]], dim=1))
+                        else:
+                            logits, state = new_logits, new_state
+                        rows = rows + joining
+                    rows, logits, state = self._step(model, ops, rows, logits, state)
+            except Exception as e:
+                for row in rows + joining:
+                    row.fail(e)
+                rows, logits, state = [], None, None
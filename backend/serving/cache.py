@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def generation_key(checkpoint_hash, model_type, seed, temperature, length, rng_seed):
+    """Cache key of one deterministic generation, seed is the list of seed tokens"""
+    payload = json.dumps([checkpoint_hash, model_type, list(seed), float(temperature), length, rng_seed])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class _LRU:
+    """Size-bounded LRU index, evict() returns the keys that no longer fit"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.bytes = 0
+
+    def touch(self, key):
+        if key in self.items:
+            self.items.move_to_end(key)
+            return True
+        return False
+
+    def add(self, key, size):
+        if key in self.items:
+            self.bytes -= self.items.pop(key)
+        self.items[key] = size
+        self.bytes += size
+        return self.evict()
+
+    def remove(self, key):
+        if key in self.items:
+            self.bytes -= self.items.pop(key)
+
+    def evict(self):
+        evicted = []
+        while self.bytes > self.max_bytes and len(self.items) > 1:
+            key, size = self.items.popitem(last=False)
+            self.bytes -= size
+            evicted.append(key)
+        return evicted
+
+
+class OutputCache:
+    """Content-addressed cache of generations and their renders.
+
+    * generation key (checkpoint hash, seed, temperature, length, rng seed) -> token
+      sequence and MIDI hash, in ``entries/``
+    * MIDI hash -> MIDI bytes in ``midi/`` and rendered audio in ``audio/``, so audio
+      can be found from the MIDI alone
+
+    Everything lives on disk under a byte budget with LRU eviction; entries and MIDI
+    (both small) are also kept in a bounded in-memory LRU.
+    """
+
+    def __init__(self, cache_dir, max_disk_bytes=1 << 30, max_memory_bytes=64 << 20):
+        self.cache_dir = cache_dir
+        for sub in ("entries", "midi", "audio"):
+            os.makedirs(os.path.join(cache_dir, sub), exist_ok=True)
+        self._lock = threading.Lock()
+        self._memory = {}
+        self._memory_lru = _LRU(max_memory_bytes)
+        self._disk_lru = _LRU(max_disk_bytes)
+        self.hits = 0
+        self.misses = 0
+        # rebuild the disk index, oldest first so they are evicted first
+        files = []
+        for sub in ("entries", "midi", "audio"):
+            folder = os.path.join(cache_dir, sub)
+            for name in os.listdir(folder):
+                path = os.path.join(folder, name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(files):
+            self._disk_lru.add(path, size)
+        self._evict_disk(self._disk_lru.evict())
+
+    @classmethod
+    def from_env(cls):
+        if os.environ.get("CACHE_DISABLED") == "1":
+            return None
+        return cls(
+            os.environ.get("CACHE_DIR", "static/cache"),
+            max_disk_bytes=int(os.environ.get("CACHE_MAX_BYTES", 1 << 30)),
+            max_memory_bytes=int(os.environ.get("CACHE_MEMORY_BYTES", 64 << 20)),
+        )
+
+    def _path(self, kind, name):
+        return os.path.join(self.cache_dir, kind, name)
+
+    def _evict_disk(self, paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _remember(self, path, data):
+        with self._lock:
+            self._memory[path] = data
+            for evicted in self._memory_lru.add(path, len(data)):
+                self._memory.pop(evicted, None)
+
+    def _read(self, path):
+        with self._lock:
+            if self._memory_lru.touch(path):
+                self._disk_lru.touch(path)
+                return self._memory[path]
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self._disk_lru.remove(path)
+            return None
+        with self._lock:
+            self._disk_lru.touch(path)
+        self._remember(path, data)
+        return data
+
+    def _write(self, path, data):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            evicted = self._disk_lru.add(path, len(data))
+        self._evict_disk(evicted)
+
+    def get_generation(self, key):
+        """(tokens, midi bytes, log-likelihood score or None) or None"""
+        raw = self._read(self._path("entries", f"{key}.json"))
+        entry = json.loads(raw) if raw is not None else None
+        midi = self.get_midi(entry["midi_hash"]) if entry else None
+        with self._lock:
+            if midi is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return entry["tokens"], midi, entry.get("score")
+
+    def put_generation(self, key, tokens, midi, score=None):
+        midi_hash = self.put_midi(midi)
+        data = json.dumps({"tokens": list(tokens), "midi_hash": midi_hash, "score": score}).encode()
+        path = self._path("entries", f"{key}.json")
+        self._write(path, data)
+        self._remember(path, data)
+        return midi_hash
+
+    def get_midi(self, midi_hash):
+        return self._read(self._path("midi", f"{midi_hash}.mid"))
+
+    def put_midi(self, midi):
+        midi_hash = hashlib.sha256(midi).hexdigest()
+        path = self._path("midi", f"{midi_hash}.mid")
+        if not os.path.exists(path):
+            self._write(path, midi)
+            self._remember(path, midi)
+        return midi_hash
+
+    def audio_path(self, midi_hash, fmt):
+        """Path of the cached render of this MIDI in fmt ("wav"/"mp3"), or None"""
+        path = self._path("audio", f"{midi_hash}.{fmt}")
+        with self._lock:
+            if not self._disk_lru.touch(path):
+                return None
+        if not os.path.exists(path):
+            with self._lock:
+                self._disk_lru.remove(path)
+            return None
+        return path
+
+    def put_audio(self, midi_hash, fmt, source_path):
+        path = self._path("audio", f"{midi_hash}.{fmt}")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        link_or_copy(source_path, tmp_path)
+        os.replace(tmp_path, path)
+        with self._lock:
+            evicted = self._disk_lru.add(path, os.path.getsize(path))
+        self._evict_disk(evicted)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "disk_bytes": self._disk_lru.bytes,
+                "memory_bytes": self._memory_lru.bytes,
+                "disk_files": len(self._disk_lru.items),
+            }
+
+
+def link_or_copy(source, destination):
+    """Hard link when both paths are on the same filesystem, the audio is never modified in place"""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
@@ -0,0 +1,188 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+
+class Overloaded(Exception):
+    """Raised when the request queue is full, the API turns it into a 503"""
+
+
+class _WaitStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "mean_seconds": self.total / self.count if self.count else 0.0,
+            "max_seconds": self.max,
+        }
+
+
+async def _feed(process, input):
+    """Write input (bytes or an async iterable of bytes) to the process's stdin and close it"""
+    try:
+        if isinstance(input, (bytes, bytearray)):
+            process.stdin.write(input)
+            await process.stdin.drain()
+        else:
+            async for chunk in input:
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        process.stdin.close()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+
+
+class ExecutionLayer:
+    """Keeps blocking work off the asyncio event loop.
+
+    * at most ``max_active`` requests run the pipeline at once, up to ``max_queue`` more
+      wait for a slot and anything beyond that is rejected with ``Overloaded``
+    * blocking Python work runs on a thread pool (``run_in_thread``): MIDI writing, WAV
+      and file writes, cache I/O. Model steps run on the batch schedulers' own threads
+    * fluidsynth/ffmpeg run through ``asyncio.create_subprocess_exec`` with at most
+      ``render_concurrency`` processes alive (``run_subprocess``)
+    """
+
+    def __init__(self, io_threads=4, render_concurrency=2, max_active=8, max_queue=32):
+        self.io_threads = io_threads
+        self.render_concurrency = render_concurrency
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(io_threads, thread_name_prefix="io")
+        self._active = asyncio.Semaphore(max_active)
+        self._render = asyncio.Semaphore(render_concurrency)
+        self.waiting = 0
+        self.running = 0
+        self.rendering = 0
+        self.rejected = 0
+        self.queue_wait = _WaitStats()
+        self.render_wait = _WaitStats()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            # INFERENCE_THREADS is the name from before sampling moved to the batch schedulers
+            io_threads=int(os.environ.get("IO_THREADS", os.environ.get("INFERENCE_THREADS", 4))),
+            render_concurrency=int(os.environ.get("RENDER_CONCURRENCY", 2)),
+            max_active=int(os.environ.get("MAX_ACTIVE_REQUESTS", 8)),
+            max_queue=int(os.environ.get("MAX_QUEUED_REQUESTS", 32)),
+        )
+
+    @asynccontextmanager
+    async def slot(self):
+        """Admission control for one request, raises Overloaded when the queue is full"""
+        if self._active.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded("Server busy, try again later")
+        self.waiting += 1
+        start = time.monotonic()
+        try:
+            await self._active.acquire()
+        finally:
+            self.waiting -= 1
+        self.queue_wait.add(time.monotonic() - start)
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._active.release()
+
+    async def run_in_thread(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, lambda: fn(*args, **kwargs))
+
+    async def run_subprocess(self, command, name, input=None):
+        """Run command without blocking the loop, feeding it input on stdin (bytes, or an
+        async iterable of bytes written as it produces them).
+        Returns its stdout, raises RuntimeError with its stderr on failure"""
+        start = time.monotonic()
+        async with self._render:
+            self.render_wait.add(time.monotonic() - start)
+            self.rendering += 1
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *command,
+                    stdin=asyncio.subprocess.PIPE if input is not None else None,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                if input is None or isinstance(input, (bytes, bytearray)):
+                    stdout, stderr = await process.communicate(input)
+                else:
+                    _, stdout, stderr = await asyncio.gather(_feed(process, input), process.stdout.read(),
+                                                             process.stderr.read())
+                    await process.wait()
+            finally:
+                self.rendering -= 1
+        if process.returncode != 0:
+            error_msg = f"{name} error: {stderr.decode()}"
+            print(error_msg)
+            raise RuntimeError(error_msg)
+        return stdout
+
+    async def stream_subprocess(self, command, name, input, chunk_size=64 * 1024):
+        """Like run_subprocess, but yields stdout in chunks while the process is still
+        writing it. The process is killed if the consumer stops early."""
+        start = time.monotonic()
+        async with self._render:
+            self.render_wait.add(time.monotonic() - start)
+            self.rendering += 1
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+
+            feeder = asyncio.create_task(_feed(process, input))
+            stderr = asyncio.create_task(process.stderr.read())
+            try:
+                while True:
+                    chunk = await process.stdout.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+                await feeder
+                await process.wait()
+            finally:
+                self.rendering -= 1
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                feeder.cancel()
+        if process.returncode != 0:
+            error_msg = f"{name} error: {(await stderr).decode()}"
+            print(error_msg)
+            raise RuntimeError(error_msg)
+
+    def metrics(self):
+        return {
+            "queue_depth": self.waiting,
+            "active_requests": self.running,
+            "active_renders": self.rendering,
+            "io_backlog": self._pool._work_queue.qsize(),
+            "rejected_requests": self.rejected,
+            "queue_wait": self.queue_wait.as_dict(),
+            "render_wait": self.render_wait.as_dict(),
+            "limits": {
+                "io_threads": self.io_threads,
+                "render_concurrency": self.render_concurrency,
+                "max_active": self.max_active,
+                "max_queue": self.max_queue,
+            },
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
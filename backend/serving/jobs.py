@@ -0,0 +1,285 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+
+def _new_job(params, stages):
+    now = time.time()
+    return {
+        "id": uuid.uuid4().hex,
+        "status": QUEUED,
+        "params": params,
+        "progress": {stage: "pending" for stage in stages},
+        "result": {},
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+class InMemoryJobStore:
+    """Jobs live in this process only, lost on restart"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._queue = []
+        self._lock = threading.Lock()
+
+    def create(self, params, stages):
+        job = _new_job(params, stages)
+        with self._lock:
+            self._jobs[job["id"]] = job
+            self._queue.append(job["id"])
+        return dict(job)
+
+    def claim(self):
+        """Oldest queued job marked as running, or None"""
+        with self._lock:
+            if not self._queue:
+                return None
+            job = self._jobs[self._queue.pop(0)]
+            job["status"] = RUNNING
+            job["updated_at"] = time.time()
+            return dict(job)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            job["updated_at"] = time.time()
+
+    def set_stage(self, job_id, stage, state):
+        with self._lock:
+            job = self._jobs[job_id]
+            job["progress"] = {**job["progress"], stage: state}
+            job["updated_at"] = time.time()
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def queued(self):
+        with self._lock:
+            return len(self._queue)
+
+    def expire(self, before):
+        """Delete finished jobs last updated before the timestamp, returns their ids"""
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job["status"] in FINISHED and job["updated_at"] < before]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return expired
+
+    def fail_stale(self, before, error):
+        """Mark running jobs last updated before the timestamp as failed, returns how many"""
+        with self._lock:
+            stale = [job for job in self._jobs.values() if job["status"] == RUNNING and job["updated_at"] < before]
+            for job in stale:
+                job.update(status=FAILED, error=error, updated_at=time.time())
+        return len(stale)
+
+
+class SQLiteJobStore:
+    """Jobs persisted in a SQLite file, survives restarts and can be shared by several
+    server processes on the same host"""
+
+    _COLUMNS = ("id", "status", "params", "progress", "result", "error", "created_at", "updated_at")
+    _JSON = ("params", "progress", "result")
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT, params TEXT, progress TEXT, result TEXT, "
+                "error TEXT, created_at REAL, updated_at REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def _row_to_job(self, row):
+        job = dict(zip(self._COLUMNS, row))
+        for key in self._JSON:
+            job[key] = json.loads(job[key])
+        return job
+
+    def create(self, params, stages):
+        job = _new_job(params, stages)
+        values = [json.dumps(job[c]) if c in self._JSON else job[c] for c in self._COLUMNS]
+        with self._lock:
+            self._conn.execute(f"INSERT INTO jobs VALUES ({', '.join('?' * len(values))})", values)
+        return job
+
+    def claim(self):
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ("
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1) "
+                f"RETURNING {', '.join(self._COLUMNS)}",
+                (RUNNING, time.time(), QUEUED),
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{key} = ?" for key in fields)
+        values = [json.dumps(v) if k in self._JSON else v for k, v in fields.items()]
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", values + [job_id])
+
+    def set_stage(self, job_id, stage, state):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET progress = json_set(progress, ?, ?), updated_at = ? WHERE id = ?",
+                (f'$."{stage}"', state, time.time(), job_id),
+            )
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def queued(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+
+    def expire(self, before):
+        with self._lock:
+            rows = self._conn.execute(
+                f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED))}) AND updated_at < ? RETURNING id",
+                (*FINISHED, before),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def fail_stale(self, before, error):
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE status = ? AND updated_at < ?",
+                (FAILED, error, time.time(), RUNNING, before),
+            ).rowcount
+
+
+def store_from_env():
+    backend = os.environ.get("JOB_STORE", "memory")
+    if backend == "memory":
+        return InMemoryJobStore()
+    if backend == "sqlite":
+        return SQLiteJobStore(os.environ.get("JOB_DB_PATH", "jobs.sqlite3"))
+    raise ValueError(f"Unknown JOB_STORE: {backend}")
+
+
+class JobManager:
+    """Runs queued jobs through ``run_job`` on a pool of local asyncio workers.
+
+    ``run_job(job, progress)`` is awaited for each job and returns the result dict
+    stored on the job; ``progress(stage, state)`` records per-stage progress.
+    The web handlers only ever enqueue and read, they never wait for a job.
+
+    Finished jobs are deleted ``ttl`` seconds after they finished, with their
+    directory under ``results_dir`` (named after the job id), by a sweep every
+    ``sweep_interval`` seconds. On start, jobs left running for more than
+    ``stale_after`` seconds (by a server that died) are marked failed.
+    """
+
+    def __init__(self, store, run_job, workers=2, poll_interval=0.5, results_dir=None, ttl=24 * 3600,
+                 sweep_interval=600.0, stale_after=3600.0):
+        self.store = store
+        self.run_job = run_job
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.results_dir = results_dir
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.stale_after = stale_after
+        self._wakeup = None
+        self._tasks = []
+
+    def submit(self, params, stages):
+        job = self.store.create(params, stages)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def start(self):
+        stale = self.store.fail_stale(time.time() - self.stale_after, "Server restarted while the job ran")
+        if stale:
+            print(f"Marked {stale} interrupted jobs as failed")
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweep_loop()))
+
+    def sweep(self):
+        """Delete expired jobs and their files, and result directories of jobs the store
+        no longer knows (an in-memory store after a restart). Returns the jobs deleted"""
+        cutoff = time.time() - self.ttl
+        expired = self.store.expire(cutoff)
+        if self.results_dir is None:
+            return len(expired)
+        for job_id in expired:
+            shutil.rmtree(os.path.join(self.results_dir, job_id), ignore_errors=True)
+        try:
+            names = os.listdir(self.results_dir)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            path = os.path.join(self.results_dir, name)
+            try:
+                orphaned = os.path.getmtime(path) < cutoff and self.store.get(name) is None
+            except FileNotFoundError:
+                continue
+            if orphaned:
+                shutil.rmtree(path, ignore_errors=True)
+        return len(expired)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await asyncio.to_thread(self.sweep)
+            except (OSError, sqlite3.Error) as e:
+                print(f"Job sweep failed: {e!r}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            job = self.store.claim()
+            if job is None:
+                # the poll covers jobs queued by other processes sharing the store
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            job_id = job["id"]
+            try:
+                result = await self.run_job(
+                    job, lambda stage, state: self.store.set_stage(job_id, stage, state)
+                )
+                self.store.update(job_id, status=DONE, result=result)
+            except asyncio.CancelledError:
+                self.store.update(job_id, status=FAILED, error="Server shut down")
+                raise
+            except Exception as e:
+                self.store.update(job_id, status=FAILED, error=str(e))
@@ -0,0 +1,162 @@
+'''Chunking for long-form generation (GenerationPipeline.run_long).
+
+Sampled tokens are collected into chunks of whole bars. Each finished chunk is
+appended to the piece's MIDI file (MidiTrackWriter) and rendered on its own by the
+synth pool. The rendered chunks are joined by OverlapAdd and encoded as they
+arrive. So only about one chunk of tokens and audio is held at a time, however
+long the piece is.'''
+import numpy as np
+
+from midi_writer import (DRUM_CHANNEL, DRUM_RESOLUTION, DRUM_VELOCITY, MELODY_RESOLUTION, MELODY_VELOCITY,
+                         TEMPO, MidiTrackWriter, drum_hits, drum_pitches, drum_tick, drum_to_midi, melody_runs,
+                         melody_to_midi)
+from serving.streaming import STEPS_PER_BAR, last_symbol
+
+CHUNK_BARS = 8
+
+
+class MelodyChunks:
+    """Melody tokens cut into chunks that start on a note or rest, so no note is held
+    across a chunk boundary. A chunk is cut at the first new symbol after chunk_bars
+    bars, or at 2 * chunk_bars bars when a single note lasts that long; that note is
+    re-struck at the start of the next chunk."""
+
+    step_duration = 0.25  # quarter notes
+    step_seconds = step_duration * TEMPO / 1e6
+    ticks_per_step = int(step_duration * MELODY_RESOLUTION)
+    resolution = MELODY_RESOLUTION
+
+    def __init__(self, chunk_bars=CHUNK_BARS):
+        self.chunk_steps = chunk_bars * STEPS_PER_BAR
+        self.tokens = []
+        self.start = 0
+        self.held = None
+        self.notes = 0
+
+    def add(self, token):
+        """Adds the next token of the piece, returns the chunks it completes as
+        (first step, tokens, final) tuples"""
+        if not self.tokens and token == "_" and self.held is not None:
+            token = self.held
+        self.held = None
+        self.tokens.append(token)
+        if token != "_" and len(self.tokens) > self.chunk_steps:
+            chunk = (self.start, self.tokens[:-1], False)
+            self.start += len(chunk[1])
+            self.tokens = [token]
+            return [chunk]
+        if len(self.tokens) >= 2 * self.chunk_steps:
+            chunk = (self.start, self.tokens, False)
+            self.start += len(self.tokens)
+            self.held = last_symbol(self.tokens)
+            self.tokens = []
+            return [chunk]
+        return []
+
+    def finish(self):
+        chunk = (self.start, self.tokens, True)
+        self.start += len(self.tokens)
+        self.tokens = []
+        return [chunk]
+
+    def _closed(self, tokens, final):
+        # a trailing rest marks where the last note of a chunk ends; the piece's very
+        # last symbol is dropped like melody_to_midi drops it
+        return tokens if final else tokens + ["R"]
+
+    def midi(self, tokens, final):
+        """The chunk on its own, for the synth"""
+        return melody_to_midi(self._closed(tokens, final), self.step_duration)
+
+    def writer(self, f):
+        return MidiTrackWriter(f, MELODY_RESOLUTION, MELODY_RESOLUTION, prefix=b"\x00\xff\x03\x00")
+
+    def events(self, start, tokens, final):
+        """MidiTrackWriter events of the chunk, the same notes melody_to_midi writes for the piece"""
+        symbols, steps = melody_runs(self._closed(tokens, final))
+        onsets = start + np.concatenate([[0], np.cumsum(steps)[:-1]]).astype(np.int64)
+        events = []
+        for symbol, onset, length in zip(symbols.tolist(), onsets.tolist(), steps.tolist()):
+            if symbol == "R":
+                continue
+            if self.notes == 0:
+                # melody_to_midi centres the pitch wheel before the first note
+                events.append((0, -1, b"\xe0\x00\x40"))
+            pitch = int(symbol)
+            events.append((onset * self.ticks_per_step, 2 * self.notes, bytes((0x90, pitch, MELODY_VELOCITY))))
+            events.append(((onset + length) * self.ticks_per_step, 2 * self.notes + 1, bytes((0x80, pitch, 0))))
+            self.notes += 1
+        return events
+
+    def tick(self, step):
+        return step * self.ticks_per_step
+
+
+class DrumChunks:
+    """Drum token ids cut into chunks of exactly chunk_bars bars (every hit lasts one step)"""
+
+    step_seconds = 0.1
+    resolution = DRUM_RESOLUTION
+
+    def __init__(self, reverse_mapping, chunk_bars=CHUNK_BARS):
+        self.chunk_steps = chunk_bars * STEPS_PER_BAR
+        self.reverse_mapping = reverse_mapping
+        self.table = drum_pitches(reverse_mapping)
+        self.tokens = []
+        self.start = 0
+
+    def add(self, token):
+        self.tokens.append(token)
+        if len(self.tokens) < self.chunk_steps:
+            return []
+        return self.finish(final=False)
+
+    def finish(self, final=True):
+        chunk = (self.start, self.tokens, final)
+        self.start += len(self.tokens)
+        self.tokens = []
+        return [chunk]
+
+    def midi(self, tokens, final):
+        return drum_to_midi(tokens, self.reverse_mapping, self.step_seconds)
+
+    def writer(self, f):
+        return MidiTrackWriter(f, DRUM_RESOLUTION, 1, prefix=b"\x00" + bytes((0xC0 | DRUM_CHANNEL, 0)))
+
+    def events(self, start, tokens, final):
+        """MidiTrackWriter events of the chunk, the same notes drum_to_midi writes for the piece"""
+        pitches, on_ticks, off_ticks = drum_hits(tokens, self.table, self.step_seconds, offset=start)
+        status = 0x90 | DRUM_CHANNEL
+        events = []
+        for pitch, on, off in zip(pitches.tolist(), on_ticks.tolist(), off_ticks.tolist()):
+            # note-offs are note-ons with velocity 0, sorted by pitch then velocity like drum_to_midi
+            events.append((on, (pitch, DRUM_VELOCITY), bytes((status, pitch, DRUM_VELOCITY))))
+            events.append((off, (pitch, 0), bytes((status, pitch, 0))))
+        return events
+
+    def tick(self, step):
+        return drum_tick(step, self.step_seconds)
+
+
+class OverlapAdd:
+    """Joins chunks rendered on their own into one signal. Each chunk's audio past
+    its own length (the release of its last notes) is mixed into the start of the
+    next chunk instead of being cut off or appended."""
+
+    def __init__(self, channels=2):
+        self.channels = channels
+        self.carry = np.zeros((0, channels), dtype=np.int32)
+
+    def add(self, pcm, frames):
+        """s16le PCM of one chunk -> the next frames frames of the joined signal"""
+        audio = np.frombuffer(pcm, dtype=np.int16).reshape(-1, self.channels)
+        mixed = np.zeros((max(frames, len(audio), len(self.carry)), self.channels), dtype=np.int32)
+        mixed[:len(audio)] += audio
+        mixed[:len(self.carry)] += self.carry
+        self.carry = mixed[frames:]
+        return np.clip(mixed[:frames], -32768, 32767).astype(np.int16).tobytes()
+
+    def finish(self):
+        """The release of the last chunk"""
+        tail, self.carry = self.carry, self.carry[:0]
+        return np.clip(tail, -32768, 32767).astype(np.int16).tobytes()
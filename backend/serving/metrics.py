@@ -0,0 +1,241 @@
+'''Prometheus metrics of the generation pipeline, served in the text exposition
+format by GET /metrics.
+
+Histograms and counters are kept here, without prometheus_client. Gauges are read
+from the components (execution layer, schedulers, cache, ...) when /metrics is
+scraped, so nothing on the request path updates them.
+
+Stage durations also go into the trace of the current request (see trace()), which
+the API returns as a Server-Timing header.'''
+import contextvars
+import math
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# seconds, from a MIDI write to a multi-minute long-form render
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+                    60.0, 300.0)
+RATE_BUCKETS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000)
+
+_trace = contextvars.ContextVar("trace", default=None)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Incremented with inc(), or read from a component's own running total with read()"""
+
+    def __init__(self, name, help, labels=(), read=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.read = read
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        if self.read is not None:
+            values = {(): self.read()}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labels, key)} {_number(value)}"
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._series = {}  # label values -> [bucket counts..., sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-1] += value
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        names = self.labels + ("le",)
+        for key, values in sorted(series.items()):
+            for bound, count in zip(self.buckets, values):
+                yield f"{self.name}_bucket{_labels(names, key + (_number(bound),))} {count}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {_number(values[-1])}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {values[-2]}"
+
+
+class Gauge:
+    """read() returns a number, or a dict of label value (tuple for several labels) -> number"""
+
+    def __init__(self, name, help, read, labels=()):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.labels = tuple(labels)
+
+    def lines(self):
+        try:
+            values = self.read()
+        except Exception:
+            return  # a component that is not running has no value
+        if values is None:
+            return
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            key = key if isinstance(key, tuple) else (key,)
+            yield f"{self.name}{_labels(self.labels, key)} {_number(value)}"
+
+
+class Metrics:
+    """The metrics of one API process, rendered by render() for GET /metrics"""
+
+    def __init__(self, prefix="musicgen"):
+        self.prefix = prefix
+        self._metrics = []
+        self.stage_seconds = self.histogram(
+            "stage_seconds", "Duration of one pipeline stage of a request", ("stage", "model_type"))
+        self.generated_tokens = self.counter(
+            "generated_tokens_total", "Tokens sampled, seeds excluded", ("model_type",))
+        self.tokens_per_second = self.histogram(
+            "generation_tokens_per_second", "Sampling throughput of one generation", ("model_type",),
+            RATE_BUCKETS)
+        self.request_seconds = self.histogram(
+            "request_seconds", "Duration of an API request", ("method", "route", "status"))
+
+    def _add(self, metric):
+        metric.name = f"{self.prefix}_{metric.name}"
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=(), read=None):
+        return self._add(Counter(name, help, labels, read))
+
+    def histogram(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, read, labels=()):
+        return self._add(Gauge(name, help, read, labels))
+
+    def observe_stage(self, stage, model_type, seconds):
+        self.stage_seconds.observe(seconds, stage=stage, model_type=model_type)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((stage, seconds))
+
+    @contextmanager
+    def time(self, stage, model_type):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, model_type, time.perf_counter() - start)
+
+    def progress(self, model_type, progress=None):
+        """Wraps a pipeline progress callback to time every stage from "running" to "done" """
+        started = {}
+
+        def report(stage, state):
+            if state == "running":
+                # a stage reported running twice (the file move before "store") starts at the first
+                started.setdefault(stage, time.perf_counter())
+            elif state == "done" and stage in started:
+                self.observe_stage(stage, model_type, time.perf_counter() - started.pop(stage))
+            if progress is not None:
+                progress(stage, state)
+        return report
+
+    def observe_generation(self, model_type, tokens, seconds):
+        self.generated_tokens.inc(tokens, model_type=model_type)
+        if tokens and seconds > 0:
+            self.tokens_per_second.observe(tokens / seconds, model_type=model_type)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.lines())
+        return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def trace():
+    """Collects the (stage, seconds) of everything observed in this context, in order"""
+    stages = []
+    token = _trace.set(stages)
+    try:
+        yield stages
+    finally:
+        _trace.reset(token)
+
+
+def server_timing(stages):
+    """Server-Timing header value of a trace, repeated stages are summed"""
+    totals = {}
+    for stage, seconds in stages:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
+
+
+def rss_bytes():
+    """Resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        # peak rather than current outside Linux; kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def torch_threads():
+    """{"intra_op": n, "inter_op": n}, None when torch was never imported (numpy backend)"""
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return None
+    return {"intra_op": torch.get_num_threads(), "inter_op": torch.get_num_interop_threads()}
+
+
+def process_gauges(metrics):
+    metrics.gauge("process_resident_memory_bytes", "Resident set size", rss_bytes)
+    metrics.gauge("process_threads", "Live Python threads", threading.active_count)
+    metrics.gauge("torch_threads", "torch thread pool sizes", torch_threads, ("pool",))
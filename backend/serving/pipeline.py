@@ -0,0 +1,549 @@
+import asyncio
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import wave
+from contextlib import nullcontext
+
+from Final_Final.generator import seed_dict
+from midi_writer import ARRANGEMENT_STEP_SECONDS, arrangement_to_midi, melody_to_midi
+from serving.cache import generation_key, link_or_copy
+from serving.longform import CHUNK_BARS, DrumChunks, MelodyChunks, OverlapAdd
+from serving.ranking import RANKINGS, heuristic_score
+from serving.streaming import STEPS_PER_BAR, iterate_in_thread, last_symbol, melody_bar
+
+MODEL_TYPES = ("Melody", "Drum")
+
+
+class GenerationPipeline:
+    """generate tokens -> write MIDI -> fluidsynth WAV -> ffmpeg MP3 -> move to storage.
+
+    Shared by the synchronous ``/generate`` endpoint and the job workers. ``progress``
+    callbacks receive ``(stage, state)`` with state one of "running", "done" or "cached".
+
+    With a cache, generations that carry an rng seed are looked up by their generation
+    key and rendered audio is looked up by the hash of the MIDI. With metrics, every
+    stage's duration and the sampling throughput are recorded (see serving/metrics.py).
+    """
+
+    STAGES = ("generate", "midi", "render", "encode", "store")
+
+    def __init__(self, registry, schedulers, execution, soundfont="FluidR3_GM.sf2", synth_pool=None,
+                 cache=None, metrics=None):
+        self.registry = registry
+        self.schedulers = schedulers
+        self.execution = execution
+        self.soundfont = soundfont
+        self.synth_pool = synth_pool
+        self.cache = cache
+        self.metrics = metrics
+
+    def _progress(self, model_type, progress):
+        """progress, or a no-op, timed into the stage metrics"""
+        progress = progress or (lambda stage, state: None)
+        return progress if self.metrics is None else self.metrics.progress(model_type, progress)
+
+    def _timed(self, stage, model_type):
+        return nullcontext() if self.metrics is None else self.metrics.time(stage, model_type)
+
+    def _plan(self, model_type, seed=None, drum_length=None):
+        """(generator, seed tokens, prompt ids, max tokens, end id) of one generation"""
+        if model_type == "Melody":
+            seed_text = seed or seed_dict.get("seed1", "_ 67 _ 65 _ 64 _ 62 _ 60 _")
+            with self._timed("model_lookup", model_type):
+                melody_generator = self.registry.get("Melody")
+            return (melody_generator, seed_text.split(), melody_generator.encode_seed(seed_text),
+                    200, melody_generator.end_id)
+        if model_type == "Drum":
+            with self._timed("model_lookup", model_type):
+                drum_generator = self.registry.get("Drum")
+            seed_sequence = drum_generator.seed_ids()
+            return drum_generator, seed_sequence, seed_sequence, drum_length or 256, None
+        raise ValueError("Invalid model type")
+
+    def cache_key(self, model_type, temperature=1.0, seed=None, drum_length=None, rng_seed=None):
+        """Only generations with an explicit rng seed are deterministic, and so cacheable"""
+        if self.cache is None or rng_seed is None:
+            return None
+        generator, seed_tokens, _, max_tokens, _ = self._plan(model_type, seed, drum_length)
+        return generation_key(generator.checkpoint_hash, model_type, seed_tokens, temperature, max_tokens, rng_seed)
+
+    def _submit(self, model_type, temperature=1.0, seed=None, drum_length=None, rng_seed=None, score=False):
+        """Queues the generation on the model's scheduler right away and returns the
+        coroutine that awaits it, so several calls in a row land in the same batch"""
+        generator, seed_tokens, prompt, max_tokens, end_id = self._plan(model_type, seed, drum_length)
+        rng = generator.rng(rng_seed) if rng_seed is not None else None
+        submitted = time.perf_counter()
+        future = self.schedulers[model_type].submit(
+            prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            end_id=end_id,
+            generator=rng,
+            score=score
+        )
+
+        async def result():
+            generated = await asyncio.wrap_future(future)
+            if score:
+                generated, log_likelihood = generated
+            if self.metrics is not None:
+                self.metrics.observe_generation(model_type, len(generated), time.perf_counter() - submitted)
+            if model_type == "Melody":
+                tokens = seed_tokens + generator.decode(generated)
+            else:
+                tokens = seed_tokens + generated
+            return (tokens, log_likelihood) if score else tokens
+        return result()
+
+    async def generate_tokens(self, model_type, temperature=1.0, seed=None, drum_length=None, rng_seed=None,
+                              score=False):
+        """Melody returns note tokens (str), Drum returns token ids. With score, returns
+        (tokens, mean log-probability of the sampled tokens under the model)"""
+        return await self._submit(model_type, temperature, seed, drum_length, rng_seed, score)
+
+    async def midi_bytes(self, model_type, tokens):
+        """SMF bytes of the tokens, written in memory (well under a millisecond, so inline)"""
+        if model_type == "Melody":
+            return melody_to_midi(tokens)
+        return self.registry.get("Drum").to_midi_bytes(tokens)
+
+    async def stream(self, model_type, temperature=1.0, seed=None, drum_length=None):
+        """Sample token by token and yield ``(event, data)`` pairs as they become available:
+        "start" with the seed, "token" for every sampled token, "chunk" with the MIDI of
+        every finished bar and "done" at the end.
+
+        Streams sample on their own (not through the batch scheduler) so each token can be
+        sent out straight away; closing the stream cancels the remaining steps.
+        """
+        if model_type == "Melody":
+            melody_generator = self.registry.get("Melody")
+            seed_text = seed or seed_dict.get("seed1", "_ 67 _ 65 _ 64 _ 62 _ 60 _")
+            sequence = seed_text.split()
+            make_iterator = lambda: melody_generator.stream(seed_text, 200, temperature)
+            decode = lambda token: token
+        elif model_type == "Drum":
+            drum_generator = self.registry.get("Drum")
+            sequence = drum_generator.seed_ids()
+            seed_sequence = list(sequence)
+            make_iterator = lambda: drum_generator.stream_sequence(seed_sequence, drum_length or 256, temperature)
+            decode = drum_generator.reverse_mapping.get
+        else:
+            raise ValueError("Invalid model type")
+
+        yield "start", {"model_type": model_type, "seed": [decode(token) for token in sequence],
+                        "steps_per_bar": STEPS_PER_BAR}
+        bar, held = 0, None
+
+        async def bar_chunk():
+            nonlocal held
+            tokens = sequence[bar * STEPS_PER_BAR:(bar + 1) * STEPS_PER_BAR]
+            if model_type == "Melody":
+                midi = await self.midi_bytes(model_type, melody_bar(tokens, held))
+                held = last_symbol(tokens, held)
+            else:
+                midi = await self.midi_bytes(model_type, tokens)
+            return {"bar": bar, "start_step": bar * STEPS_PER_BAR, "midi": midi}
+
+        async for token in iterate_in_thread(make_iterator):
+            sequence.append(token)
+            yield "token", {"index": len(sequence) - 1, "token": decode(token)}
+            while len(sequence) >= (bar + 1) * STEPS_PER_BAR:
+                yield "chunk", await bar_chunk()
+                bar += 1
+        if len(sequence) > bar * STEPS_PER_BAR:
+            yield "chunk", await bar_chunk()
+        yield "done", {"length": len(sequence)}
+
+    async def midi_to_wav(self, midi_path, wav_path):
+        """Convert MIDI to WAV using fluidsynth"""
+        sf_path = os.path.abspath(self.soundfont)
+        command = [
+            'fluidsynth', '-ni', sf_path, midi_path,
+            '-F', wav_path, '-r', '44100', '-T', 'wav'
+        ]
+        await self.execution.run_subprocess(command, "Fluidsynth")
+
+    async def wav_to_mp3(self, wav_path, mp3_path):
+        """Convert WAV to MP3 using ffmpeg"""
+        command = [
+            'ffmpeg', '-y', '-i', wav_path,
+            '-codec:a', 'libmp3lame', '-qscale:a', '2', mp3_path
+        ]
+        await self.execution.run_subprocess(command, "FFmpeg")
+
+    def pcm_to_mp3_command(self, output):
+        """ffmpeg reading raw synth PCM from stdin, output is a path or pipe:1"""
+        return [
+            'ffmpeg', '-y', '-f', 's16le', '-ar', str(self.synth_pool.samplerate), '-ac', '2',
+            '-i', 'pipe:0', '-codec:a', 'libmp3lame', '-qscale:a', '2', '-f', 'mp3', output
+        ]
+
+    async def render_pcm(self, midi):
+        if self.synth_pool is None:
+            raise RuntimeError("Rendering without intermediate files needs the synth pool")
+        return await self.synth_pool.render(midi)
+
+    async def stream_mp3(self, model_type, temperature=1.0, seed=None, drum_length=None):
+        """Generate, render and yield MP3 bytes as ffmpeg encodes them, nothing touches disk"""
+        if model_type not in MODEL_TYPES:
+            raise ValueError("Invalid model type")
+        tokens = await self.generate_tokens(model_type, temperature, seed, drum_length)
+        pcm = await self.render_pcm(await self.midi_bytes(model_type, tokens))
+        async for chunk in self.execution.stream_subprocess(self.pcm_to_mp3_command("pipe:1"), "FFmpeg", pcm):
+            yield chunk
+
+    async def _encode_single_pass(self, midi_data, out_dir, base_name, keep, progress):
+        """Synth PCM stays in memory: it is piped into ffmpeg for the MP3 and, if wanted,
+        written out as the WAV in the same pass, straight into out_dir"""
+        progress("render", "running")
+        pcm = await self.render_pcm(midi_data)
+        progress("render", "done")
+
+        progress("encode", "running")
+        files, writes = {}, []
+        if "mp3" in keep:
+            files["mp3"] = os.path.join(out_dir, f"{base_name}.mp3")
+            writes.append(self.execution.run_subprocess(self.pcm_to_mp3_command(files["mp3"]), "FFmpeg", pcm))
+        if "wav" in keep:
+            files["wav"] = os.path.join(out_dir, f"{base_name}.wav")
+            writes.append(self.execution.run_in_thread(self.synth_pool.write_wav, pcm, files["wav"]))
+        await asyncio.gather(*writes)
+        progress("encode", "done")
+        return files
+
+    async def _encode_via_files(self, midi_data, out_dir, base_name, keep, progress):
+        """fluidsynth CLI path: WAV and MP3 go through a temp dir and are moved into out_dir"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = {fmt: os.path.join(tmp_dir, f"{base_name}.{ext}")
+                     for fmt, ext in (("midi", "mid"), ("wav", "wav"), ("mp3", "mp3"))}
+            with open(paths["midi"], "wb") as f:
+                f.write(midi_data)
+
+            progress("render", "running")
+            await self.midi_to_wav(paths["midi"], paths["wav"])
+            progress("render", "done")
+
+            progress("encode", "running")
+            await self.wav_to_mp3(paths["wav"], paths["mp3"])
+            progress("encode", "done")
+
+            progress("store", "running")
+            files = {}
+            for fmt in ("wav", "mp3"):
+                if fmt in keep:
+                    files[fmt] = os.path.join(out_dir, os.path.basename(paths[fmt]))
+                    shutil.move(paths[fmt], files[fmt])
+        return files
+
+    async def _cached_audio(self, midi_hash, out_dir, base_name, keep):
+        """Link cached renders of this MIDI into out_dir, None unless every wanted format is cached"""
+        wanted = [fmt for fmt in ("wav", "mp3") if fmt in keep]
+        sources = {fmt: self.cache.audio_path(midi_hash, fmt) for fmt in wanted}
+        if not all(sources.values()):
+            return None
+        files = {}
+        for fmt, source in sources.items():
+            files[fmt] = os.path.join(out_dir, f"{base_name}.{fmt}")
+            await self.execution.run_in_thread(link_or_copy, source, files[fmt])
+        return files
+
+    async def _store_generation(self, key, tokens, midi_data, score=None):
+        if key is not None:
+            await self.execution.run_in_thread(self.cache.put_generation, key, tokens, midi_data, score)
+
+    async def _audio(self, midi_data, out_dir, base_name, keep, progress):
+        """Render and encode midi_data (or link cached renders), files listed in keep
+        ("midi", "wav", "mp3") end up in out_dir"""
+        os.makedirs(out_dir, exist_ok=True)
+        files = None
+        if self.cache is not None:
+            midi_hash = hashlib.sha256(midi_data).hexdigest()
+            files = await self._cached_audio(midi_hash, out_dir, base_name, keep)
+        if files is not None:
+            progress("render", "cached")
+            progress("encode", "cached")
+        else:
+            if self.synth_pool is not None:
+                files = await self._encode_single_pass(midi_data, out_dir, base_name, keep, progress)
+            else:
+                files = await self._encode_via_files(midi_data, out_dir, base_name, keep, progress)
+            if self.cache is not None:
+                for fmt, path in files.items():
+                    await self.execution.run_in_thread(self.cache.put_audio, midi_hash, fmt, path)
+
+        progress("store", "running")
+        if "midi" in keep:
+            files["midi"] = os.path.join(out_dir, f"{base_name}.mid")
+            with open(files["midi"], "wb") as f:
+                f.write(midi_data)
+        progress("store", "done")
+        return files
+
+    async def run(self, model_type, out_dir, temperature=1.0, seed=None, drum_length=None,
+                  keep=("wav", "mp3"), base_name=None, progress=None, rng_seed=None):
+        """Run every stage, files listed in keep ("midi", "wav", "mp3") end up in out_dir.
+
+        Returns ``{"files": {fmt: path}, "midi": bytes, "tokens": list, "cached": bool}``.
+        """
+        if model_type not in MODEL_TYPES:
+            raise ValueError("Invalid model type")
+        progress = self._progress(model_type, progress)
+        base_name = base_name or f"generated_{int(time.time())}_{uuid.uuid4().hex}"
+        key = self.cache_key(model_type, temperature, seed, drum_length, rng_seed)
+        cached = None
+        if key is not None:
+            cached = await self.execution.run_in_thread(self.cache.get_generation, key)
+
+        if cached is not None:
+            tokens, midi_data, _ = cached
+            progress("generate", "cached")
+            progress("midi", "cached")
+        else:
+            progress("generate", "running")
+            tokens = await self.generate_tokens(model_type, temperature, seed, drum_length, rng_seed)
+            progress("generate", "done")
+
+            progress("midi", "running")
+            midi_data = await self.midi_bytes(model_type, tokens)
+            progress("midi", "done")
+            await self._store_generation(key, tokens, midi_data)
+
+        files = await self._audio(midi_data, out_dir, base_name, keep, progress)
+        return {"files": files, "midi": midi_data, "tokens": tokens, "cached": cached is not None}
+
+    async def run_variants(self, model_type, out_dir, num_variants=None, temperature=1.0, temperatures=None,
+                           seed=None, drum_length=None, rng_seed=None, rng_seeds=None, rank=None,
+                           keep=("wav", "mp3"), base_name=None, progress=None):
+        """Several alternatives for one request. The variants are queued on the scheduler
+        together, so they are sampled as rows of one batched decode, and are then
+        rendered concurrently.
+
+        ``temperatures`` and ``rng_seeds`` give each variant its own value; with only
+        ``rng_seed``, variant i uses ``rng_seed + i``. ``rank`` orders the variants best
+        first by "likelihood" or "heuristic" (see serving/ranking.py).
+
+        Returns a list of run() results, each with its "temperature", "rng_seed" and
+        "score" (None when not ranked).
+        """
+        if model_type not in MODEL_TYPES:
+            raise ValueError("Invalid model type")
+        if rank not in RANKINGS:
+            raise ValueError(f"Unknown ranking {rank!r}, expected one of likelihood, heuristic")
+        count = num_variants or len(temperatures or rng_seeds or [None])
+        temperatures = list(temperatures) if temperatures else [temperature] * count
+        if rng_seeds is None:
+            rng_seeds = [None if rng_seed is None else rng_seed + i for i in range(count)]
+        if len(temperatures) != count or len(rng_seeds) != count:
+            raise ValueError("temperatures and rng_seeds need one value per variant")
+        progress = self._progress(model_type, progress)
+        base_name = base_name or f"generated_{int(time.time())}_{uuid.uuid4().hex}"
+        score = rank == "likelihood"
+
+        keys = [self.cache_key(model_type, t, seed, drum_length, s) for t, s in zip(temperatures, rng_seeds)]
+        cached = await asyncio.gather(*(self.execution.run_in_thread(self.cache.get_generation, key)
+                                        for key in keys if key is not None))
+        cached = iter(cached)
+        cached = [next(cached) if key is not None else None for key in keys]
+        # entries written without a likelihood are generated again (same tokens, the rng is seeded)
+        cached = [entry if entry is None or not score or entry[2] is not None else None for entry in cached]
+
+        progress("generate", "running")
+        pending = {i: self._submit(model_type, temperatures[i], seed, drum_length, rng_seeds[i], score)
+                   for i in range(count) if cached[i] is None}
+        generated = dict(zip(pending, await asyncio.gather(*pending.values())))
+        progress("generate", "done")
+
+        progress("midi", "running")
+        variants = []
+        for i in range(count):
+            if cached[i] is not None:
+                tokens, midi_data, variant_score = cached[i]
+            else:
+                tokens, variant_score = generated[i] if score else (generated[i], None)
+                midi_data = await self.midi_bytes(model_type, tokens)
+                await self._store_generation(keys[i], tokens, midi_data, variant_score)
+            if rank == "heuristic":
+                variant_score = heuristic_score(model_type, tokens, self.registry.get(model_type))
+            elif rank is None:
+                variant_score = None
+            variants.append({"midi": midi_data, "tokens": tokens, "cached": cached[i] is not None,
+                             "temperature": temperatures[i], "rng_seed": rng_seeds[i], "score": variant_score})
+        progress("midi", "done")
+        if rank is not None:
+            variants.sort(key=lambda variant: variant["score"], reverse=True)
+
+        quiet = lambda stage, state: None
+        progress("render", "running")
+        files = await asyncio.gather(*(self._audio(variant["midi"], out_dir, f"{base_name}_{i}", keep, quiet)
+                                       for i, variant in enumerate(variants)))
+        for variant, variant_files in zip(variants, files):
+            variant["files"] = variant_files
+        progress("render", "done")
+        progress("encode", "done")
+        progress("store", "done")
+        return variants
+
+    async def run_arrangement(self, out_dir, temperature=1.0, drum_temperature=None, seed=None, drum_length=None,
+                              rng_seed=None, keep=("wav", "mp3"), base_name=None, progress=None,
+                              step_seconds=ARRANGEMENT_STEP_SECONDS):
+        """A melody and a drum track in one piece. Both generations are queued right
+        away on their own schedulers, so they are sampled at the same time, then merged
+        by arrangement_to_midi into one MIDI that is rendered and encoded once.
+
+        The drums are generated as long as the longest possible melody (unless
+        drum_length is given) and cut to the melody's length rounded up to whole bars.
+
+        Returns ``{"files": {fmt: path}, "midi": bytes, "tokens": {"Melody": list,
+        "Drum": list}, "cached": bool}``.
+        """
+        progress = self._progress("Arrangement", progress)
+        base_name = base_name or f"generated_{int(time.time())}_{uuid.uuid4().hex}"
+        drum_temperature = temperature if drum_temperature is None else drum_temperature
+        _, melody_seed, _, melody_tokens, _ = self._plan("Melody", seed)
+        drum_generator, drum_seed, _, _, _ = self._plan("Drum")
+        drum_length = drum_length or max(len(melody_seed) + melody_tokens - len(drum_seed), 0)
+        parts = {"Melody": (temperature, seed, None), "Drum": (drum_temperature, None, drum_length)}
+
+        keys, cached = {}, {}
+        for model_type, (part_temperature, part_seed, length) in parts.items():
+            keys[model_type] = self.cache_key(model_type, part_temperature, part_seed, length, rng_seed)
+            if keys[model_type] is not None:
+                cached[model_type] = await self.execution.run_in_thread(self.cache.get_generation, keys[model_type])
+
+        progress("generate", "running")
+        pending = {model_type: self._submit(model_type, part_temperature, part_seed, length, rng_seed)
+                   for model_type, (part_temperature, part_seed, length) in parts.items()
+                   if cached.get(model_type) is None}
+        tokens = dict(zip(pending, await asyncio.gather(*pending.values())))
+        for model_type in pending:
+            await self._store_generation(keys[model_type], tokens[model_type],
+                                         await self.midi_bytes(model_type, tokens[model_type]))
+        for model_type, entry in cached.items():
+            if entry is not None:
+                tokens[model_type] = entry[0]
+        progress("generate", "done" if pending else "cached")
+
+        progress("midi", "running")
+        bars = -(-len(tokens["Melody"]) // STEPS_PER_BAR)
+        drums = tokens["Drum"][:bars * STEPS_PER_BAR]
+        midi_data = arrangement_to_midi(tokens["Melody"], drums, drum_generator.reverse_mapping, step_seconds)
+        progress("midi", "done")
+
+        files = await self._audio(midi_data, out_dir, base_name, keep, progress)
+        return {"files": files, "midi": midi_data, "tokens": {"Melody": tokens["Melody"], "Drum": drums},
+                "cached": not pending}
+
+    async def run_long(self, model_type, out_dir, duration, temperature=1.0, seed=None, rng_seed=None,
+                       keep=("wav", "mp3"), base_name=None, progress=None, chunk_bars=CHUNK_BARS):
+        """Long-form generation of about duration seconds in flat memory (see serving/longform.py).
+
+        Tokens are sampled one at a time with the carried LSTM state; the melody model
+        is never allowed to end the piece. Every chunk of finished bars is appended to
+        the MIDI file and rendered by the synth pool while the next one is sampled. The
+        rendered audio is overlap-added and piped into ffmpeg and the WAV as it comes.
+
+        Returns ``{"files": {fmt: path}, "midi": bytes, "steps": int, "cached": False}``,
+        "midi" only when it is not kept as a file.
+        """
+        if self.synth_pool is None:
+            raise RuntimeError("Long-form generation needs the synth pool")
+        progress = self._progress(model_type, progress)
+        base_name = base_name or f"generated_{int(time.time())}_{uuid.uuid4().hex}"
+        generator, seed_tokens, _, _, _ = self._plan(model_type, seed)
+        rng = generator.rng(rng_seed) if rng_seed is not None else None
+        if model_type == "Melody":
+            chunks = MelodyChunks(chunk_bars)
+            steps = max(0, round(duration / chunks.step_seconds) - len(seed_tokens))
+            make_iterator = lambda: generator.stream(" ".join(seed_tokens), steps, temperature, generator=rng,
+                                                     stop_at_end=False)
+        else:
+            chunks = DrumChunks(generator.reverse_mapping, chunk_bars)
+            steps = max(0, round(duration / chunks.step_seconds) - len(seed_tokens))
+            make_iterator = lambda: generator.stream_sequence(seed_tokens, steps, temperature, generator=rng)
+
+        os.makedirs(out_dir, exist_ok=True)
+        files = {fmt: os.path.join(out_dir, f"{base_name}.{ext}")
+                 for fmt, ext in (("midi", "mid"), ("wav", "wav"), ("mp3", "mp3")) if fmt in keep}
+        samplerate = self.synth_pool.samplerate
+        mixer = OverlapAdd()
+        midi_file = open(files["midi"], "wb") if "midi" in files else io.BytesIO()
+        writer = chunks.writer(midi_file)
+        wav_file = None
+        if "wav" in files:
+            wav_file = wave.open(files["wav"], "wb")
+            wav_file.setnchannels(2)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(samplerate)
+        # rendered audio waits here for ffmpeg, at most two chunks of it
+        encoder_input = asyncio.Queue(maxsize=2)
+
+        async def pcm_chunks():
+            while (pcm := await encoder_input.get()) is not None:
+                yield pcm
+
+        encoder = None
+        if "mp3" in files:
+            encoder = asyncio.create_task(
+                self.execution.run_subprocess(self.pcm_to_mp3_command(files["mp3"]), "FFmpeg", pcm_chunks()))
+
+        async def encode(pcm):
+            # ffmpeg exiting early stops reading the queue, so a put alone could wait forever
+            put = asyncio.ensure_future(encoder_input.put(pcm))
+            try:
+                await asyncio.wait((put, encoder), return_when=asyncio.FIRST_COMPLETED)
+                if not put.done():
+                    encoder.result()
+                    raise RuntimeError("FFmpeg exited before it read all of the audio")
+            finally:
+                put.cancel()
+
+        async def output(pcm):
+            if wav_file is not None:
+                await self.execution.run_in_thread(wav_file.writeframes, pcm)
+            if encoder is not None:
+                await encode(pcm)
+
+        async def flush(start, tokens, final):
+            end = start + len(tokens)
+            await self.execution.run_in_thread(writer.add, chunks.events(start, tokens, final),
+                                               None if final else chunks.tick(end))
+            pcm = await self.render_pcm(chunks.midi(tokens, final))
+            frames = round(end * chunks.step_seconds * samplerate) - round(start * chunks.step_seconds * samplerate)
+            await output(mixer.add(pcm, frames))
+
+        for stage in ("generate", "midi", "render"):
+            progress(stage, "running")
+        try:
+            for token in seed_tokens:
+                for chunk in chunks.add(token):
+                    await flush(*chunk)
+            async for token in iterate_in_thread(make_iterator, max_buffered=chunks.chunk_steps):
+                for chunk in chunks.add(token):
+                    await flush(*chunk)
+            progress("generate", "done")
+            for chunk in chunks.finish():
+                await flush(*chunk)
+            await output(mixer.finish())
+            progress("render", "done")
+            progress("encode", "running")
+            if encoder is not None:
+                await encode(None)
+                await encoder
+            progress("encode", "done")
+            writer.close()
+            progress("midi", "done")
+        finally:
+            if encoder is not None and not encoder.done():
+                encoder.cancel()
+            if wav_file is not None:
+                wav_file.close()
+            midi = None if "midi" in files else midi_file.getvalue()
+            midi_file.close()
+        progress("store", "done")
+        return {"files": files, "midi": midi,
+                "steps": len(seed_tokens) + steps, "cached": False}
@@ -0,0 +1,103 @@
+'''Profiles of the next N requests, armed through POST /admin/profile.
+
+  cprofile  cProfile of the event loop thread while the request runs: the
+            pipeline's own Python, request handling and MIDI writing done inline.
+            Sampling (batch scheduler thread) and work on the thread pool are not in it.
+  torch     torch.profiler CPU trace of the batch scheduler thread of the request's
+            model (an arrangement's melody model) while the request runs: every
+            batched LSTM step, of the concurrent requests sharing the batch too.
+            Written as a Chrome trace (chrome://tracing, Perfetto). Needs a torch
+            backend.
+
+One request is profiled at a time: requests running alongside a profiled one are
+not profiled and do not use up the count. Other requests on the event loop do show
+up in a cProfile, so profiles are clearest at low load.'''
+import asyncio
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+PROFILE_MODES = ("cprofile", "torch")
+
+
+class RequestProfiler:
+    def __init__(self, out_dir, execution, schedulers):
+        self.out_dir = out_dir
+        self.execution = execution
+        self.schedulers = schedulers
+        self.mode = None
+        self.remaining = 0
+        self.files = []
+        self._busy = False
+        self._lock = threading.Lock()
+
+    def arm(self, requests, mode="cprofile"):
+        """Profile the next requests requests, replacing any count still left"""
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profiler {mode!r}, expected one of {', '.join(PROFILE_MODES)}")
+        if mode == "torch" and "torch" not in sys.modules:
+            raise ValueError("The torch profiler needs a torch model backend")
+        with self._lock:
+            self.mode = mode
+            self.remaining = requests
+        return self.status()
+
+    def status(self):
+        with self._lock:
+            return {"mode": self.mode, "remaining": self.remaining, "files": list(self.files)}
+
+    def path(self, filename):
+        """Path of a written profile, None for anything else"""
+        with self._lock:
+            if filename not in self.files:
+                return None
+        return os.path.join(self.out_dir, filename)
+
+    def _take(self):
+        with self._lock:
+            if self.remaining <= 0 or self._busy:
+                return None
+            self.remaining -= 1
+            self._busy = True
+            return self.mode
+
+    @asynccontextmanager
+    async def profile(self, name, model_type=None):
+        """Profiles the body when a profile is armed and none is running"""
+        mode = self._take()
+        if mode is None:
+            yield
+            return
+        filename = f"{name}_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+        try:
+            if mode == "cprofile":
+                import cProfile
+                profiler = cProfile.Profile()
+                profiler.enable()
+            else:
+                import torch
+                # the profiler only records the thread it was started on
+                scheduler = self.schedulers.get(model_type) or next(iter(self.schedulers.values()))
+                profiler = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU])
+                await asyncio.wrap_future(scheduler.call(profiler.__enter__))
+            try:
+                yield
+            finally:
+                if mode == "cprofile":
+                    profiler.disable()
+                    filename += ".prof"
+                    save = profiler.dump_stats
+                else:
+                    await asyncio.wrap_future(scheduler.call(lambda: profiler.__exit__(None, None, None)))
+                    filename += ".json"
+                    save = profiler.export_chrome_trace
+                os.makedirs(self.out_dir, exist_ok=True)
+                await self.execution.run_in_thread(save, os.path.join(self.out_dir, filename))
+                with self._lock:
+                    self.files.append(filename)
+        finally:
+            with self._lock:
+                self._busy = False
@@ -0,0 +1,44 @@
+'''Orderings of the variants of one request (GenerationPipeline.run_variants).
+
+  likelihood  mean log-probability of the sampled tokens under the model, computed
+              by the batch scheduler while sampling
+  heuristic   simple musical checks on the decoded tokens, see melody_score and
+              drum_score'''
+import numpy as np
+
+RANKINGS = (None, "likelihood", "heuristic")
+# below any score of the checks, for variants with too few notes to judge
+UNSCORABLE = -3.0
+
+
+def melody_score(tokens):
+    """Rewards stepwise motion and pitch variety, penalizes big leaps, repeated
+    notes and rests. tokens are melody symbols (MIDI pitch, "R" or "_")."""
+    pitches = np.array([int(token) for token in tokens if token not in ("_", "R", "\\")])
+    if len(pitches) < 2:
+        return UNSCORABLE
+    intervals = np.abs(np.diff(pitches))
+    stepwise = np.mean((intervals > 0) & (intervals <= 2))
+    leaps = np.mean(intervals > 7)
+    repeats = np.mean(intervals == 0)
+    variety = len(np.unique(pitches)) / min(len(pitches), 12)
+    rests = sum(token == "R" for token in tokens) / len(tokens)
+    return float(stepwise + 0.5 * variety - leaps - 0.5 * repeats - rests)
+
+
+def drum_score(tokens, hold="_"):
+    """Rewards a hit density near 40% of the steps and a few distinct instruments.
+    tokens are drum symbols (General MIDI drum note or the hold token)."""
+    hits = [token for token in tokens if token != hold]
+    if not hits:
+        return UNSCORABLE
+    density = len(hits) / len(tokens)
+    variety = min(len(set(hits)), 4) / 4
+    return float(variety - 2 * abs(density - 0.4))
+
+
+def heuristic_score(model_type, tokens, generator):
+    """melody_score or drum_score of a pipeline result (note tokens for Melody, ids for Drum)"""
+    if model_type == "Melody":
+        return melody_score(tokens)
+    return drum_score(generator.vocab.decode(tokens), generator.vocab.token(generator.vocab.hold_id))
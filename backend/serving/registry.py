@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+
+from serving import backends
+from serving.cache import file_sha256
+
+
+class ModelRegistry:
+    """Loads every generator once and hands the same warm, eval-mode instance to all requests.
+
+    A generator class is anything built as ``cls(model_path=..., map_path=...)`` that
+    exposes ``vocab`` (a ``Vocabulary``), ``model`` and ``warmup()``
+    (``MelodyGenerator`` and ``DrumGenerator``).
+
+    ``backend`` picks how every model runs (see serving/backends.py), its ``model`` is
+    swapped for the TorchScript or int8 variant right after loading.
+    """
+
+    def __init__(self, backend="eager"):
+        if backend not in backends.BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {', '.join(backends.BACKENDS)}")
+        self.backend = backend
+        self._specs = {}
+        self._instances = {}
+        self._loaded_at = {}
+        self._lock = threading.Lock()
+        # one per model, so concurrent first requests build it once
+        self._loading = {}
+
+    def register(self, name, generator_cls, model_path, map_path):
+        self._specs[name] = {
+            "cls": generator_cls,
+            "model_path": model_path,
+            "map_path": map_path,
+        }
+        self._loading[name] = threading.Lock()
+
+    def names(self):
+        return list(self._specs)
+
+    def _build(self, name, model_path=None):
+        spec = self._specs[name]
+        model_path = model_path or spec["model_path"]
+        checkpoint_hash = file_sha256(model_path)
+        if self.backend == "numpy":
+            # the generators run .npz weights on numpy_lstm without importing torch
+            weights_path = backends.numpy_weights(model_path, checkpoint_hash)
+            generator = spec["cls"](model_path=weights_path, map_path=spec["map_path"])
+        else:
+            generator = spec["cls"](model_path=model_path, map_path=spec["map_path"])
+            generator.model = backends.load(generator.model.eval(), model_path, self.backend, checkpoint_hash)
+        # identifies the weights in cache keys, a reloaded checkpoint never hits old entries,
+        # and neither does another backend since other kernels sample differently
+        if self.backend != "eager":
+            checkpoint_hash = f"{checkpoint_hash}-{self.backend}"
+        generator.checkpoint_hash = checkpoint_hash
+        return generator
+
+    def load(self, names=None, warmup=True):
+        """Load (and optionally warm up) the given models, all registered ones by default"""
+        for name in names or self.names():
+            generator = self._build(name)
+            if warmup:
+                generator.warmup()
+            with self._lock:
+                self._instances[name] = generator
+                self._loaded_at[name] = time.time()
+
+    def get(self, name):
+        """Shared generator instance for name, loading it on first use"""
+        if name not in self._specs:
+            raise KeyError(f"Unknown model: {name}")
+        generator = self._instances.get(name)
+        if generator is None:
+            with self._loading[name]:
+                generator = self._instances.get(name)
+                if generator is None:
+                    self.load([name])
+                    generator = self._instances[name]
+        return generator
+
+    def _check_path(self, name, model_path):
+        """model_path if it lies in the directory of the registered checkpoint, otherwise
+        ValueError (reload paths come from API requests)"""
+        models_dir = os.path.realpath(os.path.dirname(self._specs[name]["model_path"]) or ".")
+        path = os.path.realpath(model_path)
+        if os.path.commonpath([models_dir, path]) != models_dir:
+            raise ValueError(f"Checkpoints for {name} have to be in {models_dir}")
+        return model_path
+
+    def reload(self, name, model_path=None):
+        """Hot-swap name to a new checkpoint, which has to be in the directory of the
+        registered one.
+
+        The new model is built and warmed up off to the side, requests that already
+        hold the old instance finish on it and new requests get the new one.
+        """
+        if name not in self._specs:
+            raise KeyError(f"Unknown model: {name}")
+        if model_path:
+            self._check_path(name, model_path)
+        generator = self._build(name, model_path)
+        generator.warmup()
+        with self._lock:
+            if model_path:
+                self._specs[name]["model_path"] = model_path
+            self._instances[name] = generator
+            self._loaded_at[name] = time.time()
+        return generator
+
+    def status(self):
+        return {
+            name: {
+                "model_path": spec["model_path"],
+                "map_path": spec["map_path"],
+                "loaded": name in self._instances,
+                "backend": self.backend,
+                "checkpoint_hash": getattr(self._instances.get(name), "checkpoint_hash", None),
+                "loaded_at": self._loaded_at.get(name),
+            }
+            for name, spec in self._specs.items()
+        }
@@ -0,0 +1,80 @@
+import asyncio
+import threading
+
+# 16 steps of 0.25 quarter notes make one 4/4 bar, drums use the same grid
+STEPS_PER_BAR = 16
+
+_DONE = object()
+
+
+async def iterate_in_thread(make_iterator, max_buffered=None):
+    """Drive a blocking iterator on its own thread and yield its items as they arrive.
+
+    The thread is not taken from the execution pool: the iterator can block for the
+    whole life of a stream (max_buffered below), and the consumer may need pool
+    threads to make progress, so sharing the pool could deadlock it.
+
+    When the consumer stops early (client disconnect cancels the response task) the
+    iterator is closed before its next step, so no further tokens are computed. With
+    max_buffered the iterator pauses while that many items wait to be consumed.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    cancelled = threading.Event()
+    slots = threading.Semaphore(max_buffered) if max_buffered else None
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            pass  # the loop was closed while the consumer was gone
+
+    def pump():
+        iterator = None
+        try:
+            iterator = make_iterator()
+            for item in iterator:
+                while slots is not None and not slots.acquire(timeout=0.1):
+                    if cancelled.is_set():
+                        break
+                if cancelled.is_set():
+                    break
+                put(item)
+        except Exception as e:
+            put(e)
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+            put(_DONE)
+
+    threading.Thread(target=pump, name="iterate-in-thread", daemon=True).start()
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if slots is not None:
+                slots.release()
+            yield item
+    finally:
+        cancelled.set()
+
+
+def melody_bar(tokens, held):
+    """Tokens of one melody bar as a standalone melody.
+
+    A bar that starts on a "_" continues the note held over the barline, so it is
+    re-struck with ``held``; the trailing "R" makes save_melody flush the last note.
+    """
+    if tokens and tokens[0] == "_" and held is not None:
+        tokens = [held] + tokens[1:]
+    return tokens + ["R"]
+
+
+def last_symbol(tokens, held=None):
+    for token in reversed(tokens):
+        if token != "_":
+            return token
+    return held
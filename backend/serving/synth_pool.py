@@ -0,0 +1,178 @@
+import asyncio
+import os
+import sys
+import wave
+
+from serving.synth_worker import HEADER
+
+
+class SynthWorkerError(RuntimeError):
+    pass
+
+
+class _Worker:
+    def __init__(self, command):
+        self.command = command
+        self.process = None
+        self.restarts = -1
+        self.renders = 0
+        self.killed = False
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.returncode is None and not self.killed
+
+    def kill(self):
+        """Kill at once, without awaiting the exit, so it also works in a cancelled task.
+        The worker counts as dead from now on and is restarted on its next use."""
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+        self.killed = True
+
+    async def start(self, timeout):
+        self.restarts += 1
+        self.killed = False
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE
+        )
+        op, _ = await asyncio.wait_for(self._read(), timeout)
+        if op != b"K":
+            raise SynthWorkerError(f"Synth worker sent {op!r} instead of ready")
+
+    async def _read(self):
+        op, length = HEADER.unpack(await self.process.stdout.readexactly(HEADER.size))
+        return op, await self.process.stdout.readexactly(length)
+
+    async def request(self, op, payload, timeout):
+        self.process.stdin.write(HEADER.pack(op, len(payload)) + payload)
+        await self.process.stdin.drain()
+        return await asyncio.wait_for(self._read(), timeout)
+
+    async def stop(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+            await self.process.wait()
+
+
+class SynthPool:
+    """N long-lived synth processes with the soundfont already loaded.
+
+    MIDI goes to a worker over its stdin and PCM comes back over its stdout (see
+    serving/synth_worker.py for the framing). A worker that crashes, hangs or stops
+    answering pings is killed and restarted; the request it was serving fails.
+    """
+
+    def __init__(self, size, command, samplerate=44100, render_timeout=120.0,
+                 start_timeout=60.0, health_interval=30.0):
+        self.size = size
+        self.command = command
+        self.samplerate = samplerate
+        self.render_timeout = render_timeout
+        self.start_timeout = start_timeout
+        self.health_interval = health_interval
+        self._workers = []
+        self._idle = None
+        self._health_task = None
+
+    @classmethod
+    def from_env(cls, soundfont="FluidR3_GM.sf2"):
+        """SYNTH_POOL_SIZE workers (0 disables the pool), SYNTH_FAKE=1 swaps fluidsynth for
+        the sine stand-in"""
+        size = int(os.environ.get("SYNTH_POOL_SIZE", 2))
+        if size <= 0:
+            return None
+        command = [sys.executable, "-m", "serving.synth_worker", "--soundfont", os.path.abspath(soundfont)]
+        if os.environ.get("SYNTH_FAKE") == "1":
+            command.append("--fake")
+        return cls(size, command)
+
+    async def start(self):
+        """Raises SynthWorkerError when not a single worker starts (no pyfluidsynth or
+        soundfont), workers that failed alongside running ones are retried on use"""
+        self._idle = asyncio.Queue()
+        self._workers = [_Worker(self.command) for _ in range(self.size)]
+        await asyncio.gather(*(self._restart(worker) for worker in self._workers))
+        if not any(worker.alive for worker in self._workers):
+            await self.stop()
+            raise SynthWorkerError(f"None of the {self.size} synth workers started")
+        for worker in self._workers:
+            self._idle.put_nowait(worker)
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+        await asyncio.gather(*(worker.stop() for worker in self._workers))
+
+    async def _restart(self, worker):
+        await worker.stop()
+        try:
+            await worker.start(self.start_timeout)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, SynthWorkerError) as e:
+            print(f"Synth worker failed to start: {e!r}")
+            await worker.stop()
+
+    async def render(self, midi):
+        """MIDI bytes -> s16le stereo PCM bytes"""
+        worker = await self._idle.get()
+        try:
+            if not worker.alive:
+                await self._restart(worker)
+            if not worker.alive:
+                raise SynthWorkerError("Synth worker is not running")
+            try:
+                op, payload = await worker.request(b"R", midi, self.render_timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                await self._restart(worker)
+                raise SynthWorkerError(f"Synth worker crashed while rendering: {e!r}")
+            except BaseException:
+                # cancelled mid-render: the reply is still on its way and would be read
+                # by the next request, so the worker is not reused
+                worker.kill()
+                raise
+            if op == b"E":
+                raise SynthWorkerError(f"Synth error: {payload.decode()}")
+            worker.renders += 1
+            return payload
+        finally:
+            self._idle.put_nowait(worker)
+
+    def write_wav(self, pcm, wav_path):
+        with wave.open(wav_path, "wb") as f:
+            f.setnchannels(2)
+            f.setsampwidth(2)
+            f.setframerate(self.samplerate)
+            f.writeframes(pcm)
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            # only idle workers are pinged, busy ones are covered by the render timeout
+            for _ in range(self._idle.qsize()):
+                worker = self._idle.get_nowait()
+                try:
+                    if not worker.alive:
+                        await self._restart(worker)
+                    else:
+                        try:
+                            await worker.request(b"P", b"", self.start_timeout)
+                        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                            await self._restart(worker)
+                finally:
+                    self._idle.put_nowait(worker)
+
+    def health(self):
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize() if self._idle else 0,
+            "workers": [
+                {
+                    "pid": worker.process.pid if worker.process else None,
+                    "alive": worker.alive,
+                    "restarts": max(worker.restarts, 0),
+                    "renders": worker.renders,
+                }
+                for worker in self._workers
+            ],
+        }
@@ -0,0 +1,147 @@
+'''long-lived synth process used by serving/synth_pool.py, run as
+python -m serving.synth_worker --soundfont FluidR3_GM.sf2 (or --fake)
+
+The soundfont is loaded once at start. Requests and replies are frames on
+stdin/stdout: one op byte, a 4 byte big-endian length and the payload.
+  P ping          -> K (empty)
+  R render <midi> -> D <pcm s16le stereo> or E <error message>
+A K frame is also sent once the worker is ready.'''
+import argparse
+import io
+import struct
+import sys
+
+import numpy as np
+
+HEADER = struct.Struct(">cI")
+DRUM_CHANNEL = 9
+TAIL_SECONDS = 1.0
+
+
+def read_frame(stream):
+    header = stream.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None, None
+    op, length = HEADER.unpack(header)
+    payload = stream.read(length)
+    return op, payload
+
+
+def write_frame(stream, op, payload=b""):
+    stream.write(HEADER.pack(op, len(payload)) + payload)
+    stream.flush()
+
+
+class FakeSynth:
+    """Stand-in for fluidsynth.Synth with the calls render() uses: plays a decaying sine per
+    note so the pool and the rest of the pipeline can run without fluidsynth installed"""
+
+    def __init__(self, samplerate=44100):
+        self.samplerate = samplerate
+        self.position = 0
+        self.notes = {}
+
+    def program_select(self, chan, sfid, bank, preset):
+        pass
+
+    def noteon(self, chan, key, vel):
+        self.notes[(chan, key)] = (440.0 * 2 ** ((key - 69) / 12), vel / 127, self.position)
+
+    def noteoff(self, chan, key):
+        self.notes.pop((chan, key), None)
+
+    def system_reset(self):
+        self.notes = {}
+        self.position = 0
+
+    def get_samples(self, length=1024):
+        t = np.arange(self.position, self.position + length)
+        mono = np.zeros(length)
+        for freq, amp, start in self.notes.values():
+            elapsed = (t - start) / self.samplerate
+            mono += 0.2 * amp * np.sin(2 * np.pi * freq * elapsed) * np.exp(-3 * elapsed)
+        self.position += length
+        pcm = (np.clip(mono, -1, 1) * 32767).astype(np.int16)
+        return np.repeat(pcm, 2)
+
+
+def load_synth(soundfont, fake, samplerate):
+    if fake:
+        return FakeSynth(samplerate), None
+    import fluidsynth
+    synth = fluidsynth.Synth(samplerate=samplerate)
+    return synth, synth.sfload(soundfont)
+
+
+def midi_events(midi):
+    """(time, order, kind, channel, pitch, velocity) for every note, plus one program
+    select per channel, note-offs sort before note-ons at the same time"""
+    import pretty_midi
+    pm = pretty_midi.PrettyMIDI(io.BytesIO(midi))
+    programs, events = [], []
+    free_channels = [c for c in range(16) if c != DRUM_CHANNEL]
+    for instrument in pm.instruments:
+        if instrument.is_drum:
+            channel, bank = DRUM_CHANNEL, 128
+        elif free_channels:
+            channel, bank = free_channels.pop(0), 0
+        else:
+            continue
+        programs.append((channel, bank, 0 if instrument.is_drum else instrument.program))
+        for note in instrument.notes:
+            events.append((note.start, 1, "on", channel, note.pitch, note.velocity))
+            events.append((note.end, 0, "off", channel, note.pitch, 0))
+    events.sort()
+    return programs, events
+
+
+def render(synth, sfid, midi, samplerate):
+    """Render MIDI bytes to interleaved s16le stereo PCM"""
+    programs, events = midi_events(midi)
+    for channel, bank, preset in programs:
+        synth.program_select(channel, sfid, bank, preset)
+    chunks, cursor = [], 0
+    for time, _, kind, channel, pitch, velocity in events:
+        target = int(time * samplerate)
+        if target > cursor:
+            chunks.append(synth.get_samples(target - cursor))
+            cursor = target
+        if kind == "on":
+            synth.noteon(channel, pitch, velocity)
+        else:
+            synth.noteoff(channel, pitch)
+    chunks.append(synth.get_samples(int(TAIL_SECONDS * samplerate)))
+    synth.system_reset()
+    return np.concatenate(chunks).astype(np.int16).tobytes()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--soundfont", default="FluidR3_GM.sf2")
+    parser.add_argument("--samplerate", type=int, default=44100)
+    parser.add_argument("--fake", action="store_true", help="sine stand-in, no fluidsynth needed")
+    args = parser.parse_args()
+
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    # keep stray prints from libraries out of the protocol stream
+    sys.stdout = sys.stderr
+    synth, sfid = load_synth(args.soundfont, args.fake, args.samplerate)
+    write_frame(stdout, b"K")
+    while True:
+        op, payload = read_frame(stdin)
+        if op is None:
+            break
+        if op == b"P":
+            write_frame(stdout, b"K")
+        elif op == b"R":
+            try:
+                write_frame(stdout, b"D", render(synth, sfid, payload, args.samplerate))
+            except Exception as e:
+                synth.system_reset()
+                write_frame(stdout, b"E", str(e).encode())
+        else:
+            write_frame(stdout, b"E", f"unknown op {op!r}".encode())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import asyncio
+import sys
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from serving.execution import ExecutionLayer
+from serving.synth_pool import SynthPool
+
+
+@pytest.fixture
+def one_slot(monkeypatch):
+    execution = ExecutionLayer(io_threads=2, render_concurrency=1, max_active=1, max_queue=0)
+    monkeypatch.setattr(main, "execution", execution)
+    return execution
+
+
+def test_stream_holds_a_slot_and_is_rejected_when_full(one_slot, monkeypatch):
+    sampled = threading.Event()
+    release = threading.Event()
+
+    async def stream(*args):
+        yield "start", {}
+        sampled.set()
+        await asyncio.to_thread(release.wait, 10)
+        yield "done", {}
+
+    monkeypatch.setattr(main.pipeline, "stream", stream)
+    client = TestClient(main.app)
+    first = threading.Thread(target=client.get, args=("/generate/stream",), kwargs={"params": {"model_type": "Drum"}})
+    first.start()
+    assert sampled.wait(10)
+    assert one_slot.running == 1
+    assert client.get("/generate/stream", params={"model_type": "Drum"}).status_code == 503
+    release.set()
+    first.join(10)
+    assert one_slot.running == 0
+    assert "event: done" in client.get("/generate/stream", params={"model_type": "Drum"}).text
+
+
+def test_startup_falls_back_to_the_fluidsynth_cli_without_synth_workers(monkeypatch):
+    broken = SynthPool(1, [sys.executable, "-c", "raise SystemExit(1)"], start_timeout=10)
+    monkeypatch.setattr(main, "synth_pool", broken)
+    monkeypatch.setattr(main.pipeline, "synth_pool", broken)
+    with TestClient(main.app) as client:
+        assert main.synth_pool is None and main.pipeline.synth_pool is None
+        assert client.get("/generate/mp3", params={"model_type": "Drum"}).status_code == 501
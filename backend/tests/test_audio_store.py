@@ -0,0 +1,33 @@
+import os
+import time
+
+from serving.audio_store import AudioStore
+from serving.cache import link_or_copy
+
+
+def test_ttl_counts_from_when_a_cache_hit_was_added(tmp_path):
+    render = tmp_path / "cache.mp3"
+    render.write_bytes(b"\xff" * 100)
+    old = time.time() - 3600
+    os.utime(render, (old, old))
+
+    store = AudioStore(str(tmp_path / "audio"), ttl=60)
+    served = os.path.join(store.root, "generated_1.mp3")
+    link_or_copy(str(render), served)  # a cache hit keeps the render's mtime
+    store.add(served)
+
+    assert store.sweep() == 0
+    assert store.get("generated_1.mp3") is not None
+    assert os.path.exists(served)
+
+
+def test_expired_files_are_removed(tmp_path):
+    store = AudioStore(str(tmp_path), ttl=60)
+    path = tmp_path / "generated_2.wav"
+    path.write_bytes(b"\x00" * 100)
+    store.add(str(path))
+    store.get("generated_2.wav").added -= 120
+
+    assert store.sweep() == 1
+    assert store.get("generated_2.wav") is None
+    assert not path.exists()
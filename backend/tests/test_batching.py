@@ -0,0 +1,66 @@
+import math
+import time
+
+import pytest
+import torch
+
+from serving.batching import BatchScheduler
+
+
+class _Model(torch.nn.Module):
+    """step() like the LSTM models: logits of the last position and an (h, c) state.
+    Every id predicts a uniform distribution, so sampling never ends early."""
+
+    def __init__(self, vocab=8, delay=0.0):
+        super().__init__()
+        self.vocab = vocab
+        self.delay = delay
+        self.weight = torch.nn.Parameter(torch.zeros(1))
+
+    def step(self, x, state=None):
+        time.sleep(self.delay)
+        batch = x.shape[0]
+        if state is None:
+            state = (torch.zeros(1, batch, 1), torch.zeros(1, batch, 1))
+        return torch.zeros(batch, self.vocab), state
+
+
+def _scheduler(**kwargs):
+    model = _Model(**kwargs)
+    return BatchScheduler(lambda: model, window_ms=20)
+
+
+def test_cancelled_row_does_not_fail_its_batch():
+    scheduler = _scheduler(delay=0.002)
+    try:
+        cancelled = scheduler.submit([1, 2], max_tokens=200)
+        kept = scheduler.submit([1, 2], max_tokens=200)
+        time.sleep(0.05)
+        assert cancelled.cancel() or cancelled.done()
+        assert len(kept.result(timeout=10)) == 200
+    finally:
+        scheduler.stop()
+
+
+def test_row_whose_sampling_fails_does_not_fail_its_batch():
+    scheduler = _scheduler()
+    try:
+        # a generator torch.multinomial rejects fails only this row's sampling
+        bad = scheduler.submit([1, 2], max_tokens=20, generator=object())
+        good = scheduler.submit([1, 2], max_tokens=20)
+        assert len(good.result(timeout=10)) == 20
+        with pytest.raises(TypeError):
+            bad.result(timeout=10)
+    finally:
+        scheduler.stop()
+
+
+def test_non_positive_temperature_is_rejected_at_submit():
+    scheduler = _scheduler()
+    try:
+        with pytest.raises(ValueError):
+            scheduler.submit([1, 2], max_tokens=20, temperature=0)
+        with pytest.raises(ValueError):
+            scheduler.submit([1, 2], max_tokens=20, temperature=math.nan)
+    finally:
+        scheduler.stop()
@@ -0,0 +1,48 @@
+import pytest
+import torch
+
+from drum.drum_gen import DrumGenerator
+from Final_Final.generator import DEFAULT_MAP_PATH, DEFAULT_MODEL_PATH, MelodyGenerator
+
+CHECKPOINTS = {
+    "melody": (MelodyGenerator, DEFAULT_MODEL_PATH, DEFAULT_MAP_PATH),
+    "drum": (DrumGenerator, "drum/model_drum.pth", "drum/drum_map.json"),
+}
+
+
+@pytest.fixture(scope="module", params=list(CHECKPOINTS))
+def generator(request):
+    cls, model_path, map_path = CHECKPOINTS[request.param]
+    return cls(model_path=model_path, map_path=map_path)
+
+
+def _tokens(generator, length):
+    return torch.randint(0, generator.vocab_size, (1, length), generator=torch.Generator().manual_seed(0))
+
+
+def test_step_matches_forward_on_the_whole_prefix(generator):
+    model = generator.model
+    tokens = _tokens(generator, 64).to(generator.device)
+    with torch.no_grad():
+        logits, state = model.step(tokens[:, :16])
+        assert torch.allclose(logits, model(tokens[:, :16]), atol=1e-5)
+        for t in range(16, tokens.shape[1]):
+            logits, state = model.step(tokens[:, t:t + 1], state)
+            assert torch.allclose(logits, model(tokens[:, :t + 1]), atol=1e-5), f"diverged at token {t}"
+
+
+def test_stateful_decoding_samples_like_the_sliding_window(generator):
+    """Serving carries the state past the 128-token window the models were trained on.
+    Nothing makes an LSTM forget what fell out of the window, so the logits are not
+    compared: only the next-token distributions have to stay close (total variation
+    below 0.05), which is what sampling sees. A checkpoint that fails this depends on
+    context older than the window, and stateful decoding changes its output."""
+    model, window = generator.model, 128
+    tokens = _tokens(generator, window + 64).to(generator.device)
+    with torch.no_grad():
+        _, state = model.step(tokens[:, :window])
+        for t in range(window, tokens.shape[1]):
+            stateful, state = model.step(tokens[:, t:t + 1], state)
+            windowed = model(tokens[:, t - window + 1:t + 1])
+            distance = (torch.softmax(stateful, -1) - torch.softmax(windowed, -1)).abs().sum() / 2
+            assert distance < 0.05, f"next-token distributions differ by {distance:.3f} at token {t}"
@@ -0,0 +1,72 @@
+import asyncio
+import time
+import types
+
+import pytest
+
+from serving import jobs
+from serving.jobs import DONE, FAILED, QUEUED, RUNNING, InMemoryJobStore, JobManager, SQLiteJobStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryJobStore()
+    return SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=time.time())
+    monkeypatch.setattr(jobs, "time", types.SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+async def _no_job(job, progress):
+    return {}
+
+
+def _finish(store):
+    job = store.claim()
+    store.update(job["id"], status=DONE, result={})
+    return job
+
+
+def test_sweep_deletes_expired_jobs_and_their_files(store, clock, tmp_path):
+    results = tmp_path / "jobs"
+    old = store.create({}, ["generate"])
+    recent = store.create({}, ["generate"])
+    queued = store.create({}, ["generate"])
+    _finish(store)
+    clock.now += 7200
+    _finish(store)
+    for job in (old, recent):
+        (results / job["id"]).mkdir(parents=True)
+    orphan = results / "lost"
+    orphan.mkdir()
+
+    assert JobManager(store, _no_job, results_dir=str(results), ttl=3600).sweep() == 1
+    assert store.get(old["id"]) is None
+    assert not (results / old["id"]).exists()
+    assert store.get(recent["id"])["status"] == DONE
+    assert (results / recent["id"]).exists()
+    assert store.get(queued["id"])["status"] == QUEUED
+    # written when the clock was still two hours back
+    assert not orphan.exists()
+
+
+def test_start_fails_jobs_left_running(store, clock):
+    stale = store.create({}, ["generate"])
+    store.claim()
+    clock.now += 7200
+    fresh = store.create({}, ["generate"])
+    store.claim()
+
+    async def start_and_stop():
+        manager = JobManager(store, _no_job, stale_after=3600)
+        await manager.start()
+        await manager.stop()
+    asyncio.run(start_and_stop())
+
+    assert store.get(stale["id"])["status"] == FAILED
+    assert store.get(fresh["id"])["status"] == RUNNING
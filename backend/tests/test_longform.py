@@ -0,0 +1,38 @@
+import asyncio
+import sys
+
+import pytest
+
+from drum.drum_gen import DrumGenerator
+from serving.batching import BatchScheduler
+from serving.execution import ExecutionLayer
+from serving.pipeline import GenerationPipeline
+from serving.registry import ModelRegistry
+from serving.synth_pool import SynthPool
+
+
+def test_long_form_fails_instead_of_hanging_when_ffmpeg_exits(tmp_path, monkeypatch):
+    registry = ModelRegistry()
+    registry.register("Drum", DrumGenerator, "drum/model_drum.pth", "drum/drum_map.json")
+    scheduler = BatchScheduler(lambda: registry.get("Drum").model)
+    pool = SynthPool(1, [sys.executable, "-m", "serving.synth_worker", "--soundfont", "unused.sf2", "--fake"])
+    execution = ExecutionLayer(io_threads=2, render_concurrency=2, max_active=1, max_queue=0)
+    pipeline = GenerationPipeline(registry, {"Drum": scheduler}, execution, synth_pool=pool)
+    # exits without reading its input, after the queue in front of it has filled up
+    monkeypatch.setattr(pipeline, "pcm_to_mp3_command",
+                        lambda output: [sys.executable, "-c", "import time; time.sleep(1); raise SystemExit(3)"])
+
+    async def main():
+        await pool.start()
+        try:
+            await asyncio.wait_for(pipeline.run_long("Drum", str(tmp_path), 120, keep=("mp3",), chunk_bars=1),
+                                   timeout=10)
+        finally:
+            await pool.stop()
+
+    try:
+        with pytest.raises(RuntimeError):
+            asyncio.run(main())
+    finally:
+        scheduler.stop()
+        execution.shutdown()
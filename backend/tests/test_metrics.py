@@ -0,0 +1,11 @@
+from serving.metrics import Metrics
+
+
+def test_running_totals_are_exposed_as_counters():
+    rejected = [0]
+    metrics = Metrics(prefix="test")
+    metrics.counter("requests_rejected_total", "Requests rejected with 503", read=lambda: rejected[0])
+    rejected[0] = 3
+    lines = metrics.render().splitlines()
+    assert "# TYPE test_requests_rejected_total counter" in lines
+    assert "test_requests_rejected_total 3" in lines
@@ -0,0 +1,18 @@
+import numpy as np
+
+from midi_writer import arrangement_to_midi, melody_runs, melody_to_midi
+
+
+def test_melody_runs_of_only_holds_are_empty():
+    for melody in (["_", "_"], ["_"] * 16):
+        symbols, steps = melody_runs(melody)
+        assert len(symbols) == 0 and len(steps) == 0
+        assert melody_to_midi(melody) == melody_to_midi([])
+        assert arrangement_to_midi(melody, [], {0: "36"}) == arrangement_to_midi([], [], {0: "36"})
+
+
+def test_leading_holds_lengthen_the_first_symbol():
+    symbols, steps = melody_runs("_ _ 60 _ 62 _ R".split())
+    assert symbols.tolist() == ["60", "62"]
+    np.testing.assert_array_equal(steps, [4, 2])
+    assert melody_to_midi("_ _ 60 _ 62 _ R".split()) == melody_to_midi("60 _ _ _ 62 _ R".split())
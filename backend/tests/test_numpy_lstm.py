@@ -0,0 +1,30 @@
+import numpy as np
+import torch
+
+import numpy_lstm
+from lstm_model import Model
+
+
+def _assert_close(actual, expected):
+    np.testing.assert_allclose(actual, expected.numpy(), rtol=1e-4, atol=1e-5)
+
+
+def test_converted_model_matches_torch_step_by_step(tmp_path):
+    torch.manual_seed(0)
+    vocab_size, hidden_dim = 20, 16
+    model = Model(hidden_dim, vocab_size, hidden_dim, vocab_size).eval()
+    torch.save(model.state_dict(), tmp_path / "model.pth")
+    npz_path = numpy_lstm.convert(str(tmp_path / "model.pth"), str(tmp_path / "model.npz"), checkpoint_hash="test")
+    converted = numpy_lstm.NumpyModel.load(npz_path)
+
+    # a batch of three prompts, then one token per step from the carried state
+    tokens = torch.randint(0, vocab_size, (3, 12))
+    chunks = [tokens[:, :4]] + [tokens[:, t:t + 1] for t in range(4, tokens.shape[1])]
+    state, numpy_state = None, None
+    for chunk in chunks:
+        with torch.no_grad():
+            expected, state = model.step(chunk, state)
+        logits, numpy_state = converted.step(chunk.numpy(), numpy_state)
+        _assert_close(logits, expected)
+        _assert_close(numpy_state[0], state[0])
+        _assert_close(numpy_state[1], state[1])
@@ -0,0 +1,40 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import torch
+
+from serving.registry import ModelRegistry
+
+
+def test_reload_rejects_checkpoints_outside_the_models_directory(tmp_path):
+    models = tmp_path / "models"
+    models.mkdir()
+    registry = ModelRegistry()
+    registry.register("Melody", object, str(models / "model.pth"), str(models / "map.json"))
+
+    for path in (tmp_path / "model.pth", models / ".." / "model.pth", "/etc/passwd"):
+        with pytest.raises(ValueError):
+            registry.reload("Melody", str(path))
+
+
+def test_concurrent_first_requests_build_the_model_once(tmp_path):
+    built = []
+
+    class Generator:
+        def __init__(self, model_path, map_path):
+            built.append(model_path)
+            time.sleep(0.2)
+            self.model = torch.nn.Linear(1, 1)
+
+        def warmup(self):
+            pass
+
+    (tmp_path / "model.pth").write_bytes(b"weights")
+    registry = ModelRegistry()
+    registry.register("Melody", Generator, str(tmp_path / "model.pth"), str(tmp_path / "map.json"))
+    with ThreadPoolExecutor(4) as pool:
+        generators = list(pool.map(lambda _: registry.get("Melody"), range(4)))
+
+    assert len(built) == 1
+    assert all(generator is generators[0] for generator in generators)
@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+from serving.execution import ExecutionLayer
+from serving.streaming import iterate_in_thread
+
+
+def _tokens(count):
+    for i in range(count):
+        time.sleep(0.001)
+        yield i
+
+
+async def _consume(execution, count, max_buffered):
+    """Like run_long: every item is handed to the execution pool before the next one"""
+    seen = []
+    async for item in iterate_in_thread(lambda: _tokens(count), max_buffered=max_buffered):
+        await execution.run_in_thread(seen.append, item)
+    return seen
+
+
+def test_backpressured_streams_do_not_starve_the_pool():
+    async def main():
+        execution = ExecutionLayer(io_threads=2)
+        try:
+            results = await asyncio.wait_for(
+                asyncio.gather(*(_consume(execution, 50, max_buffered=2) for _ in range(4))), timeout=10)
+        finally:
+            execution.shutdown()
+        return results
+
+    for seen in asyncio.run(main()):
+        assert seen == list(range(50))
+
+
+def test_closing_the_consumer_closes_the_iterator():
+    closed = []
+
+    def tokens():
+        try:
+            yield from _tokens(1000)
+        finally:
+            closed.append(True)
+
+    async def main():
+        stream = iterate_in_thread(tokens, max_buffered=1)
+        assert await anext(stream) == 0
+        await stream.aclose()
+        for _ in range(50):
+            if closed:
+                break
+            await asyncio.sleep(0.02)
+
+    asyncio.run(main())
+    assert closed == [True]
+
+
+def test_iterator_errors_reach_the_consumer():
+    def tokens():
+        yield 1
+        raise ValueError("bad token")
+
+    async def main():
+        return [item async for item in iterate_in_thread(tokens)]
+
+    try:
+        asyncio.run(main())
+    except ValueError as e:
+        assert str(e) == "bad token"
+    else:
+        raise AssertionError("the iterator's error was swallowed")
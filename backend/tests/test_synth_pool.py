@@ -0,0 +1,44 @@
+import asyncio
+import sys
+
+import pytest
+
+from midi_writer import melody_to_midi
+from serving.synth_pool import SynthPool, SynthWorkerError
+
+SHORT = melody_to_midi("60 _ _ _ 62 _ _ _ R".split())
+LONG = melody_to_midi(("60 _ _ _ _ _ _ _ " * 400 + "R").split())
+
+
+def _pool():
+    return SynthPool(1, [sys.executable, "-m", "serving.synth_worker", "--soundfont", "unused.sf2", "--fake"])
+
+
+def test_cancelled_render_does_not_leak_its_reply():
+    async def main():
+        pool = _pool()
+        await pool.start()
+        try:
+            expected = await pool.render(SHORT)
+            render = asyncio.create_task(pool.render(LONG))
+            await asyncio.sleep(0.05)
+            render.cancel()
+            await asyncio.gather(render, return_exceptions=True)
+            assert render.cancelled()
+            after = await asyncio.wait_for(pool.render(SHORT), timeout=10)
+            return expected, after, pool.health()
+        finally:
+            await pool.stop()
+
+    expected, after, health = asyncio.run(main())
+    assert after == expected
+    assert health["workers"][0]["restarts"] == 1
+
+
+def test_start_fails_when_no_worker_starts():
+    async def main():
+        pool = SynthPool(2, [sys.executable, "-c", "raise SystemExit(1)"], start_timeout=10)
+        await pool.start()
+
+    with pytest.raises(SynthWorkerError):
+        asyncio.run(main())
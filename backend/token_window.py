@@ -0,0 +1,30 @@
+'''The sliding window of token ids the generators feed the model when they
+re-run the whole window every step (stateful=False).'''
+import numpy as np
+
+
+class TokenWindow:
+    """The last size token ids, kept in a preallocated buffer of 2 * size.
+
+    Appending writes one slot. Once the buffer is full, its last size - 1 ids are
+    copied to the front, once every size appends. So sliding the window costs O(1)
+    amortized, and memory stays fixed however many tokens pass through it.
+    """
+
+    def __init__(self, ids, size):
+        ids = np.asarray(ids, dtype=np.int64)[-size:]
+        self.size = size
+        self.buffer = np.empty(2 * size, dtype=np.int64)
+        self.buffer[:len(ids)] = ids
+        self.end = len(ids)
+
+    def append(self, index):
+        if self.end == len(self.buffer):
+            self.buffer[:self.size - 1] = self.buffer[self.end - self.size + 1:]
+            self.end = self.size - 1
+        self.buffer[self.end] = index
+        self.end += 1
+
+    def view(self):
+        """The window as an int64 array, valid until the next append"""
+        return self.buffer[max(0, self.end - self.size):self.end]
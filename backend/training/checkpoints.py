@@ -0,0 +1,106 @@
+'''Resumable training checkpoints.
+
+Every epoch the trainer writes <dir>/epoch-0007.pt. The file holds the
+model and optimizer state, the epoch, the RNG states, the hash of the
+vocabulary, and the validation and early-stopping bookkeeping. Files are
+written to a temporary name and renamed into place, so a crash never
+leaves a truncated checkpoint behind. Only the last `keep` checkpoints,
+plus the one with the lowest validation loss, are kept. They are listed
+in <dir>/checkpoints.json.'''
+import json
+import os
+import random
+
+import numpy as np
+import torch
+
+INDEX = "checkpoints.json"
+
+
+def atomic_save(obj, path):
+    """torch.save that leaves either the old or the new file at path, never half of one"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def rng_state():
+    state = {"python": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+class CheckpointManager:
+    """The checkpoints of one training run in directory, the last keep of them
+    plus the best by validation loss"""
+
+    def __init__(self, directory, keep=3):
+        self.directory = directory
+        self.keep = max(1, keep)
+        os.makedirs(directory, exist_ok=True)
+        self.entries = self._read_index()
+
+    def _read_index(self):
+        path = os.path.join(self.directory, INDEX)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r") as f:
+            entries = json.load(f)
+        # a crash between writing a checkpoint and the index can leave either behind
+        return [entry for entry in entries if os.path.exists(os.path.join(self.directory, entry["file"]))]
+
+    def _write_index(self):
+        path = os.path.join(self.directory, INDEX)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(self.entries, f, indent=4)
+        os.replace(f"{path}.tmp", path)
+
+    def best(self):
+        scored = [entry for entry in self.entries if entry["val_loss"] is not None]
+        return min(scored, key=lambda entry: entry["val_loss"]) if scored else None
+
+    def latest_path(self):
+        return os.path.join(self.directory, self.entries[-1]["file"]) if self.entries else None
+
+    def save(self, state, epoch, val_loss):
+        """Writes state as the checkpoint of epoch and drops the ones no longer kept"""
+        name = f"epoch-{epoch:04d}.pt"
+        atomic_save(state, os.path.join(self.directory, name))
+        val_loss = None if val_loss is None or np.isnan(val_loss) else float(val_loss)
+        self.entries = [entry for entry in self.entries if entry["file"] != name]
+        self.entries.append({"file": name, "epoch": epoch, "val_loss": val_loss})
+        kept = self.entries[-self.keep:]
+        best = self.best()
+        if best is not None and best not in kept:
+            kept.insert(0, best)
+        removed = [entry for entry in self.entries if entry not in kept]
+        self.entries = kept
+        self._write_index()
+        for entry in removed:
+            os.remove(os.path.join(self.directory, entry["file"]))
+
+    def clear(self):
+        for entry in self.entries:
+            os.remove(os.path.join(self.directory, entry["file"]))
+        self.entries = []
+        self._write_index()
+
+    def load(self, path=None):
+        """The latest checkpoint (or path), None when there is none"""
+        path = path or self.latest_path()
+        if path is None:
+            return None
+        # written by save above, the RNG states need the full unpickler
+        return torch.load(path, map_location="cpu", weights_only=False)
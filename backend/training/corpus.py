@@ -0,0 +1,144 @@
+'''Token corpora as one int array, and the fixed-length training windows over it.
+
+A corpus text file (space separated tokens, as written by Final_Final/data.py and
+drum/drum_data.py) is encoded once, in chunks, into a .npy next to it and
+memory-mapped from then on. Windows are views or on-demand slices of that array,
+so a corpus never has to fit in RAM, let alone N copies of a 128-token window.'''
+import json
+import os
+
+import numpy as np
+
+from vocabulary import Vocabulary
+
+CHUNK_BYTES = 1 << 22
+
+
+def load_mapping(map_path):
+    with open(map_path, "r") as f:
+        return json.load(f)
+
+
+def id_dtype(mapping):
+    """Smallest unsigned int type holding every id of mapping"""
+    return np.min_scalar_type(max(mapping.values(), default=0))
+
+
+def encode(tokens, mapping, dtype=None):
+    """Token strings -> id array, see Vocabulary.encode
+
+    :raises KeyError: for a token that is not in mapping
+    """
+    return Vocabulary(mapping).encode(tokens, dtype or id_dtype(mapping))
+
+
+def _chunks(text_path, chunk_bytes=CHUNK_BYTES):
+    """Token lists of text_path, read chunk_bytes at a time without splitting a token"""
+    rest = ""
+    with open(text_path, "r") as f:
+        while True:
+            data = f.read(chunk_bytes)
+            if not data:
+                break
+            data = rest + data
+            cut = max(data.rfind(" "), data.rfind("\n"))
+            if cut < 0:
+                rest = data
+                continue
+            rest = data[cut:]
+            yield data[:cut].split()
+    if rest.split():
+        yield rest.split()
+
+
+def encode_file(text_path, mapping, npy_path, chunk_bytes=CHUNK_BYTES):
+    """Encodes a corpus text file into npy_path chunk by chunk, memory stays at
+    O(chunk_bytes) whatever the size of the corpus"""
+    count = sum(len(tokens) for tokens in _chunks(text_path, chunk_bytes))
+    dtype = id_dtype(mapping)
+    tmp_path = f"{npy_path}.tmp"
+    out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(count,))
+    offset = 0
+    vocab = Vocabulary(mapping)
+    for tokens in _chunks(text_path, chunk_bytes):
+        out[offset:offset + len(tokens)] = vocab.encode(tokens, dtype)
+        offset += len(tokens)
+    out.flush()
+    del out
+    os.replace(tmp_path, npy_path)
+    return npy_path
+
+
+def cache_path(text_path):
+    return os.path.splitext(text_path)[0] + ".npy"
+
+
+def load_corpus(text_path, map_path, npy_path=None, mmap=True):
+    """Encoded corpus of text_path as a read-only memory-mapped array. The .npy
+    cache is (re)built when missing or older than the text or the mapping."""
+    npy_path = npy_path or cache_path(text_path)
+    if (not os.path.exists(npy_path)
+            or os.path.getmtime(npy_path) < max(os.path.getmtime(text_path), os.path.getmtime(map_path))):
+        encode_file(text_path, load_mapping(map_path), npy_path)
+    return np.load(npy_path, mmap_mode="r" if mmap else None)
+
+
+def windows(encoded, sequence_length):
+    """(inputs, targets) for every position of encoded, inputs[i] being the
+    sequence_length ids before targets[i]. Both are views of encoded, nothing is copied."""
+    if len(encoded) <= sequence_length:
+        return np.empty((0, sequence_length), dtype=encoded.dtype), encoded[:0]
+    inputs = np.lib.stride_tricks.sliding_window_view(encoded[:-1], sequence_length)
+    return inputs, encoded[sequence_length:]
+
+
+class WindowDataset:
+    """The windows of encoded[start:stop] (counted in windows), sliced on demand.
+
+    Map-style, so it can go straight into a torch DataLoader; items are int64
+    (inputs, target) pairs ready for the embedding and the loss.
+    """
+
+    def __init__(self, encoded, sequence_length, start=0, stop=None):
+        total = max(len(encoded) - sequence_length, 0)
+        stop = total if stop is None else min(stop, total)
+        self.encoded = encoded
+        self.sequence_length = sequence_length
+        self.start = min(start, stop)
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getstate__(self):
+        # DataLoader workers started with spawn reopen the memory map instead of copying it
+        state = self.__dict__.copy()
+        if isinstance(self.encoded, np.memmap) and self.encoded.filename:
+            state["encoded"] = (self.encoded.filename, self.encoded.offset, self.encoded.dtype, self.encoded.shape)
+        return state
+
+    def __setstate__(self, state):
+        if isinstance(state["encoded"], tuple):
+            filename, offset, dtype, shape = state["encoded"]
+            state["encoded"] = np.memmap(filename, dtype=dtype, mode="r", offset=offset, shape=shape)
+        self.__dict__.update(state)
+
+    def __getitem__(self, index):
+        if not -len(self) <= index < len(self):
+            raise IndexError(index)
+        offset = self.start + index % len(self)
+        window = np.asarray(self.encoded[offset:offset + self.sequence_length + 1], dtype=np.int64)
+        return window[:-1], window[-1]
+
+    def batch(self, start, stop):
+        """int64 (inputs, targets) for the contiguous items start:stop, copied from
+        the strided view in one go"""
+        start, stop = self.start + start, self.start + min(stop, len(self))
+        inputs, targets = windows(self.encoded[start:stop + self.sequence_length], self.sequence_length)
+        return inputs.astype(np.int64), targets.astype(np.int64)
+
+    def split(self, fraction):
+        """(first fraction of the windows, the rest) as two datasets"""
+        cut = self.start + int(len(self) * fraction)
+        return (WindowDataset(self.encoded, self.sequence_length, self.start, cut),
+                WindowDataset(self.encoded, self.sequence_length, cut, self.stop))
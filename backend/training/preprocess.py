@@ -0,0 +1,145 @@
+'''Parallel, cached preprocessing of a song collection into a training corpus.
+
+  kern  .krn files: parsed with music21, filtered by duration, transposed to
+        C major / A minor and encoded at quarter-step resolution (Final_Final/data.py)
+  drum  .mid files: drum hits encoded at a 0.1 s timestep (drum/drum_data.py)
+
+Files are handled by a process pool, and each result is cached under
+<cache dir>/<kind>/<sha256 of file and settings>.txt, so a re-run on a grown
+collection only parses the new or changed files. Encoded songs are streamed
+to the corpus file in path order as they complete. Run from backend/ with
+python -m training.preprocess kern path/to/krn --workers 8'''
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from serving.cache import file_sha256
+
+KINDS = {
+    "kern": {
+        "module": "Final_Final.data",
+        "suffixes": (".krn",),
+        "output": lambda data: data.single_path,
+        "params": lambda data: {"durations": data.durations, "timestep": data.timestep},
+        "song_end": lambda data: data.song_end,
+    },
+    "drum": {
+        "module": "drum.drum_data",
+        "suffixes": (".mid", ".midi"),
+        "output": lambda data: data.SINGLE_SONG_PATH,
+        "params": lambda data: {"timestep": 0.1},
+        "song_end": lambda data: [],
+    },
+}
+
+
+def find_files(root, suffixes):
+    """Sorted paths under root ending in one of suffixes"""
+    paths = []
+    for dirpath, _, files in os.walk(root):
+        paths.extend(os.path.join(dirpath, file) for file in files if file.lower().endswith(suffixes))
+    return sorted(paths)
+
+
+def cache_key(path, kind, params):
+    settings = json.dumps([kind, params], sort_keys=True)
+    return hashlib.sha256(f"{file_sha256(path)}:{settings}".encode()).hexdigest()
+
+
+def _write(path, text):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _process(job):
+    """Worker: encode one file and cache the result, an empty cache entry marks a
+    file that was filtered out. Failures are returned rather than cached, so they
+    are retried on the next run."""
+    kind, path, cache_file, params = job
+    try:
+        tokens = importlib.import_module(KINDS[kind]["module"]).preprocess_file(path, **params)
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+    text = " ".join(tokens or [])
+    _write(cache_file, text)
+    return text, None
+
+
+def preprocess(kind, root, output=None, cache_dir=None, workers=None, map_path=None):
+    """Encodes every file of kind under root into output, returns the run's counts"""
+    config = KINDS[kind]
+    data = importlib.import_module(config["module"])
+    params = config["params"](data)
+    song_end = " ".join(config["song_end"](data))
+    output = output or config["output"](data)
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(output)), ".preprocess_cache")
+    cache_dir = os.path.join(cache_dir, kind)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    paths = find_files(root, config["suffixes"])
+    cache_files = [os.path.join(cache_dir, f"{cache_key(path, kind, params)}.txt") for path in paths]
+    pending = [(kind, path, cache_file, params)
+               for path, cache_file in zip(paths, cache_files) if not os.path.exists(cache_file)]
+    counts = {"files": len(paths), "cached": len(paths) - len(pending), "processed": 0,
+              "skipped": 0, "failed": 0, "tokens": 0}
+    tokens = set()
+
+    tmp_output = f"{output}.tmp"
+    with ProcessPoolExecutor(max_workers=workers) as executor, open(tmp_output, "w") as out:
+        chunksize = max(1, len(pending) // (8 * (workers or os.cpu_count() or 1)))
+        results = executor.map(_process, pending, chunksize=chunksize)
+        pending_paths = {job[1] for job in pending}
+        first = True
+        for path, cache_file in zip(paths, cache_files):
+            if path in pending_paths:
+                text, error = next(results)
+                if error:
+                    counts["failed"] += 1
+                    print(f"{path}: {error}")
+                    continue
+                counts["processed"] += 1
+            else:
+                with open(cache_file) as f:
+                    text = f.read()
+            if not text:
+                counts["skipped"] += 1
+                continue
+            song = text.split()
+            tokens.update(song)
+            counts["tokens"] += len(song)
+            out.write(("" if first else " ") + text + (" " + song_end if song_end else ""))
+            first = False
+    os.replace(tmp_output, output)
+
+    if map_path:
+        tokens.update(config["song_end"](data))
+        with open(map_path, "w") as f:
+            json.dump({token: i for i, token in enumerate(sorted(tokens))}, f, indent=4)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("kind", choices=list(KINDS))
+    parser.add_argument("root", help="directory searched recursively for songs")
+    parser.add_argument("--output", help="corpus file, defaults to the one the training scripts read")
+    parser.add_argument("--cache-dir", help="defaults to .preprocess_cache next to the output")
+    parser.add_argument("--workers", type=int, help="processes, defaults to the number of CPUs")
+    parser.add_argument("--map", help="also write a token -> id mapping of the corpus here")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = preprocess(args.kind, args.root, args.output, args.cache_dir, args.workers, args.map)
+    print(f"{counts['files']} files ({counts['cached']} cached, {counts['processed']} processed, "
+          f"{counts['skipped']} filtered out, {counts['failed']} failed), {counts['tokens']} tokens "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+'''Truncated-BPTT training (--bptt N on the training scripts).
+
+Window training reads every token sequence_length times per epoch, once in each
+window that contains it, and gets one loss term per 128-step forward and
+backward. Here the corpus is laid out as parallel streams that are read in
+consecutive chunks of N tokens. The loss covers every position, and the LSTM
+state is carried, detached, from one chunk into the next. Every token is then
+read once per epoch. The same Model is trained, so checkpoints load into the
+generators unchanged.'''
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+
+from training.trainer import Trainer
+
+
+class ChunkDataset:
+    """tokens[offset:] cut into streams equal rows, item i being the int64
+    (inputs, targets) columns [i * length, (i + 1) * length) of the rows
+    rank::world_size, targets shifted by one token. Items have to be read in
+    order for a carried state to line up; the last one may be shorter."""
+
+    def __init__(self, tokens, streams, length, offset=0, rank=0, world_size=1):
+        tokens = tokens[offset:]
+        per_stream = len(tokens) // streams
+        self.rows = tokens[:streams * per_stream].reshape(streams, per_stream)[rank::world_size]
+        self.length = length
+
+    def __len__(self):
+        return -(-max(self.rows.shape[1] - 1, 0) // self.length)
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start = index * self.length
+        chunk = np.asarray(self.rows[:, start:start + self.length + 1], dtype=np.int64)
+        return chunk[:, :-1], chunk[:, 1:]
+
+
+class SequenceModel(nn.Module):
+    """The generators' Model with its head applied at every position:
+    ids (batch, steps), state -> logits (batch, steps, vocab), state. Model's
+    forward is the last position of this."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x, state=None):
+        out, state = self.model.lstm1(self.model.embedding(x), state)
+        return self.model.mlp(out), state
+
+
+class TBPTTTrainer(Trainer):
+    """Trainer over token arrays instead of window datasets: batch_size streams
+    per process, bptt tokens per chunk and optimizer step"""
+
+    def __init__(self, model, train_tokens, val_tokens, checkpoint_path, bptt=128, **kwargs):
+        self.bptt = bptt
+        self.hidden = None
+        super().__init__(model, train_tokens, val_tokens, checkpoint_path, **kwargs)
+
+    def wrap(self, model):
+        return SequenceModel(model)
+
+    def build_loaders(self):
+        # the chunk boundaries move every epoch, so loaders are built per epoch
+        pass
+
+    def _loader(self, dataset):
+        # each item already is a whole batch
+        return DataLoader(dataset, batch_size=None, shuffle=False, **self.loader_args)
+
+    def train_batches(self, epoch):
+        # a different shift every epoch so each token is predicted from different chunk offsets
+        offset = int(torch.randint(self.bptt, (1,), generator=torch.Generator().manual_seed(self.seed + epoch)))
+        self.hidden = None
+        streams = self.batch_size * self.world_size
+        return self._loader(ChunkDataset(self.train_set, streams, self.bptt, offset, self.rank, self.world_size))
+
+    def val_batches(self):
+        self.hidden = None
+        # fewer streams on a small validation split so each is still a few chunks long
+        streams = max(1, min(self.batch_size * self.world_size, len(self.val_set) // (4 * self.bptt)))
+        rank, world_size = (self.rank, self.world_size) if streams >= self.world_size else (0, 1)
+        if rank != self.rank:
+            return []
+        return self._loader(ChunkDataset(self.val_set, streams, self.bptt, 0, rank, world_size))
+
+    def _carry(self, state):
+        self.hidden = tuple(s.detach() for s in state)
+
+    def batch_loss(self, features, targets):
+        logits, state = self.model(features, self.hidden)
+        self._carry(state)
+        return self.loss_fn(logits.flatten(0, 1), targets.flatten()), targets.numel()
+
+    def val_loss(self, features, targets):
+        logits, state = self.module(features, self.hidden)
+        self._carry(state)
+        return nn.functional.cross_entropy(logits.flatten(0, 1), targets.flatten(), reduction="sum").item(), \
+            targets.numel()
@@ -0,0 +1,316 @@
+'''Training loop shared by Final_Final/model.py and drum/model_drum.py.
+
+Batches come from shuffled DataLoaders over a WindowDataset, optionally
+prefetched by worker processes, and gradients can be accumulated over several
+batches. Started with torchrun the loop runs data-parallel (DDP over gloo on
+CPU), one shard of every epoch per process:
+
+    torchrun --nproc_per_node 4 -m Final_Final.model --epochs 50
+
+and across machines with torchrun's --nnodes/--rdzv-endpoint options.'''
+import argparse
+import contextlib
+import math
+import os
+import time
+
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, DistributedSampler, RandomSampler, Subset
+from tqdm.auto import tqdm
+
+from training.checkpoints import CheckpointManager, atomic_save, rng_state, set_rng_state
+from vocabulary import Vocabulary
+
+
+def add_arguments(parser, epochs=200, batch_size=256, lr=0.0001):
+    parser.add_argument("--epochs", type=int, default=epochs)
+    parser.add_argument("--batch-size", type=int, default=batch_size, help="per process and per step")
+    parser.add_argument("--lr", type=float, default=lr)
+    parser.add_argument("--accumulation-steps", type=int, default=1,
+                        help="batches whose gradients are summed before each optimizer step")
+    parser.add_argument("--workers", type=int, default=0, help="DataLoader worker processes")
+    parser.add_argument("--prefetch", type=int, default=2, help="batches prefetched per worker")
+    parser.add_argument("--val-fraction", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, help="torch threads per process, by default the cores split evenly")
+    parser.add_argument("--bptt", type=int, default=0,
+                        help="truncated-BPTT chunk length, trains on --batch-size token streams with the loss at "
+                             "every position instead of one target per window (see training/tbptt.py)")
+    parser.add_argument("--checkpoint", help="where the best weights go, by default where the generator loads them")
+    parser.add_argument("--checkpoint-dir", help="resumable checkpoints, by default checkpoints/ next to --checkpoint")
+    parser.add_argument("--keep", type=int, default=3, help="recent checkpoints kept besides the best one")
+    parser.add_argument("--fresh", action="store_true", help="start over instead of resuming the latest checkpoint")
+    parser.add_argument("--patience", type=int, default=0,
+                        help="stop after this many epochs without a better validation loss, 0 never stops early")
+    parser.add_argument("--min-delta", type=float, default=0.0, help="smallest validation loss drop that counts")
+    return parser
+
+
+def parse_args(argv=None, **defaults):
+    return add_arguments(argparse.ArgumentParser(), **defaults).parse_args(argv)
+
+
+def setup_distributed():
+    """(rank, world size), joining the process group when started by torchrun"""
+    world_size = int(os.environ.get("WORLD_SIZE", "1"))
+    if world_size > 1 and not dist.is_initialized():
+        dist.init_process_group("nccl" if torch.cuda.is_available() else "gloo")
+    return (dist.get_rank(), dist.get_world_size()) if dist.is_initialized() else (0, 1)
+
+
+def _all_reduce(*values):
+    """values summed over every process"""
+    tensor = torch.tensor(values, dtype=torch.float64)
+    if dist.is_initialized():
+        dist.all_reduce(tensor)
+    return tensor.tolist()
+
+
+class Trainer:
+    """Fits a next-token model (ids (batch, steps) -> logits (batch, vocab)) on
+    (inputs, target) datasets.
+
+    :param accumulation_steps (int): optimizer step every this many batches, the
+        effective batch is batch_size * accumulation_steps * world size
+    :param workers (int): DataLoader processes slicing and collating batches ahead
+        of the training step, prefetch batches each
+
+    :param checkpoint_path (str): the weights with the best validation loss so far
+        are written here, as the plain state dict the generators load
+    :param vocab (Vocabulary): what the model is trained on, its hash is recorded
+        with the checkpoints and next to checkpoint_path
+    :param checkpoints (CheckpointManager): resumable per-epoch checkpoints, see resume
+    :param patience (int): epochs without a validation loss min_delta below the
+        best before fit stops, 0 never stops early
+
+    Subclasses change what is trained on through wrap, train_batches, val_batches,
+    batch_loss and the validation loss, the accumulation, DDP and logging stay here.
+    """
+
+    def __init__(self, model, train_set, val_set, checkpoint_path, lr=0.0001, batch_size=256,
+                 accumulation_steps=1, workers=0, prefetch=2, seed=0, device=None,
+                 checkpoints=None, vocab=None, patience=0, min_delta=0.0):
+        self.rank, self.world_size = setup_distributed()
+        if device is None:
+            device = f"cuda:{int(os.environ.get('LOCAL_RANK', 0))}" if torch.cuda.is_available() else "cpu"
+        self.device = torch.device(device)
+        # network is what gets saved, module what is trained, model the same behind DDP
+        self.network = model.to(self.device)
+        self.module = self.wrap(self.network)
+        self.model = self.module
+        if self.world_size > 1:
+            device_ids = [self.device] if self.device.type == "cuda" else None
+            # the generators' Model computes a LayerNorm it never uses, so its parameters get no gradient
+            self.model = DistributedDataParallel(self.module, device_ids=device_ids, find_unused_parameters=True)
+        self.optimizer = torch.optim.Adam(self.model.parameters(), lr=lr)
+        self.loss_fn = nn.CrossEntropyLoss()
+        self.checkpoint_path = checkpoint_path
+        self.accumulation_steps = max(1, accumulation_steps)
+        self.batch_size = batch_size
+        self.seed = seed
+        self.train_set, self.val_set = train_set, val_set
+        self.checkpoints = checkpoints
+        self.vocab = vocab
+        self.vocab_hash = vocab.hash if vocab is not None else None
+        self.patience = patience
+        self.min_delta = min_delta
+        self.start_epoch = 0
+        self.best_loss = math.inf
+        self.bad_epochs = 0
+        self.history = []
+
+        self.loader_args = {"num_workers": workers, "pin_memory": self.device.type == "cuda"}
+        if workers > 0:
+            self.loader_args["prefetch_factor"] = prefetch
+        self.build_loaders()
+
+    def wrap(self, model):
+        return model
+
+    def build_loaders(self):
+        loader_args = dict(self.loader_args, batch_size=self.batch_size,
+                           persistent_workers=self.loader_args["num_workers"] > 0)
+        # DistributedSampler shuffles with the same seed everywhere and hands each process its own shard
+        if self.world_size > 1:
+            self.train_sampler = DistributedSampler(self.train_set, self.world_size, self.rank, shuffle=True,
+                                                    seed=self.seed)
+        else:
+            self.shuffle_generator = torch.Generator()
+            self.train_sampler = RandomSampler(self.train_set, generator=self.shuffle_generator)
+        # the loaders get generators of their own, so starting their workers never draws from the global RNG
+        self.train_loader = DataLoader(self.train_set, sampler=self.train_sampler,
+                                       generator=torch.Generator().manual_seed(self.seed), **loader_args)
+        # every validation window is scored exactly once, including the last partial batch
+        val_shard = Subset(self.val_set, range(self.rank, len(self.val_set), self.world_size))
+        self.val_loader = DataLoader(val_shard, shuffle=False, generator=torch.Generator().manual_seed(self.seed),
+                                     **loader_args)
+
+    def train_batches(self, epoch):
+        # the shuffle depends on the seed and epoch only, so a resumed run repeats it
+        if isinstance(self.train_sampler, DistributedSampler):
+            self.train_sampler.set_epoch(epoch)
+        else:
+            self.shuffle_generator.manual_seed(self.seed + epoch)
+        return self.train_loader
+
+    def val_batches(self):
+        return self.val_loader
+
+    def batch_loss(self, features, targets):
+        """(mean loss, number of loss terms) of a training batch"""
+        return self.loss_fn(self.model(features), targets), len(targets)
+
+    def val_loss(self, features, targets):
+        """(summed loss, number of loss terms) of a validation batch"""
+        logits = self.module(features)
+        return nn.functional.cross_entropy(logits, targets, reduction="sum").item(), len(targets)
+
+    def log(self, message):
+        if self.rank == 0:
+            print(message)
+
+    def train_epoch(self, epoch):
+        """(mean train loss, samples/sec) over every process, a sample being one loss term"""
+        self.model.train()
+        total_loss = samples = 0.0
+        batches = self.train_batches(epoch)
+        count = len(batches)
+        start = time.perf_counter()
+        self.optimizer.zero_grad()
+        for i, (features, targets) in enumerate(tqdm(batches, disable=self.rank != 0, leave=False)):
+            features = features.to(self.device, non_blocking=True)
+            targets = targets.to(self.device, non_blocking=True)
+            group_start = i - i % self.accumulation_steps
+            group_size = min(self.accumulation_steps, count - group_start)
+            step = i == group_start + group_size - 1
+            # DDP only needs to all-reduce the gradients of the batch that ends an accumulation group
+            sync = self.model.no_sync() if self.world_size > 1 and not step else contextlib.nullcontext()
+            with sync:
+                loss, terms = self.batch_loss(features, targets)
+                (loss / group_size).backward()
+            if step:
+                self.optimizer.step()
+                self.optimizer.zero_grad()
+            total_loss += loss.item() * terms
+            samples += terms
+        elapsed = time.perf_counter() - start
+        total_loss, samples, elapsed = _all_reduce(total_loss, samples, elapsed)
+        return total_loss / max(samples, 1), samples / (elapsed / self.world_size)
+
+    def validate(self):
+        """mean loss over the whole validation set"""
+        # the unwrapped module, shards can differ by one batch and need no DDP sync
+        self.module.eval()
+        total_loss = samples = 0.0
+        with torch.no_grad():
+            for features, targets in self.val_batches():
+                loss, terms = self.val_loss(features.to(self.device), targets.to(self.device))
+                total_loss += loss
+                samples += terms
+        total_loss, samples = _all_reduce(total_loss, samples)
+        return total_loss / samples if samples else math.nan
+
+    def state(self, epoch):
+        return {
+            "model": self.network.state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+            "epoch": epoch,  # epochs completed
+            "rng": rng_state(),
+            "vocab_hash": self.vocab_hash,
+            "best_loss": self.best_loss,
+            "bad_epochs": self.bad_epochs,
+            "history": self.history,
+        }
+
+    def resume(self, checkpoint):
+        """Continues from a state() checkpoint, with the epoch after it"""
+        if self.vocab_hash and checkpoint.get("vocab_hash") not in (None, self.vocab_hash):
+            raise ValueError("The checkpoint was trained on a different vocabulary, "
+                             "start over with --fresh or use the matching map")
+        self.network.load_state_dict(checkpoint["model"])
+        self.optimizer.load_state_dict(checkpoint["optimizer"])
+        set_rng_state(checkpoint["rng"])
+        self.start_epoch = checkpoint["epoch"]
+        self.best_loss = checkpoint["best_loss"]
+        self.bad_epochs = checkpoint["bad_epochs"]
+        self.history = list(checkpoint["history"])
+        self.log(f"resumed after epoch {self.start_epoch} (best vald loss {self.best_loss:.4f})")
+
+    def save(self, epoch, vald_loss, improved):
+        if self.rank != 0:
+            return
+        if improved:
+            atomic_save(self.network.state_dict(), self.checkpoint_path)
+            if self.vocab is not None:
+                self.vocab.save_hash(self.checkpoint_path)
+        if self.checkpoints is not None:
+            self.checkpoints.save(self.state(epoch + 1), epoch + 1, vald_loss)
+
+    def stopped(self):
+        return self.patience > 0 and self.bad_epochs >= self.patience
+
+    def fit(self, epochs):
+        """Trains up to epoch number epochs (counting the ones resumed from), returns
+        the per-epoch (train loss, validation loss)"""
+        for epoch in range(self.start_epoch, epochs):
+            if self.stopped():
+                self.log(f"stopping early, no better vald loss in {self.bad_epochs} epochs")
+                break
+            train_loss, throughput = self.train_epoch(epoch)
+            vald_loss = self.validate()
+            # without a validation split the latest weights count as the best
+            improved = math.isnan(vald_loss) or vald_loss < self.best_loss - self.min_delta
+            if improved:
+                self.best_loss, self.bad_epochs = vald_loss, 0
+            else:
+                self.bad_epochs += 1
+            self.history.append((train_loss, vald_loss))
+            self.save(epoch, vald_loss, improved)
+            self.log(f"epoch {epoch + 1}: train loss {train_loss:.4f} | vald loss {vald_loss:.4f}"
+                     f"{' (best)' if improved else ''} | {throughput:.0f} samples/sec")
+        return self.history
+
+
+def run(build_model, dataset, checkpoint_path, args, map_path=None):
+    """Splits dataset into train/validation and trains build_model() on it as set
+    by the add_arguments options, the entry point of the training scripts. The
+    model is built after seeding, so its initial weights depend on --seed only.
+    Resumes the latest checkpoint unless --fresh."""
+    rank, world_size = setup_distributed()
+    torch.manual_seed(args.seed)
+    model = build_model()
+    local_processes = int(os.environ.get("LOCAL_WORLD_SIZE", world_size))
+    torch.set_num_threads(args.threads or max(1, (os.cpu_count() or 1) // local_processes))
+    checkpoint_path = args.checkpoint or checkpoint_path
+    checkpoints = CheckpointManager(args.checkpoint_dir or os.path.join(os.path.dirname(checkpoint_path), "checkpoints"),
+                                    args.keep)
+    if args.fresh and rank == 0:
+        checkpoints.clear()
+    options = {"lr": args.lr, "batch_size": args.batch_size, "accumulation_steps": args.accumulation_steps,
+               "workers": args.workers, "prefetch": args.prefetch, "seed": args.seed,
+               "checkpoints": checkpoints, "vocab": Vocabulary.load(map_path) if map_path else None,
+               "patience": args.patience, "min_delta": args.min_delta}
+    if args.bptt:
+        from training.tbptt import TBPTTTrainer
+        tokens = dataset.encoded
+        cut = int(len(tokens) * (1 - args.val_fraction))
+        if rank == 0:
+            print(f"{cut} training and {len(tokens) - cut} validation tokens in chunks of {args.bptt} "
+                  f"on {world_size} process(es)")
+        trainer = TBPTTTrainer(model, tokens[:cut], tokens[cut:], checkpoint_path, bptt=args.bptt, **options)
+    else:
+        train_set, val_set = dataset.split(1 - args.val_fraction)
+        if rank == 0:
+            print(f"{len(train_set)} training and {len(val_set)} validation windows on {world_size} process(es)")
+        trainer = Trainer(model, train_set, val_set, checkpoint_path, **options)
+    checkpoint = None if args.fresh else checkpoints.load()
+    if checkpoint is not None:
+        trainer.resume(checkpoint)
+    try:
+        return trainer.fit(args.epochs)
+    finally:
+        if dist.is_initialized():
+            dist.destroy_process_group()
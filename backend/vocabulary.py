@@ -0,0 +1,111 @@
+'''Token vocabularies of the generators (Final_Final/map.json, drum/drum_map.json).
+
+A Vocabulary is loaded once per generator and holds the id -> token table as an
+array and the token -> id table as sorted key/id arrays, so whole sequences are
+encoded with one binary search per token and decoded with one fancy index. It
+also names the special ids (pad, end, hold) instead of patching extra tokens
+into the mapping.
+
+Trained weights record the hash of their vocabulary next to them
+(model.pth -> model.vocab.json). Generators refuse weights whose recorded hash
+differs from the map they are given.'''
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def vocab_path(model_path):
+    """model.pth, model.quantized.pt or model.numpy.npz -> model.vocab.json"""
+    root, _ = os.path.splitext(model_path)
+    for backend in ("numpy", "quantized", "torchscript"):
+        if root.endswith(f".{backend}"):
+            root = root[:-len(backend) - 1]
+    return f"{root}.vocab.json"
+
+
+class Vocabulary:
+    """token <-> id tables of a mapping whose ids are 0..len-1
+
+    :param pad (str): token the seed window is left-padded with
+    :param end (str): token that ends a generation
+    :param hold (str): token that holds the previous note or leaves a step empty
+    """
+
+    def __init__(self, mapping, pad=None, end=None, hold=None):
+        if sorted(mapping.values()) != list(range(len(mapping))):
+            raise ValueError("Vocabulary ids must be 0..n-1, each used once")
+        self.mapping = dict(mapping)
+        self.tokens = np.empty(len(mapping), dtype=object)
+        for token, index in mapping.items():
+            self.tokens[index] = token
+        self.reverse_mapping = dict(enumerate(self.tokens.tolist()))
+        self._keys = np.array(sorted(mapping), dtype=str)
+        self._ids = np.array([mapping[key] for key in self._keys], dtype=np.int64)
+        missing = [token for token in (pad, end, hold) if token is not None and token not in mapping]
+        if missing:
+            raise ValueError(f"The vocabulary has no {missing[0]!r} token")
+        self.pad_id = mapping.get(pad)
+        self.end_id = mapping.get(end)
+        self.hold_id = mapping.get(hold)
+        # independent of key order and json formatting, so a re-saved map keeps its hash
+        self.hash = hashlib.sha256(json.dumps(self.mapping, sort_keys=True).encode()).hexdigest()
+
+    @classmethod
+    def load(cls, map_path, **special):
+        with open(map_path, "r") as f:
+            return cls(json.load(f), **special)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __contains__(self, token):
+        return token in self.mapping
+
+    def id(self, token):
+        try:
+            return self.mapping[token]
+        except KeyError:
+            raise KeyError(f"{token!r} is not in the vocabulary") from None
+
+    def token(self, index):
+        return self.reverse_mapping[index]
+
+    def encode(self, tokens, dtype=np.int64):
+        """Token strings -> id array
+
+        :param tokens (sequence of str or np.ndarray of str):
+        :raises KeyError: for a token that is not in the vocabulary
+        """
+        tokens = np.asarray(tokens, dtype=str)
+        if tokens.size == 0:
+            return np.empty(0, dtype=dtype)
+        index = np.minimum(np.searchsorted(self._keys, tokens), len(self._keys) - 1)
+        unknown = self._keys[index] != tokens
+        if unknown.any():
+            raise KeyError(f"{tokens[unknown][0]!r} is not in the vocabulary")
+        return self._ids[index].astype(dtype, copy=False)
+
+    def decode(self, ids):
+        """ids (any int sequence or array) -> list of token strings"""
+        return self.tokens[np.asarray(ids, dtype=np.int64)].tolist()
+
+    def save_hash(self, model_path):
+        """Records this vocabulary as the one the weights at model_path were trained on"""
+        path = vocab_path(model_path)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({"vocab_hash": self.hash, "size": len(self)}, f, indent=4)
+        os.replace(f"{path}.tmp", path)
+
+    def check(self, model_path):
+        """Raises ValueError when the weights at model_path were trained on another
+        vocabulary, weights without a record are accepted"""
+        path = vocab_path(model_path)
+        if not os.path.exists(path):
+            return
+        with open(path, "r") as f:
+            recorded = json.load(f)["vocab_hash"]
+        if recorded != self.hash:
+            raise ValueError(f"{model_path} was trained on a different vocabulary than this map "
+                             f"({recorded[:12]} != {self.hash[:12]})")